@@ -1,12 +1,37 @@
 import os
 import logging
-from typing import List, Tuple, Optional
+import threading
+from collections import OrderedDict
+from typing import Any, List, Tuple, Optional
 
 
 logger = logging.getLogger("ROBOTY.mesh_loader")
 
-# Кэш для загруженных мешей
-_mesh_cache = {}
+# Кэш для загруженных мешей и определений руки (LRU по ключу путь+масштаб)
+_mesh_cache: "OrderedDict[str, Any]" = OrderedDict()
+# Сколько последних файлов держать в кэше: повторные визуализации с теми же
+# моделями не разбирают файлы заново, а память остаётся ограниченной
+_MESH_CACHE_SIZE = 8
+# Меши и определения руки загружаются параллельно из пула show_all_visualizations
+_mesh_cache_lock = threading.Lock()
+
+
+def _cache_get(key: str) -> Any:
+    """Значение из кэша (None, если нет); найденный ключ становится самым свежим."""
+    with _mesh_cache_lock:
+        value = _mesh_cache.get(key)
+        if value is not None:
+            _mesh_cache.move_to_end(key)
+        return value
+
+
+def _cache_put(key: str, value: Any) -> None:
+    """Кладёт значение в кэш, вытесняя самые давно использованные записи."""
+    with _mesh_cache_lock:
+        _mesh_cache[key] = value
+        _mesh_cache.move_to_end(key)
+        while len(_mesh_cache) > _MESH_CACHE_SIZE:
+            _mesh_cache.popitem(last=False)
 
 
 def load_obj(filepath: str, scale: float = 1.0) -> Optional[Tuple[List[float], List[float], List[float], List[int], List[int], List[int]]]:
@@ -16,10 +41,11 @@ def load_obj(filepath: str, scale: float = 1.0) -> Optional[Tuple[List[float], L
     Использует кэширование для ускорения повторных загрузок.
     """
     # Проверяем кэш
-    cache_key = f"{filepath}_{scale}"
-    if cache_key in _mesh_cache:
+    cache_key = f"{filepath}_{float(scale)}"
+    cached = _cache_get(cache_key)
+    if cached is not None:
         logger.info(f"Используем кэшированный меш: {filepath}")
-        return _mesh_cache[cache_key]
+        return cached
     
     try:
         if not os.path.isfile(filepath):
@@ -66,7 +92,7 @@ def load_obj(filepath: str, scale: float = 1.0) -> Optional[Tuple[List[float], L
         result = (xs, ys, zs, is_, js_, ks_)
         
         # Сохраняем в кэш
-        _mesh_cache[cache_key] = result
+        _cache_put(cache_key, result)
         
         logger.info(f"OBJ загружен и кэширован: {filepath}, вершин={len(vertices)}, треугольников={len(faces)}")
         return result
@@ -78,7 +104,8 @@ def load_obj(filepath: str, scale: float = 1.0) -> Optional[Tuple[List[float], L
 def clear_mesh_cache():
     """Очищает кэш загруженных мешей для освобождения памяти"""
     global _mesh_cache
-    _mesh_cache.clear()
+    with _mesh_cache_lock:
+        _mesh_cache.clear()
     logger.info("Кэш мешей очищен")
 
 
@@ -119,7 +146,12 @@ def load_hand_definition(filepath: str, scale: float = 1.0) -> Optional[dict]:
       { 'vertices': [(x,y,z), ...], 'segments': [ (i1, i2), ... ], 'points': [i, ...] }
     Индексы конвертируются в пары сегментов по соседним вершинам линии.
     Масштаб применяется к координатам.
+    Результат кэшируется вместе с мешами и только читается вызывающими.
     """
+    cache_key = f"hand:{filepath}_{float(scale)}"
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
     try:
         if not os.path.isfile(filepath):
             logger.warning(f"Файл определения руки не найден: {filepath}")
@@ -166,7 +198,9 @@ def load_hand_definition(filepath: str, scale: float = 1.0) -> Optional[dict]:
             for a, b in zip(poly[:-1], poly[1:]):
                 segments.append((a, b))
         logger.info(f"Hand definition загружен: {filepath}, вершин={len(vertices)}, сегментов={len(segments)}, точек={len(points)}")
-        return { 'vertices': vertices, 'segments': segments, 'points': points }
+        result = { 'vertices': vertices, 'segments': segments, 'points': points }
+        _cache_put(cache_key, result)
+        return result
     except Exception as e:
         logger.error(f"Ошибка чтения hand definition {filepath}: {e}")
         return None
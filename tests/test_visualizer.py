@@ -0,0 +1,949 @@
+"""
+Тесты для вспомогательных функций модуля визуализации.
+"""
+import base64
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+import numpy as np
+from viz import visualizer
+from viz.visualizer import (
+    _collect_base_markers, _normalize_plan, create_3d_visualization, create_2d_projection,
+    _lttb_indices, _lttb_indices_np, _rdp_indices, _write_html, _interp_xyz_many,
+    _robot_traj, create_3d_animation, _arm_segments, _arm_segments_cached,
+    _oriented_box_corners, _oriented_box_corners_np, _cubes_edges, _object_edge_traces, _carry_table, _carriers_at_many,
+    _speeds,
+    _plotly_payload, _browser_command, show_all_visualizations, show_visualization
+)
+
+
+def _trajectory(points):
+    """Строит траекторию в формате плана из кортежей (t, x, y, z)"""
+    return [{"t": t, "x": x, "y": y, "z": z} for t, x, y, z in points]
+
+
+def _frame_array(value):
+    """Массив кадра: typed array plotly.js ({"dtype", "bdata"}) -> numpy"""
+    if isinstance(value, dict):
+        return np.frombuffer(base64.b64decode(value["bdata"]), dtype=value["dtype"])
+    return np.asarray(value)
+
+
+def _rotation_matrix_reference(a, b):
+    """Эталон поворота a в b: формула Родрига в матричной форме (K, K @ K)"""
+    a = a / (np.linalg.norm(a) + 1e-12)
+    b = b / (np.linalg.norm(b) + 1e-12)
+    v = np.cross(a, b)
+    c = float(np.dot(a, b))
+    s = float(np.linalg.norm(v))
+    if s < 1e-12:
+        if c > 0.999999:
+            return np.eye(3)
+        # Противоположные: поворот на 180° вокруг оси, ортогональной a (R = I + 2*K^2)
+        ref = np.array([1.0, 0.0, 0.0]) if abs(a[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
+        v = np.cross(a, ref)
+        v = v / (np.linalg.norm(v) + 1e-12)
+        K = np.array([[0, -v[2], v[1]], [v[2], 0, -v[0]], [-v[1], v[0], 0]], dtype=float)
+        return np.eye(3) + 2.0 * (K @ K)
+    K = np.array([[0, -v[2], v[1]], [v[2], 0, -v[0]], [-v[1], v[0], 0]], dtype=float)
+    return np.eye(3) + K + K @ K * ((1 - c) / (s * s + 1e-12))
+
+
+class TestNormalizePlan(unittest.TestCase):
+    """Тесты для перевода траекторий плана в массивы"""
+
+    def test_xyzt_columns(self):
+        """Тест порядка столбцов x, y, z, t"""
+        plan = {"robots": [{"id": 7, "base_xyz": [1, 2, 3], "tool_clearance": 0.1,
+                            "trajectory": _trajectory([(0.0, 1.0, 2.0, 3.0), (0.5, 4.0, 5.0, 6.0)])}]}
+        traj = _normalize_plan(plan)[0]
+        self.assertEqual(traj.id, 7)
+        self.assertEqual(traj.xyzt.shape, (2, 4))
+        self.assertEqual(traj.xyzt[1].tolist(), [4.0, 5.0, 6.0, 0.5])
+        self.assertEqual(traj.ts.tolist(), [0.0, 0.5])
+        self.assertTrue(traj.ts.flags.c_contiguous)
+        self.assertEqual(traj.base_xyz.tolist(), [1.0, 2.0, 3.0])
+        self.assertFalse(traj.default_base)
+
+    def test_empty_trajectory_and_plan_untouched(self):
+        """Тест пустой траектории и неизменности плана"""
+        robot = {"id": 1, "trajectory": []}
+        traj = _normalize_plan({"robots": [robot]})[0]
+        self.assertEqual(traj.xyzt.shape, (0, 4))
+        self.assertTrue(traj.default_base)
+        self.assertEqual(robot, {"id": 1, "trajectory": []})
+
+
+class TestInterpolation(unittest.TestCase):
+    """Тесты для интерполяции TCP по массиву траектории"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.trajectory = _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 2.0, 3.0),
+                                       (1.0, 1.0, 2.0, 3.0), (3.0, 5.0, 2.0, -1.0)])
+        self.xyzt = _robot_traj({"trajectory": self.trajectory}).xyzt
+
+    def test_matches_np_interp(self):
+        """Тест: совпадение с np.interp по каждой оси (вне диапазона — крайние точки)"""
+        times = np.array([-1.0, 0.0, 0.25, 1.0, 2.0, 2.9, 3.0, 4.0])
+        expected = np.column_stack([np.interp(times, self.xyzt[:, 3], self.xyzt[:, d]) for d in range(3)])
+        np.testing.assert_allclose(_interp_xyz_many(self.xyzt, times), expected)
+        single = self.xyzt[:1]
+        np.testing.assert_array_equal(_interp_xyz_many(single, times), np.repeat(single[:, :3], len(times), axis=0))
+
+    def test_empty_trajectory(self):
+        """Тест пустой траектории"""
+        np.testing.assert_array_equal(_interp_xyz_many(np.empty((0, 4)), np.array([1.0, 2.0])), np.zeros((2, 3)))
+
+
+class TestArmSegments(unittest.TestCase):
+    """Тесты для упрощенной модели руки"""
+
+    def test_endpoints_and_cache(self):
+        """Тест: суставы от базы до TCP, близкие позы берутся из кэша"""
+        _arm_segments_cached.cache_clear()
+        joints = _arm_segments((0.0, 0.0, 0.0), (1.0, 0.0, 0.0), segments=4, bulge=0.2)
+        self.assertEqual(len(joints), 5)
+        np.testing.assert_allclose(joints[0], (0.0, 0.0, 0.0))
+        np.testing.assert_allclose(joints[-1], (1.0, 0.0, 0.0), atol=1e-12)
+        np.testing.assert_allclose(joints[2], (0.5, -0.2, 0.0), atol=1e-12)
+        _arm_segments((0.0, 0.0, 0.0), (1.0 + 1e-6, 0.0, 0.0), segments=4, bulge=0.2)
+        self.assertEqual(_arm_segments_cached.cache_info().hits, 1)
+
+    def test_straight_model(self):
+        """Тест: прямая модель — суставы равномерно на отрезке"""
+        joints = _arm_segments((0.0, 0.0, 0.0), (0.0, 0.0, 2.0), segments=4, model="straight")
+        np.testing.assert_allclose(joints, [(0.0, 0.0, z) for z in (0.0, 0.5, 1.0, 1.5, 2.0)])
+
+    def test_degenerate_arm(self):
+        """Тест: TCP в базе — два сустава"""
+        self.assertEqual(len(_arm_segments((1.0, 1.0, 1.0), (1.0, 1.0, 1.0))), 2)
+
+    @unittest.skipUnless(visualizer.NUMBA_AVAILABLE, "numba не установлен")
+    def test_numba_matches_numpy(self):
+        """Тест совпадения Numba- и NumPy-ядер суставов (в т.ч. вертикальная рука)"""
+        for model in ("curved", "double", "straight"):
+            a, off = visualizer._arm_profile(6, 0.2, model)
+            for base, tcp in (((0.0, 0.0, 0.0), (1.0, 2.0, 0.5)), ((1.0, 1.0, 0.0), (1.0, 1.0, 3.0))):
+                np.testing.assert_allclose(visualizer._arm_points_nb(*base, *tcp, a, off),
+                                           visualizer._arm_points_np(*base, *tcp, a, off), atol=1e-12)
+
+
+class TestOrientedBox(unittest.TestCase):
+    """Тесты для вершин ориентированного бокса звена"""
+
+    def test_axis_aligned_box(self):
+        """Тест: звено вдоль X — бокс [0,2] x [-0.1,0.1]^2"""
+        xs, ys, zs = _oriented_box_corners((0.0, 0.0, 0.0), (2.0, 0.0, 0.0), 0.2)
+        self.assertEqual(sorted(set(np.round(xs, 9))), [0.0, 2.0])
+        self.assertEqual(sorted(set(np.round(ys, 9))), [-0.1, 0.1])
+        self.assertEqual(sorted(set(np.round(zs, 9))), [-0.1, 0.1])
+
+    @unittest.skipUnless(visualizer.NUMBA_AVAILABLE, "numba не установлен")
+    def test_numba_matches_numpy(self):
+        """Тест совпадения Numba- и NumPy-реализаций (включая вертикальное звено)"""
+        for p1, p2 in [((0.1, 0.2, 0.3), (1.0, -0.5, 0.7)), ((1.0, 1.0, 0.0), (1.0, 1.0, 2.0))]:
+            np.testing.assert_allclose(_oriented_box_corners(p1, p2, 0.05),
+                                       _oriented_box_corners_np(*p1, *p2, 0.05))
+
+
+class TestRotationFromVectors(unittest.TestCase):
+    """Тесты для матрицы поворота вектора a в вектор b"""
+
+    def test_rotates_a_onto_b(self):
+        """Тест: R·a сонаправлен b, включая сонаправленные и противоположные векторы"""
+        a = np.array([0.0, 0.0, 1.0])
+        for b in ([0.3, -0.2, 0.5], [0.0, 0.0, 2.0], [0.0, 0.0, -1.0]):
+            b = np.asarray(b)
+            R = visualizer._rotation_matrix_from_vectors(a, b)
+            np.testing.assert_allclose(R @ a, b / np.linalg.norm(b), atol=1e-9)
+            np.testing.assert_allclose(R @ R.T, np.eye(3), atol=1e-9)
+
+    @unittest.skipUnless(visualizer.NUMBA_AVAILABLE, "numba не установлен")
+    def test_numba_matches_numpy(self):
+        """Тест совпадения Numba- и NumPy-реализаций"""
+        a = np.array([0.0, 0.0, 1.0])
+        for b in ([0.3, -0.2, 0.5], [0.0, 0.0, 2.0], [0.0, 0.0, -1.0], [1.0, 0.0, 0.0]):
+            b = np.asarray(b)
+            np.testing.assert_allclose(visualizer._rotation_matrix_from_vectors(a, b),
+                                       _rotation_matrix_reference(a, b), atol=1e-12)
+
+    def test_closed_form_matches_matrix_form(self):
+        """Тест: замкнутая форма Родрига совпадает с матричной K, K @ K"""
+        a = np.array([0.0, 0.0, 1.0])
+        for b in ([0.3, -0.2, 0.5], [0.0, 0.0, 2.0], [0.0, 0.0, -1.0], [-1.0, 2.0, 0.0]):
+            b = np.asarray(b, dtype=float)
+            np.testing.assert_allclose(np.reshape(visualizer._rotation_matrix_elems(*a, *b), (3, 3)),
+                                       _rotation_matrix_reference(a, b), atol=1e-12)
+
+
+class TestTransformMesh(unittest.TestCase):
+    def test_arrays_match_lists(self):
+        """Тест: путь для массивов float32 (Numba) совпадает с общим путём для списков"""
+        rng = np.random.default_rng(0)
+        xs, ys, zs = (rng.normal(size=50).astype(np.float32) for _ in range(3))
+        R = visualizer._rotation_matrix_from_vectors(np.array([0.0, 0.0, 1.0]), np.array([0.3, 0.2, 0.5]))
+        fast = visualizer._transform_mesh_vertices(xs, ys, zs, R, (0.5, -1.0, 2.0))
+        reference = visualizer._transform_mesh_vertices(list(xs), list(ys), list(zs), R, (0.5, -1.0, 2.0))
+        for a, b in zip(fast, reference):
+            self.assertEqual(a.dtype, np.float32)
+            np.testing.assert_allclose(a, b, rtol=1e-6)
+
+
+class TestArmMesh(unittest.TestCase):
+    @unittest.skipUnless(visualizer.NUMBA_AVAILABLE, "numba не установлен")
+    def test_kernel_matches_numpy(self):
+        """Тест: ядро Numba даёт те же вершины и индексы, что и сборка из отдельных мешей"""
+        for tcp in [(1.0, 0.5, 0.7), (0.0, 0.0, 1.0)]:
+            joints = _arm_segments((0.0, 0.0, 0.0), tcp, segments=5, bulge=0.18, model="curved")
+            for realistic in (False, True):
+                for details in (False, True):
+                    fast = visualizer._arm_mesh(joints, tcp, 0.06, realistic, details, "red")
+                    reference = visualizer._arm_mesh_np(joints, tcp, 0.06, realistic, details, "red")
+                    for key in "xyzijk":
+                        np.testing.assert_allclose(fast[key], reference[key], rtol=1e-6)
+                    self.assertEqual(fast["opacity"], reference["opacity"])
+
+    def test_degenerate_arm(self):
+        """Тест: рука нулевой длины собирается без ошибок, индексы в пределах вершин"""
+        mesh = visualizer._arm_mesh(((1.0, 1.0, 1.0), (1.0, 1.0, 1.0)), (1.0, 1.0, 1.0), 0.06, True, True, "red")
+        self.assertLess(max(max(mesh["i"]), max(mesh["j"]), max(mesh["k"])), len(mesh["x"]))
+
+
+def _cube_edges_reference(center, size):
+    """Эталон рёбер одного куба: пары вершин по _CUBE_EDGE_PAIRS, после каждого ребра NaN"""
+    v = np.array(visualizer._CUBE_VERTEX_SIGNS, dtype=np.float64) * (size / 2.0) + np.asarray(center, dtype=np.float64)
+    pts = []
+    for a, b in visualizer._CUBE_EDGE_PAIRS:
+        pts += [v[a], v[b], (np.nan, np.nan, np.nan)]
+    return tuple(np.array(pts, dtype=np.float32).T)
+
+
+class TestCubeEdges(unittest.TestCase):
+    """Тесты для рёбер куба объектов"""
+
+    def test_edges_around_center(self):
+        """Тест: 12 рёбер с NaN-разделителями вокруг центра"""
+        xs, ys, zs = _cubes_edges([(1.0, 2.0, 3.0)], [0.5])
+        self.assertEqual(len(xs), 36)
+        self.assertEqual(int(np.isnan(xs).sum()), 12)
+        self.assertTrue(np.all(np.isnan(xs[2::3])))
+        self.assertEqual(np.unique(xs[~np.isnan(xs)]).tolist(), [0.75, 1.25])
+        self.assertEqual(np.unique(zs[~np.isnan(zs)]).tolist(), [2.75, 3.25])
+        # Смещение центра не влияет на шаблон того же размера
+        xs2, _, _ = _cubes_edges([(0.0, 0.0, 0.0)], [0.5])
+        self.assertEqual(np.unique(xs2[~np.isnan(xs2)]).tolist(), [-0.25, 0.25])
+
+    def test_batch_matches_single(self):
+        """Тест: рёбра нескольких кубов одним вызовом совпадают с поштучным эталоном"""
+        centers = [(0.0, 0.0, 0.0), (1.0, -2.0, 0.5), (3.0, 1.0, 2.0)]
+        sizes = [0.1, 0.25, 1.0]
+        batch = _cubes_edges(centers, sizes)
+        for k, (center, size) in enumerate(zip(centers, sizes)):
+            for got, ref in zip(batch, _cube_edges_reference(center, size)):
+                np.testing.assert_array_equal(got[36 * k:36 * (k + 1)], ref)
+
+    def test_objects_merged_by_color(self):
+        """Тест: кубы одного цвета склеиваются в один след"""
+        objects = [
+            {"id": 1, "size": 0.1, "initial_position": [0, 0, 0]},
+            {"id": 2, "size": 0.2, "initial_position": [1, 1, 1]},
+            {"id": 3, "size": 0.1, "initial_position": [2, 0, 0], "color": "blue"},
+            {"id": 4, "type": "sphere"},
+        ]
+        traces = _object_edge_traces(objects, width=4)
+        self.assertEqual([(t["name"], t["line"]["color"], len(t["x"])) for t in traces],
+                         [("Objects", "red", 72), ("Object 3", "blue", 36)])
+        np.testing.assert_array_equal(traces[0]["x"][36:], _cube_edges_reference((1, 1, 1), 0.2)[0])
+
+
+class TestSpeeds(unittest.TestCase):
+    """Тесты для скорости TCP в анализе времени"""
+
+    def test_speeds(self):
+        """Тест: первая точка и нулевой шаг по времени дают 0"""
+        xyzt = np.array([[0.0, 0.0, 0.0, 0.0], [3.0, 4.0, 0.0, 1.0], [3.0, 4.0, 2.0, 1.0], [3.0, 4.0, 4.0, 3.0]])
+        np.testing.assert_allclose(_speeds(xyzt), [0.0, 5.0, 0.0, 1.0])
+
+
+class TestBaseMarkers(unittest.TestCase):
+    """Тесты для агрегированных маркеров баз роботов"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.colors = ['blue', 'red', 'green']
+        self.far = _trajectory([(0.0, 5.0, 5.0, 5.0), (1.0, 6.0, 6.0, 6.0)])
+        self.near = _trajectory([(0.0, 0.1, 0.0, 0.0), (1.0, 1.0, 1.0, 1.0)])
+
+    def test_duplicate_bases_merged(self):
+        """Тест объединения совпадающих баз"""
+        robots = [
+            {"id": 1, "base_xyz": [1, 2, 0], "trajectory": self.far},
+            {"id": 2, "base_xyz": [1, 2, 0], "trajectory": self.far},
+            {"id": 3, "base_xyz": [0, 0, 0], "trajectory": self.far},
+        ]
+        positions, colors, labels = _collect_base_markers(_normalize_plan({"robots": robots}), self.colors)
+        self.assertEqual(positions, [(1.0, 2.0, 0.0), (0.0, 0.0, 0.0)])
+        self.assertEqual(colors, ['blue', 'green'])
+        self.assertEqual(labels, ["Base 1, 2", "Base 3"])
+
+    def test_default_base_culled_far_from_origin(self):
+        """Тест отбрасывания базы по умолчанию вдали от траекторий"""
+        robots = [{"id": 1, "trajectory": self.far}]
+        positions, _, _ = _collect_base_markers(_normalize_plan({"robots": robots}), self.colors)
+        self.assertEqual(positions, [])
+
+    def test_default_base_kept_near_origin(self):
+        """Тест сохранения базы по умолчанию рядом с траекторией"""
+        robots = [{"id": 1, "trajectory": self.near}]
+        positions, _, _ = _collect_base_markers(_normalize_plan({"robots": robots}), self.colors)
+        self.assertEqual(positions, [(0.0, 0.0, 0.0)])
+
+    def test_robot_without_trajectory_skipped(self):
+        """Тест пропуска робота без траектории"""
+        robots = [{"id": 1, "base_xyz": [1, 1, 1], "trajectory": []}]
+        positions, _, _ = _collect_base_markers(_normalize_plan({"robots": robots}), self.colors)
+        self.assertEqual(positions, [])
+
+    def test_single_base_trace_per_figure(self):
+        """Тест одного следа баз на фигуру"""
+        plan = {
+            "robots": [
+                {"id": 1, "base_xyz": [0, 0, 0], "trajectory": self.near},
+                {"id": 2, "base_xyz": [0, 1, 0], "trajectory": self.far},
+            ],
+            "makespan": 1.0,
+        }
+        for fig in (create_3d_visualization(plan), create_2d_projection(plan, "xy")):
+            bases = [tr for tr in fig.data if tr.name == "Bases"]
+            self.assertEqual(len(bases), 1)
+            self.assertEqual(len(bases[0].x), 2)
+
+
+class TestSafetyZones(unittest.TestCase):
+    """Тесты для зон безопасности в 3D визуализации"""
+
+    def test_single_trace(self):
+        """Тест: один след на все зоны, по три точки на робота"""
+        traj = _trajectory([(float(t), float(t), 0.0, 0.0) for t in range(5)])
+        plan = {"robots": [{"id": 1, "tool_clearance": 0.1, "trajectory": traj},
+                           {"id": 2, "tool_clearance": 0.2, "trajectory": traj},
+                           {"id": 3, "tool_clearance": 0.0, "trajectory": traj}]}
+        zones = [tr for tr in create_3d_visualization(plan).data if tr.name == "Safety zones"]
+        self.assertEqual(len(zones), 1)
+        self.assertEqual(list(zones[0].x), [0.0, 2.0, 4.0, 0.0, 2.0, 4.0])
+        self.assertEqual(list(zones[0].text), ["Safety zone 1"] * 3 + ["Safety zone 2"] * 3)
+
+
+class TestLTTB(unittest.TestCase):
+    """Тесты для прореживания траекторий LTTB"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        rng = np.random.default_rng(42)
+        self.pts = np.cumsum(rng.normal(size=(1000, 3)), axis=0)
+
+    def test_keeps_endpoints_and_size(self):
+        """Тест сохранения крайних точек и размера выборки"""
+        idx = _lttb_indices(self.pts, 100)
+        self.assertEqual(len(idx), 100)
+        self.assertEqual(idx[0], 0)
+        self.assertEqual(idx[-1], 999)
+        self.assertTrue(np.all(np.diff(idx) > 0))
+
+    def test_short_input_untouched(self):
+        """Тест: короткие траектории не прореживаются"""
+        idx = _lttb_indices(self.pts[:50], 100)
+        self.assertEqual(idx.tolist(), list(range(50)))
+
+    def test_picks_spike(self):
+        """Тест: выброс попадает в выборку"""
+        pts = np.zeros((200, 2))
+        pts[:, 0] = np.arange(200)
+        pts[137, 1] = 10.0
+        self.assertIn(137, _lttb_indices(pts, 20).tolist())
+
+    @unittest.skipUnless(visualizer.NUMBA_AVAILABLE, "numba не установлен")
+    def test_numba_matches_numpy(self):
+        """Тест совпадения Numba- и NumPy-реализаций"""
+        np.testing.assert_array_equal(_lttb_indices(self.pts, 100), _lttb_indices_np(self.pts, 100))
+
+
+class TestRDP(unittest.TestCase):
+    """Тесты для упрощения траекторий Рамера–Дугласа–Пекера"""
+
+    def test_collinear_reduced_to_endpoints(self):
+        """Тест: точки на прямой выбрасываются"""
+        pts = np.linspace(0.0, 1.0, 100)[:, None] * np.array([1.0, 2.0, 3.0])
+        self.assertEqual(_rdp_indices(pts, 1e-6).tolist(), [0, 99])
+
+    def test_keeps_turnaround(self):
+        """Тест: точка разворота на пути «туда и обратно» сохраняется"""
+        x = np.r_[np.linspace(0.0, 1.0, 50), np.linspace(1.0, 0.5, 50)]
+        pts = np.column_stack([x, np.zeros(100), np.zeros(100)])
+        self.assertEqual(_rdp_indices(pts, 1e-6).tolist(), [0, 49, 99])
+
+    def test_within_tolerance(self):
+        """Тест: выброшенные точки не дальше eps от упрощённой ломаной"""
+        rng = np.random.default_rng(7)
+        pts = np.cumsum(rng.normal(size=(300, 2)), axis=0)
+        idx = _rdp_indices(pts, 0.5)
+        for a, b in zip(idx[:-1], idx[1:]):
+            d = pts[a:b + 1] - pts[a]
+            ab = pts[b] - pts[a]
+            d -= np.clip(d @ ab / (ab @ ab), 0.0, 1.0)[:, None] * ab
+            self.assertLessEqual(np.linalg.norm(d, axis=1).max(), 0.5 + 1e-12)
+
+    def test_disabled(self):
+        """Тест: eps=0 оставляет все точки"""
+        self.assertEqual(_rdp_indices(np.zeros((5, 3)), 0.0).tolist(), list(range(5)))
+
+
+class TestDensityPath(unittest.TestCase):
+    """Тесты для растрового пути Datashader в 2D-проекции"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        pts = [(float(t), float(np.cos(t)), 0.0, float(np.sin(t))) for t in np.linspace(0, 10, 500)]
+        self.plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0], "trajectory": _trajectory(pts)}]}
+
+    def test_below_threshold_no_image(self):
+        """Тест: обычный путь без растра"""
+        fig = create_2d_projection(self.plan, "xz")
+        self.assertEqual(len(fig.layout.images), 0)
+
+    @unittest.skipUnless(visualizer.DATASHADER_AVAILABLE, "datashader не установлен")
+    def test_above_threshold_adds_image(self):
+        """Тест: растр под осями и тонкие линии поверх"""
+        fig = create_2d_projection({**self.plan, "datashader_threshold": 100}, "xz")
+        self.assertEqual(len(fig.layout.images), 1)
+        self.assertEqual(fig.layout.images[0].layer, "below")
+        self.assertEqual(fig.data[0].mode, "lines")
+
+
+class TestCarryTable(unittest.TestCase):
+    """Тесты для поиска носителя объекта по времени"""
+
+    def test_schedule_handoff(self):
+        """Тест: передача между роботами, на стыке — предыдущий носитель"""
+        table = _carry_table({"carry_schedule": [
+            {"by": 2, "interval": [2.0, 4.0]},
+            {"by": 1, "interval": [0.0, 2.0]},
+            {"by": None, "interval": [5.0, 6.0]},
+        ]})
+        carriers = _carriers_at_many(table, [-1.0, 0.0, 1.0, 2.0, 3.0, 4.0, 5.5])
+        self.assertEqual(carriers, [None, 1, 1, 1, 2, 2, None])
+
+    def test_carry_intervals(self):
+        """Тест: carried_by + carry_intervals и объект без переноса"""
+        table = _carry_table({"carried_by": 3, "carry_intervals": [[1, 2], [5, 6]]})
+        self.assertEqual(_carriers_at_many(table, [1.5, 3.0, 6.0]), [3, None, 3])
+        self.assertEqual(_carriers_at_many(_carry_table({"carry_intervals": [[0, 1]]}), [0.5]), [None])
+
+    def test_many_matches_scalar(self):
+        """Тест: векторный поиск носителей совпадает с линейным проходом по интервалам"""
+        table = _carry_table({"carry_schedule": [
+            {"by": 1, "interval": [0.0, 2.0]}, {"by": 2, "interval": [2.0, 4.0]}, {"by": 1, "interval": [5.0, 6.0]}]})
+        times = np.linspace(-1.0, 7.0, 33)
+        starts, ends, carriers = table
+        # Первый по началу интервал, содержащий t (на стыке — предыдущий носитель)
+        expected = [next((c for s, e, c in zip(starts, ends, carriers) if s <= t <= e), None) for t in times]
+        self.assertEqual(_carriers_at_many(table, times), expected)
+        self.assertEqual(_carriers_at_many(_carry_table({}), times[:3]), [None, None, None])
+
+
+class TestAnimation(unittest.TestCase):
+    """Тесты для 3D анимации траекторий"""
+
+    def test_frames_per_time(self):
+        """Тест: по кадру на каждую отметку времени и перенос объекта с TCP"""
+        plan = {
+            "robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                        "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0), (2.0, 1.0, 1.0, 0.0)])}],
+            "objects": [{"id": 1, "initial_position": [0, 0, 0], "size": 0.1,
+                         "carried_by": 1, "carry_intervals": [[0.5, 1.5]]}],
+        }
+        fig = create_3d_animation(plan)
+        self.assertEqual([fr.name for fr in fig.frames], ["t=0.00", "t=1.00", "t=2.00"])
+        self.assertEqual([len(_frame_array(fr.data[0].x)) for fr in fig.frames], [1, 2, 3])
+        # Кадры обновляют плейсхолдеры по индексам, а не по порядку следов фигуры
+        for fr in fig.frames:
+            self.assertEqual(len(fr.traces), len(fr.data))
+            self.assertEqual(fig.data[fr.traces[0]].name, "Robot 1")
+        carrier = [tr for tr in fig.frames[1].data if tr.name == "Carrier R1"]
+        self.assertEqual(len(carrier), 1)
+        self.assertEqual([_frame_array(carrier[0][axis])[0] for axis in "xyz"], [1.0, 0.0, 0.0])
+        self.assertFalse(any(tr.name == "Carrier R1" for tr in fig.frames[2].data))
+
+    def test_frames_keep_salient_times(self):
+        """Тест: при ограничении кадров момент перемещения попадает в кадр (LTTB по активности)"""
+        # Робот стоит, между t=12 и t=13 переходит в x=1 и снова стоит;
+        # каждый третий момент (0, 3, ..., 27) этот переход бы пропустил
+        points = [(float(t), 0.0 if t <= 12 else 1.0, 0.0, 0.0) for t in range(30)]
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0], "trajectory": _trajectory(points)}],
+                "max_anim_frames": 10}
+        fig = create_3d_animation(plan)
+        names = [fr.name for fr in fig.frames]
+        self.assertEqual(len(names), 10)
+        self.assertEqual((names[0], names[-1]), ("t=0.00", "t=29.00"))
+        self.assertIn("t=13.00", names)
+        # Шаги слайдера — те же отобранные кадры
+        self.assertEqual([step.label for step in fig.layout.sliders[0].steps], names)
+
+    def test_arm_mesh_merged_per_robot(self):
+        """Тест: звенья и детали меш-руки склеены в один Mesh3d на робота"""
+        plan = {
+            "robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                        "trajectory": _trajectory([(0.0, 1.0, 0.0, 0.5), (1.0, 0.0, 1.0, 0.5)])}],
+            "arm_mesh": True,
+        }
+        fig = create_3d_animation(plan)
+        self.assertEqual(sum(tr.type == "mesh3d" for tr in fig.data), 1)
+        meshes = [tr for tr in fig.frames[0].data if tr.type == "mesh3d"]
+        self.assertEqual(len(meshes), 1)
+        # Индексы треугольников указывают на вершины склеенного меша
+        self.assertLess(max(_frame_array(meshes[0][axis]).max() for axis in "ijk"), len(_frame_array(meshes[0].x)))
+
+    def test_arms_merged_into_one_trace(self):
+        """Тест: линии рук всех роботов — один след, цвет вершины — номер робота"""
+        plan = {"robots": [
+            {"id": 1, "base_xyz": [0, 0, 0], "trajectory": _trajectory([(0.0, 1.0, 0.0, 0.5), (1.0, 0.0, 1.0, 0.5)])},
+            {"id": 2, "base_xyz": [2, 0, 0], "trajectory": _trajectory([(0.0, 1.0, 1.0, 0.5), (1.0, 2.0, 1.0, 0.5)])},
+        ]}
+        fig = create_3d_animation(plan)
+        arm_slots = [k for k, tr in enumerate(fig.data) if tr.name == "Arms"]
+        self.assertEqual(len(arm_slots), 1)
+        self.assertEqual(len(fig.data[arm_slots[0]].line.colorscale), 2)
+        frame = fig.frames[0]
+        arms = frame.data[list(frame.traces).index(arm_slots[0])]
+        self.assertEqual(len(_frame_array(arms.x)), len(_frame_array(arms.line.color)))
+        self.assertEqual(set(_frame_array(arms.line.color).tolist()), {0, 1})
+        # Части роботов разделены NaN
+        self.assertTrue(np.isnan(_frame_array(arms.x)).any())
+
+    def test_arm_toggle_restyles_visibility(self):
+        """Тест: «Без рук» скрывает следы руки одним restyle, кадры не дублируются"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 1.0, 0.0, 0.5), (1.0, 0.0, 1.0, 0.5)])}],
+                "arm_mesh": True}
+        fig = create_3d_animation(plan)
+        self.assertEqual(len(fig.frames), 2)
+        toggle = fig.layout.updatemenus[1]
+        hide = [b for b in toggle.buttons if b.label == "Без рук"][0]
+        self.assertEqual(hide.method, "restyle")
+        self.assertEqual({fig.data[k].name for k in hide.args[1]}, {"Arms", "ArmMesh R1"})
+        self.assertEqual(hide.args[0], {"visible": False})
+
+    def test_play_without_transition(self):
+        """Тест: проигрывание перерисовывает сцену 3D без анимированного перехода"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 1.0, 0.0, 0.5), (1.0, 0.0, 1.0, 0.5)])}]}
+        fig = create_3d_animation(plan)
+        play = fig.layout.updatemenus[0].buttons[0].args[1]
+        speeds = [step.args[1] for step in fig.layout.sliders[1].steps]
+        self.assertEqual([opts["frame"]["duration"] for opts in speeds], [200, 120, 80, 60, 40, 20])
+        for opts in [play, *speeds]:
+            self.assertTrue(opts["frame"]["redraw"])
+            self.assertEqual(opts["transition"], {"duration": 0})
+
+    def test_objects_grouped_by_color(self):
+        """Тест: рёбра объектов одного цвета — один след анимации"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 1.0, 0.0, 0.5), (1.0, 0.0, 1.0, 0.5)])}],
+                "objects": [{"id": 1, "initial_position": [0, 0, 0]}, {"id": 2, "initial_position": [1, 0, 0]},
+                            {"id": 3, "initial_position": [2, 0, 0], "color": "blue"}]}
+        fig = create_3d_animation(plan)
+        slots = {tr.name: k for k, tr in enumerate(fig.data) if (tr.name or "").startswith("Object")}
+        self.assertEqual(sorted(slots), ["Object 3", "Objects"])
+        frame = fig.frames[0]
+        edges = frame.data[list(frame.traces).index(slots["Objects"])]
+        self.assertEqual(len(_frame_array(edges.x)), 72)
+
+    def test_frame_arrays_are_typed(self):
+        """Тест: координаты кадров — float32, индексы мешей — int32, уже в виде typed array"""
+        plan = {
+            "robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                        "trajectory": _trajectory([(0.0, 1.0, 0.0, 0.5), (1.0, 0.0, 1.0, 0.5)])}],
+            "arm_mesh": True,
+        }
+        fig = create_3d_animation(plan)
+        for tr in fig.frames[0].data:
+            if len(tr.x):
+                self.assertEqual(tr.x["dtype"], "f4", tr.type)
+                self.assertEqual(_frame_array(tr.x).dtype, np.float32)
+            if tr.type == "mesh3d":
+                self.assertEqual(tr.i["dtype"], "i4")
+
+
+class TestWriteHtml(unittest.TestCase):
+    """Тесты для потоковой записи HTML"""
+
+    def test_document_structure(self):
+        """Тест: полный документ с plotly.js из CDN"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 1.0, 1.0)])}]}
+        buf = io.BytesIO()
+        _write_html(create_3d_visualization(plan), buf, {"responsive": True})
+        html = buf.getvalue().decode("utf-8")
+        self.assertTrue(html.startswith("<html>"))
+        self.assertTrue(html.endswith("</html>"))
+        self.assertIn("cdn.plot.ly", html)
+        self.assertEqual(html.count("<body>"), 1)
+
+    def test_directory_plotlyjs(self):
+        """Тест: офлайн-режим ссылается на общий plotly.min.js"""
+        buf = io.BytesIO()
+        _write_html(create_3d_visualization({"robots": []}), buf, {}, include_plotlyjs="directory")
+        html = buf.getvalue().decode("utf-8")
+        self.assertIn('src="plotly.min.js"', html)
+        self.assertNotIn("cdn.plot.ly", html)
+
+    def test_plotlyjs_written_once_from_threads(self):
+        """Тест: потоки одного процесса пишут plotly.min.js под разными временными именами"""
+        with tempfile.TemporaryDirectory() as tmp:
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                list(pool.map(lambda _: visualizer._ensure_plotlyjs(tmp), range(4)))
+            self.assertEqual(os.listdir(tmp), ["plotly.min.js"])
+            with open(os.path.join(tmp, "plotly.min.js"), encoding="utf-8") as js:
+                self.assertEqual(js.read(), visualizer.get_plotlyjs())
+
+    def test_plotly_internals_missing_falls_back(self):
+        """Тест: без ожидаемых внутренних атрибутов фигуры HTML пишет pio.to_html"""
+        buf = io.BytesIO()
+        with mock.patch.object(visualizer, "_html_fragment", side_effect=AttributeError("_frame_objs")):
+            _write_html(create_3d_visualization({"robots": []}), buf, {})
+        html = buf.getvalue().decode("utf-8")
+        self.assertIn("plotly-graph-div", html)
+        self.assertTrue(html.endswith("</html>"))
+
+    def test_frame_encoding_error_rewrites_file(self):
+        """Тест: ошибка кодирования кадра посреди записи — страница и кэш заново через pio.to_html"""
+        def broken_frames(frames):
+            yield b"["
+            raise TypeError("Type is not JSON serializable")
+
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0)])}]}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "page.html")
+            cache_path = os.path.join(tmp, "cache", "page.html.gz")
+            with mock.patch.object(visualizer, "_frames_json", side_effect=broken_frames):
+                visualizer._write_html_file(create_3d_animation(plan), path, {}, cache_path=cache_path)
+            with open(path, "rb") as f:
+                page = f.read()
+            html = page.decode("utf-8")
+            self.assertEqual(html.count("<html>"), 1)
+            self.assertEqual(html.count("plotly-graph-div"), 1)
+            self.assertTrue(html.endswith("</html>"))
+            with gzip.open(cache_path, "rb") as f:
+                self.assertEqual(f.read(), page)
+            self.assertEqual(sorted(os.listdir(tmp)), ["cache", "page.html"])
+            self.assertEqual(os.listdir(os.path.join(tmp, "cache")), ["page.html.gz"])
+
+    def test_frames_written_while_encoding(self):
+        """Тест: кадры кодируются по мере записи — фрагмент не материализуется до записи"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0), (2.0, 1.0, 1.0, 0.0)])}]}
+        fig = create_3d_animation(plan)
+        buf = io.BytesIO()
+        written_at = []
+        frames_json = visualizer._frames_json
+
+        def tracked_frames(frames):
+            for chunk in frames_json(frames):
+                written_at.append(buf.tell())
+                yield chunk
+
+        with mock.patch.object(visualizer, "_frames_json", side_effect=tracked_frames):
+            _write_html(fig, buf, {})
+        # К кодированию первого кадра заголовок и начало фрагмента уже в файле,
+        # а каждый следующий кусок кодируется после записи предыдущего
+        self.assertGreater(written_at[0], 0)
+        self.assertEqual(written_at, sorted(written_at))
+        self.assertLess(written_at[0], written_at[-1])
+
+    def test_payload_matches_plotly(self):
+        """Тест: прямая сериализация кадров даёт тот же JSON, что и Plotly"""
+        plan = {"robots": [{"id": "R1", "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0), (2.0, 1.0, 1.0, 0.0)])}]}
+        fig = create_3d_animation(plan)
+        reference = json.loads(fig.to_json(validate=False))
+        payload = {"data": _plotly_payload(fig._data), "layout": _plotly_payload(fig._layout),
+                   "frames": _plotly_payload([frame._props for frame in fig._frame_objs])}
+        self.assertEqual(json.loads(visualizer._script_json(payload)), reference)
+
+    def test_frames_streamed_per_frame(self):
+        """Тест: кадры кодируются по одному и вместе дают тот же JSON-массив"""
+        plan = {"robots": [{"id": "R1", "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0), (2.0, 1.0, 1.0, 0.0)])}]}
+        fig = create_3d_animation(plan)
+        frames = [frame._props for frame in fig._frame_objs]
+        chunks = list(visualizer._frames_json(frames))
+        self.assertEqual(len(chunks), 2 * len(frames) + 1)
+        self.assertEqual(json.loads(b"".join(chunks)), json.loads(visualizer._script_json(_plotly_payload(frames))))
+
+
+class TestShowAll(unittest.TestCase):
+    def test_batch_does_not_open_browser(self):
+        """Тест: пакетное построение возвращает все фигуры и не открывает браузер"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0)])}]}
+        with mock.patch.object(visualizer, "_open_in_browser") as opener:
+            figs = show_all_visualizations(plan)
+        opener.assert_not_called()
+        self.assertEqual(sorted(figs), ["2d_xy", "2d_xz", "2d_yz", "3d", "time"])
+
+    def test_empty_views_skipped(self):
+        """Тест: без точек ничего не строится, без длительности — нет анализа времени"""
+        self.assertEqual(show_all_visualizations({"robots": []}), {})
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (0.0, 1.0, 0.0, 0.0)])}]}
+        self.assertEqual(sorted(show_all_visualizations(plan)), ["2d_xy", "2d_xz", "2d_yz", "3d"])
+
+    def test_index_opened_once(self):
+        """Тест: open_index пишет страницу index со всеми видами и открывает одну вкладку"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0)])}]}
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch("tempfile.gettempdir", return_value=tmp), \
+                mock.patch.object(visualizer, "_schedule_unlink"), \
+                mock.patch.object(visualizer, "_open_in_browser") as opener:
+            show_all_visualizations(plan, open_index=True)
+            opener.assert_called_once()
+            index_path = opener.call_args[0][0]
+            with open(index_path, encoding="utf-8") as fh:
+                page = fh.read()
+            self.assertEqual(page.count('loading="lazy"'), 5)
+            self.assertEqual(len(os.listdir(tmp)), 6)
+
+
+class TestHtmlCache(unittest.TestCase):
+    def test_same_plan_reuses_html(self):
+        """Тест: повторный показ того же плана берёт HTML из кэша без построения фигуры"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0)])}]}
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch("tempfile.gettempdir", return_value=tmp), \
+                mock.patch.object(visualizer, "_schedule_unlink") as unlink:
+            self.assertIsNotNone(show_visualization(plan, "3d_anim", open_in_browser=False))
+            self.assertEqual(len(os.listdir(os.path.join(tmp, "roboty_viz_cache"))), 1)
+            with mock.patch.object(visualizer, "create_3d_animation") as build, \
+                    mock.patch.object(visualizer, "_prepare_cached") as prepare:
+                self.assertIsNone(show_visualization(plan, "3d_anim", open_in_browser=False))
+            build.assert_not_called()
+            prepare.assert_not_called()
+            written, restored = [c[0][0] for c in unlink.call_args_list]
+            # Страница плана названа по хэшу и открывается повторно как есть
+            self.assertEqual(written, restored)
+            with open(written, "rb") as f:
+                page = f.read()
+            # Удалённая очисткой страница распаковывается из кэша под тем же именем
+            os.unlink(written)
+            with mock.patch.object(visualizer, "create_3d_animation") as build:
+                self.assertIsNone(show_visualization(plan, "3d_anim", open_in_browser=False))
+            build.assert_not_called()
+            with open(written, "rb") as f:
+                self.assertEqual(f.read(), page)
+            # По запросу фигура строится и с кэшем, но HTML повторно не пишется
+            with mock.patch.object(visualizer, "_write_html") as write:
+                self.assertIsNotNone(show_visualization(plan, "3d_anim", open_in_browser=False, return_figure=True))
+            write.assert_not_called()
+            plan["robots"][0]["base_xyz"] = [1, 0, 0]
+            self.assertIsNotNone(show_visualization(plan, "3d_anim", open_in_browser=False))
+            self.assertEqual(len(os.listdir(os.path.join(tmp, "roboty_viz_cache"))), 2)
+
+    def test_key_tracks_model_files_and_version(self):
+        """Тест: правка файла меша или смена версии формата даёт новую запись кэша"""
+        with tempfile.TemporaryDirectory() as tmp:
+            mesh_path = os.path.join(tmp, "hand.obj")
+            with open(mesh_path, "w") as fh:
+                fh.write("v 0 0 0\n")
+            plan = {"robots": [], "robot_mesh": {"path": mesh_path}}
+            path = visualizer._html_cache_path(plan, "3d_anim")
+            self.assertEqual(visualizer._html_cache_path(plan, "3d_anim"), path)
+            with open(mesh_path, "a") as fh:
+                fh.write("v 1 0 0\n")
+            self.assertNotEqual(visualizer._html_cache_path(plan, "3d_anim"), path)
+            path = visualizer._html_cache_path(plan, "3d_anim")
+            with mock.patch.object(visualizer, "_HTML_CACHE_VERSION", visualizer._HTML_CACHE_VERSION + 1):
+                self.assertNotEqual(visualizer._html_cache_path(plan, "3d_anim"), path)
+
+    def test_background_write_failure_shows_figure(self):
+        """Тест: ошибка фоновой записи HTML не теряет визуализацию — фигура показывается напрямую"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0)])}],
+                "html_cache": False}
+        pool = ThreadPoolExecutor(max_workers=1)
+        progress = []
+        with mock.patch.object(visualizer, "_io_pool", pool), \
+                mock.patch.object(visualizer, "_publish_html", side_effect=OSError("disk full")), \
+                mock.patch.object(visualizer.go.Figure, "show") as show:
+            fig = show_visualization(plan, "3d_anim", progress_callback=progress.append)
+            pool.shutdown(wait=True)
+        self.assertIsNotNone(fig)
+        show.assert_called_once()
+        self.assertNotIn(100, progress)
+
+    def test_progress_done_after_background_write(self):
+        """Тест: 100% прогресса — только после фоновой записи страницы"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0)])}],
+                "html_cache": False}
+        pool = ThreadPoolExecutor(max_workers=1)
+        progress = []
+
+        def publish(*args):
+            progress.append("written")
+
+        with mock.patch.object(visualizer, "_io_pool", pool), \
+                mock.patch.object(visualizer, "_publish_html", side_effect=publish):
+            show_visualization(plan, "3d_anim", progress_callback=progress.append)
+            pool.shutdown(wait=True)
+        self.assertEqual(progress[-2:], ["written", 100])
+
+    def test_foreground_write_raises_to_caller(self):
+        """Тест: background=False пишет HTML в вызывающем потоке, без пула"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0)])}],
+                "html_cache": False}
+        with mock.patch.object(visualizer, "_io_pool") as pool, \
+                mock.patch.object(visualizer, "_publish_html", side_effect=OSError("disk full")), \
+                mock.patch.object(visualizer.go.Figure, "show", side_effect=ValueError("no renderer")):
+            with self.assertRaises(ValueError):
+                show_visualization(plan, "3d_anim", background=False)
+        pool.submit.assert_not_called()
+
+    def test_failed_write_leaves_no_cache_entry(self):
+        """Тест: оборванная запись HTML не оставляет в кэше ни записи, ни обрывка"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0)])}]}
+        with tempfile.TemporaryDirectory() as tmp, \
+                mock.patch("tempfile.gettempdir", return_value=tmp), \
+                mock.patch.object(visualizer, "_schedule_unlink"), \
+                mock.patch.object(visualizer, "_write_html", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                show_visualization(plan, "3d_anim", open_in_browser=False)
+            self.assertEqual(os.listdir(os.path.join(tmp, "roboty_viz_cache")), [])
+            self.assertFalse([name for name in os.listdir(tmp) if name.endswith(".part")])
+
+
+class TestPreparedCache(unittest.TestCase):
+    def test_views_of_same_plan_share_prepare(self):
+        """Тест: разные виды одного плана подготавливают траектории один раз"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0)])}]}
+        visualizer._prepared_cache.clear()
+        visualizer._figure_cache.clear()
+        with mock.patch.object(visualizer, "_prepare", wraps=visualizer._prepare) as prepare:
+            show_visualization(plan, "3d")
+            show_visualization(plan, "2d_xy")
+            self.assertEqual(prepare.call_count, 1)
+            plan["robots"][0]["base_xyz"] = [1, 0, 0]
+            show_visualization(plan, "3d")
+            self.assertEqual(prepare.call_count, 2)
+
+
+class TestFigureCache(unittest.TestCase):
+    def test_same_plan_returns_copy_without_rebuild(self):
+        """Тест: повторный показ плана не строит фигуру заново и отдаёт независимую копию"""
+        plan = {"robots": [{"id": 1, "base_xyz": [0, 0, 0],
+                            "trajectory": _trajectory([(0.0, 0.0, 0.0, 0.0), (1.0, 1.0, 0.0, 0.0)])}],
+                "html_cache": False}
+        visualizer._figure_cache.clear()
+        with mock.patch.object(visualizer, "create_3d_animation", wraps=create_3d_animation) as build:
+            first = show_visualization(plan, "3d_anim", open_in_browser=False)
+            first.update_layout(title_text="changed")
+            second = show_visualization(plan, "3d_anim", open_in_browser=False)
+        self.assertEqual(build.call_count, 1)
+        self.assertIsNot(first, second)
+        self.assertNotEqual(second.layout.title.text, "changed")
+        self.assertEqual(len(second.frames), len(first.frames))
+        with mock.patch.object(visualizer, "create_3d_visualization", wraps=create_3d_visualization) as build:
+            show_visualization(plan, "3d")
+            show_visualization(plan, "3d")
+            plan["robots"][0]["base_xyz"] = [1, 0, 0]
+            show_visualization(plan, "3d")
+        self.assertEqual(build.call_count, 2)
+
+
+class TestPruneHtmlCache(unittest.TestCase):
+    def test_keeps_most_recent(self):
+        """Тест: очистка оставляет самые свежие записи кэша и не трогает чужие файлы"""
+        with tempfile.TemporaryDirectory() as tmp:
+            for k in range(5):
+                path = os.path.join(tmp, f"3d_anim_{k}.html.gz")
+                open(path, "wb").close()
+                os.utime(path, (k, k))
+            open(os.path.join(tmp, "other.txt"), "wb").close()
+            visualizer._prune_html_cache(tmp, keep=2)
+            self.assertEqual(sorted(os.listdir(tmp)), ["3d_anim_3.html.gz", "3d_anim_4.html.gz", "other.txt"])
+
+
+class TestTempFileJanitor(unittest.TestCase):
+    def test_purge_by_deadline(self):
+        """Тест: удаляются только просроченные файлы, purge() без срока — все"""
+        janitor = visualizer._TempFileJanitor(ttl=10.0, interval=3600.0)
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, f"{k}.html") for k in range(2)]
+            for path in paths:
+                open(path, "wb").close()
+            with mock.patch("time.monotonic", return_value=100.0):
+                janitor.add(paths[0])
+            with mock.patch("time.monotonic", return_value=105.0):
+                janitor.add(paths[1])
+            janitor.purge(112.0)
+            self.assertEqual([os.path.exists(p) for p in paths], [False, True])
+            janitor.purge()
+            self.assertFalse(os.path.exists(paths[1]))
+
+    def test_thread_stops_when_idle(self):
+        """Тест: поток очистки удаляет просроченный файл и завершается, когда файлов нет"""
+        janitor = visualizer._TempFileJanitor(ttl=0.0, interval=0.01)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "a.html")
+            open(path, "wb").close()
+            janitor.add(path)
+            thread = janitor._thread
+            thread.join(timeout=5.0)
+            self.assertFalse(thread.is_alive())
+            self.assertFalse(os.path.exists(path))
+            self.assertIsNone(janitor._thread)
+
+
+class TestBrowserCommand(unittest.TestCase):
+    def test_platforms(self):
+        url = "file:///tmp/a.html"
+        self.assertEqual(_browser_command(url, "darwin"), ["open", url])
+        self.assertEqual(_browser_command(url, "linux"), ["xdg-open", url])
+
+    def test_windows_uses_startfile(self):
+        """Тест: на Windows файл открывается os.startfile, путь не проходит через cmd.exe"""
+        path = os.path.abspath(os.path.join("R&D %USER%", "a^b.html"))
+        with mock.patch.object(visualizer, "_headless", return_value=False), \
+                mock.patch.object(visualizer.sys, "platform", "win32"), \
+                mock.patch("os.startfile", create=True) as startfile, \
+                mock.patch("subprocess.Popen") as popen:
+            self.assertTrue(visualizer._open_in_browser(path))
+        startfile.assert_called_once_with(path)
+        popen.assert_not_called()
+
+    def test_headless(self):
+        """Тест: CI, ROBOTY_NO_BROWSER и Linux без дисплея считаются окружением без графики"""
+        self.assertTrue(visualizer._headless({"CI": "true", "DISPLAY": ":0"}, "linux"))
+        self.assertTrue(visualizer._headless({"ROBOTY_NO_BROWSER": "1"}, "darwin"))
+        self.assertTrue(visualizer._headless({}, "linux"))
+        self.assertFalse(visualizer._headless({"WAYLAND_DISPLAY": "wayland-0"}, "linux"))
+        self.assertFalse(visualizer._headless({}, "win32"))
+        with mock.patch.object(visualizer, "_headless", return_value=True), \
+                mock.patch("subprocess.Popen") as popen:
+            self.assertFalse(visualizer._open_in_browser("/tmp/a.html"))
+        popen.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
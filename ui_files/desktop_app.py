@@ -476,7 +476,8 @@ class DesktopApp(QtWidgets.QMainWindow, Ui_MainWindow):
                                 self.progress.emit(int(p))
                             except Exception:
                                 pass
-                        show_visualization(self._plan, self._mode, progress_callback=_cb)
+                        # Рабочий поток ждёт записи: «открыто» — только если страница записана
+                        show_visualization(self._plan, self._mode, progress_callback=_cb, background=False)
                         self.finished.emit()
                     except Exception as e:
                         self.error.emit(str(e))
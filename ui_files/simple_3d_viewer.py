@@ -244,7 +244,8 @@ class Simple3DViewer(QtWidgets.QMainWindow):
                 QtWidgets.QApplication.processEvents()
             
             # Запускаем визуализацию
-            show_visualization(plan, "3d_anim", progress_callback=progress_callback)
+            # HTML ищется сразу после вызова — запись не уходит в фон
+            show_visualization(plan, "3d_anim", progress_callback=progress_callback, background=False)
             
             # Ищем созданный HTML файл
             self.find_html_file()
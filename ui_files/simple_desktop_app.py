@@ -261,7 +261,7 @@ class SimpleDesktopApp(QtWidgets.QMainWindow, Ui_MainWindow):
                 self.textLog.append("⚡ Применены максимальные оптимизации для очень большой сцены")
             
             # Запускаем визуализацию
-            show_visualization(self.plan, "3d_anim")
+            show_visualization(self.plan, "3d_anim", background=False)
             
             self.textLog.append("✅ Оптимизированная визуализация завершена")
             self.logger.info("Визуализация успешно завершена")
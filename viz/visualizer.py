@@ -1,96 +1,419 @@
+import atexit
+import base64
+import gzip
+import hashlib
+import html
+import itertools
+import json
 import logging
+import math
+import multiprocessing
+import operator
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import webbrowser
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from functools import lru_cache, partial
 import plotly.graph_objects as go
+import plotly.io as pio
+from pathlib import Path
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
 from plotly.subplots import make_subplots
 import numpy as np
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, Iterable, Iterator, List, Sequence, Tuple
 
 # Настройка логгера для модуля визуализации
 logger = logging.getLogger("ROBOTY.visualizer")
+
+# Быстрая сериализация фигур в JSON через orjson (если установлен)
+try:
+    import orjson
+    pio.json.config.default_engine = "orjson"
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# Datashader (опционально) для растровой плотности очень длинных траекторий
+try:
+    import datashader as ds
+    import datashader.transfer_functions as tf
+    import pandas as pd
+    import PIL  # noqa: F401 — нужен для img.to_pil()
+    DATASHADER_AVAILABLE = True
+except ImportError:
+    DATASHADER_AVAILABLE = False
+
+# Numba (опционально) для JIT-компиляции числовых ядер
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
 try:
     from core.mesh_loader import load_obj, load_hand_definition
 except Exception:
     load_obj = None
     load_hand_definition = None
 
-def _interpolate_position(trajectory: List[Dict[str, Any]], t: float) -> Tuple[float, float, float]:
-    """
-    Линейная интерполяция позиции TCP по времени t.
-    Возвращает последнюю известную точку, если t вне диапазона.
-    """
-    if not trajectory:
-        return (0.0, 0.0, 0.0)
-    if t <= trajectory[0]["t"]:
-        p = trajectory[0]
-        return (p["x"], p["y"], p["z"])
-    if t >= trajectory[-1]["t"]:
-        p = trajectory[-1]
-        return (p["x"], p["y"], p["z"])
-    for i in range(len(trajectory) - 1):
-        p1 = trajectory[i]
-        p2 = trajectory[i + 1]
-        if p1["t"] <= t <= p2["t"]:
-            dt = p2["t"] - p1["t"]
-            alpha = 0.0 if dt == 0 else (t - p1["t"]) / dt
-            x = p1["x"] + alpha * (p2["x"] - p1["x"]) 
-            y = p1["y"] + alpha * (p2["y"] - p1["y"]) 
-            z = p1["z"] + alpha * (p2["z"] - p1["z"]) 
-            return (x, y, z)
-    p = trajectory[-1]
-    return (p["x"], p["y"], p["z"])
-
-def create_desktop_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
+def _interp_xyz_many(xyzt: np.ndarray, times: np.ndarray, ts: np.ndarray = None) -> np.ndarray:
+    """
+    Линейная интерполяция TCP по массиву (N, 4) [x, y, z, t] сразу для
+    массива моментов times: один np.searchsorted и векторная линейная смесь
+    соседних точек; вне диапазона — крайние точки. ts — непрерывный столбец
+    времени (RobotTraj.ts), без него он копируется из xyzt. Возвращает (len(times), 3).
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if len(xyzt) == 0:
+        return np.zeros((len(times), 3))
+    if len(xyzt) == 1:
+        return np.repeat(xyzt[:1, :3], len(times), axis=0)
+    if ts is None:
+        ts = np.ascontiguousarray(xyzt[:, 3])
+    k = np.clip(np.searchsorted(ts, times, side="right"), 1, len(ts) - 1)
+    p1, p2 = xyzt[k - 1], xyzt[k]
+    dt = p2[:, 3] - p1[:, 3]
+    alpha = np.divide(times - p1[:, 3], dt, out=np.zeros_like(dt), where=dt != 0)
+    out = p1[:, :3] + alpha[:, None] * (p2[:, :3] - p1[:, :3])
+    # Вне диапазона — крайние точки траектории
+    out[times <= ts[0]] = xyzt[0, :3]
+    out[times >= ts[-1]] = xyzt[-1, :3]
+    return out
+
+# Тип координат, передаваемых в Plotly: float32 достаточно для отображения
+# и вдвое уменьшает объём JSON/HTML и передачу в WebGL. Расчёты остаются во float64.
+_DISPLAY_DTYPE = np.float32
+# Разрыв линии между частями склеенного следа
+_NAN_BREAK = np.full(1, np.nan, dtype=_DISPLAY_DTYPE)
+
+def _display(values) -> np.ndarray:
+    """Координаты для следа Plotly в _DISPLAY_DTYPE."""
+    return np.asarray(values, dtype=_DISPLAY_DTYPE)
+
+# Цвета для роботов
+_ROBOT_COLORS = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray']
+
+@dataclass
+class RobotTraj:
+    """
+    Траектория робота для визуализации: массив (N, 4) со столбцами x, y, z, t.
+    ts — отдельная непрерывная копия столбца времени для бинарного поиска.
+    """
+    id: Any
+    base_xyz: np.ndarray
+    tool_clearance: float
+    xyzt: np.ndarray
+    default_base: bool = False
+    ts: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self):
+        self.ts = np.ascontiguousarray(self.xyzt[:, 3])
+
+# Выборка x, y, z, t из точки траектории одним вызовом на C-уровне
+_XYZT_GETTER = operator.itemgetter("x", "y", "z", "t")
+
+def _robot_traj(robot: Dict[str, Any]) -> RobotTraj:
+    """Преобразует робота из плана (список словарей точек) в RobotTraj."""
+    trajectory = robot.get("trajectory") or []
+    # Один проход по точкам прямо в буфер float64 (SoA-столбцы — срезы xyzt):
+    # itemgetter и chain не создают Python-кадр генератора на каждое значение
+    xyzt = np.fromiter(itertools.chain.from_iterable(map(_XYZT_GETTER, trajectory)), dtype=np.float64,
+                       count=4 * len(trajectory)).reshape(-1, 4)
+    return RobotTraj(
+        id=robot.get("id"),
+        base_xyz=np.asarray(robot.get("base_xyz", [0, 0, 0]), dtype=np.float64),
+        tool_clearance=float(robot.get("tool_clearance", 0.0)),
+        xyzt=xyzt,
+        default_base="base_xyz" not in robot,
+    )
+
+def _normalize_plan(plan: Dict[str, Any]) -> List[RobotTraj]:
+    """
+    Однократно переводит траектории плана в массивы NumPy.
+    Сам план не изменяется (он сохраняется в JSON после визуализации).
+    """
+    return [_robot_traj(robot) for robot in plan.get("robots", [])]
+
+# Максимум точек на статический след траектории (выше — прореживание LTTB)
+_MAX_PLOT_POINTS = 2000
+
+def _lttb_indices_np(pts: np.ndarray, n_out: int) -> np.ndarray:
+    """LTTB на NumPy: цикл по корзинам, площади треугольников внутри корзины векторизованы."""
+    n = len(pts)
+    idx = np.empty(n_out, dtype=np.int32)
+    idx[0] = 0
+    idx[-1] = n - 1
+    every = (n - 2) / (n_out - 2)
+    a = 0
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg = pts[end:next_end].mean(axis=0) if i < n_out - 3 else pts[n - 1]
+        u = pts[start:end] - pts[a]
+        v = avg - pts[a]
+        # |u × v|² = |u|²|v|² − (u·v)² — годится для 2D и 3D
+        area2 = (u * u).sum(axis=1) * float(v @ v) - (u @ v) ** 2
+        a = start + int(np.argmax(area2))
+        idx[i + 1] = a
+    return idx
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _lttb_indices_nb(pts, n_out):
+        """LTTB, скомпилированный Numba (последовательный проход по корзинам)."""
+        n, dim = pts.shape
+        idx = np.empty(n_out, dtype=np.int32)
+        idx[0] = 0
+        idx[n_out - 1] = n - 1
+        every = (n - 2) / (n_out - 2)
+        avg = np.empty(dim)
+        a = 0
+        for i in range(n_out - 2):
+            start = int(i * every) + 1
+            end = int((i + 1) * every) + 1
+            next_end = min(int((i + 2) * every) + 1, n)
+            if i < n_out - 3:
+                for d in range(dim):
+                    acc = 0.0
+                    for j in range(end, next_end):
+                        acc += pts[j, d]
+                    avg[d] = acc / (next_end - end)
+            else:
+                for d in range(dim):
+                    avg[d] = pts[n - 1, d]
+            vv = 0.0
+            for d in range(dim):
+                vd = avg[d] - pts[a, d]
+                vv += vd * vd
+            best = -1.0
+            best_j = start
+            for j in range(start, end):
+                uu = 0.0
+                uv = 0.0
+                for d in range(dim):
+                    ud = pts[j, d] - pts[a, d]
+                    uu += ud * ud
+                    uv += ud * (avg[d] - pts[a, d])
+                area2 = uu * vv - uv * uv
+                if area2 > best:
+                    best = area2
+                    best_j = j
+            a = best_j
+            idx[i + 1] = a
+        return idx
+
+def _lttb_indices(pts: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Индексы точек, отобранных алгоритмом Largest-Triangle-Three-Buckets.
+    pts — массив (N, D), D = 2 или 3. Первая и последняя точки сохраняются.
+    Возвращает int32-индексы, чтобы выбрать сразу все столбцы (x, y, z, t).
+    """
+    pts = np.ascontiguousarray(pts, dtype=np.float64)
+    n = len(pts)
+    if n_out >= n or n_out < 3:
+        return np.arange(n, dtype=np.int32)
+    if NUMBA_AVAILABLE:
+        return _lttb_indices_nb(pts, n_out)
+    return _lttb_indices_np(pts, n_out)
+
+# Допуск упрощения Рамера–Дугласа–Пекера по умолчанию — доля safe_dist плана (м)
+_RDP_EPS_FRACTION = 0.01
+
+def _rdp_indices(pts: np.ndarray, eps: float) -> np.ndarray:
+    """
+    Индексы точек, оставленных упрощением Рамера–Дугласа–Пекера:
+    выброшенные точки отстоят от отрезка между соседними оставленными не более
+    чем на eps. Расстояние считается до отрезка, а не до прямой, поэтому
+    точки разворота на пути «туда и обратно» сохраняются.
+    """
+    pts = np.asarray(pts, dtype=np.float64)
+    n = len(pts)
+    if n < 3 or eps <= 0:
+        return np.arange(n, dtype=np.int32)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    eps2 = eps * eps
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b - a < 2:
+            continue
+        d = pts[a + 1:b] - pts[a]
+        ab = pts[b] - pts[a]
+        ab2 = float(ab @ ab)
+        if ab2 > 0.0:
+            d -= np.clip((d @ ab) / ab2, 0.0, 1.0)[:, None] * ab
+        dist2 = np.einsum("ij,ij->i", d, d)
+        k = int(np.argmax(dist2))
+        if dist2[k] > eps2:
+            k += a + 1
+            keep[k] = True
+            stack.append((a, k))
+            stack.append((k, b))
+    return np.flatnonzero(keep).astype(np.int32)
+
+# Базы «по умолчанию» (0,0,0) без явного base_xyz скрываются, если ни одна
+# траектория не подходит к началу координат ближе этого расстояния (м)
+_DEFAULT_BASE_CULL_DIST = 1.0
+
+def _collect_base_markers(trajs: List[RobotTraj], colors: List[str]) -> Tuple[List[Tuple[float, float, float]], List[str], List[str]]:
+    """
+    Собирает маркеры баз роботов (с траекторией) для одного агрегированного следа.
+    Совпадающие базы объединяются в один маркер. База по умолчанию (0,0,0)
+    у роботов без base_xyz отбрасывается, если траектории далеко от начала координат.
+    Возвращает (позиции, цвета, подписи).
+    """
+    positions: List[Tuple[float, float, float]] = []
+    marker_colors: List[str] = []
+    labels: List[str] = []
+    index_by_pos: Dict[Tuple[float, float, float], int] = {}
+    origin_near = None
+    for i, traj in enumerate(trajs):
+        if not len(traj.xyzt):
+            continue
+        base = tuple(float(c) for c in traj.base_xyz)
+        if traj.default_base and base == (0.0, 0.0, 0.0):
+            if origin_near is None:
+                pts = np.vstack([tr.xyzt[:, :3] for tr in trajs])
+                origin_near = float(np.min(np.linalg.norm(pts, axis=1))) <= _DEFAULT_BASE_CULL_DIST
+            if not origin_near:
+                continue
+        k = index_by_pos.get(base)
+        if k is None:
+            index_by_pos[base] = len(positions)
+            positions.append(base)
+            marker_colors.append(colors[i % len(colors)])
+            labels.append(f"Base {traj.id}")
+        else:
+            labels[k] += f", {traj.id}"
+    return positions, marker_colors, labels
+
+def _speeds(xyzt: np.ndarray) -> np.ndarray:
+    """Скорость TCP (м/с) по соседним точкам траектории; первая точка — 0."""
+    speeds = np.zeros(len(xyzt))
+    # Одна разность по всем четырём столбцам: шаги по x/y/z и по времени
+    d = np.diff(xyzt, axis=0)
+    dt = d[:, 3]
+    dist = np.sqrt(np.einsum("ij,ij->i", d[:, :3], d[:, :3]))
+    # Точки с неположительным шагом по времени — скорость 0
+    speeds[1:] = np.divide(dist, dt, out=np.zeros_like(dist), where=dt > 0)
+    return speeds
+
+def _prepare(plan: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Один проход по траекториям плана для всех типов визуализации:
+    массивы RobotTraj, индексы LTTB (+ упрощение RDP), скорости и агрегированные базы.
+    shown — прорежённые координаты (3, n) в _DISPLAY_DTYPE: строки x/y/z
+    непрерывны, и 3D-вид и все 2D-проекции отдают их в Plotly без копий.
+    Результат только читается, поэтому его можно разделять между потоками.
+    """
+    trajs = _normalize_plan(plan)
+    max_points = int(plan.get("max_plot_points", _MAX_PLOT_POINTS))
+    lttb_idx = [_lttb_indices(tr.xyzt[:, :3], max_points) for tr in trajs]
+    # После LTTB убираем почти коллинеарные точки (RDP): вершин в WebGL меньше,
+    # а разница на экране не заметна. simplify_eps=0 отключает упрощение.
+    eps = float(plan.get("simplify_eps", _RDP_EPS_FRACTION * float(plan.get("safe_dist", 0.0) or 0.0)))
+    if eps > 0:
+        lttb_idx = [idx[_rdp_indices(tr.xyzt[idx, :3], eps)] for tr, idx in zip(trajs, lttb_idx)]
+    return {
+        "trajs": trajs,
+        "lttb_idx": lttb_idx,
+        "shown": [np.ascontiguousarray(tr.xyzt[idx, :3].T, dtype=_DISPLAY_DTYPE)
+                  for tr, idx in zip(trajs, lttb_idx)],
+        "speeds": [_speeds(tr.xyzt) if len(tr.xyzt) > 1 else [] for tr in trajs],
+        "bases": _collect_base_markers(trajs, _ROBOT_COLORS),
+    }
+
+# Общий шаблон подсказки для следов траекторий: customdata = [t, id робота]
+_HOVER_TEMPLATE = ("<b>Robot %{customdata[1]}</b><br>"
+                   "X: %{x:.3f}<br>"
+                   "Y: %{y:.3f}<br>"
+                   "Z: %{z:.3f}<br>"
+                   "Time: %{customdata[0]:.2f}s<extra></extra>")
+
+def _hover_customdata(xyzt: np.ndarray, robot_id: Any) -> np.ndarray:
+    """Столбцы customdata для _HOVER_TEMPLATE: время точки и id робота."""
+    if isinstance(robot_id, (int, float, np.number)):
+        return np.column_stack([xyzt[:, 3], np.full(len(xyzt), robot_id, dtype=np.float64)])
+    return np.column_stack([xyzt[:, 3].astype(object), np.full(len(xyzt), robot_id, dtype=object)])
+
+def _scene_ranges(points: np.ndarray, pad_ratio: float = 0.05, min_pad: float = 0.05) -> Dict[str, Any]:
+    """
+    Явные диапазоны осей 3D-сцены по ограничивающему параллелепипеду точек (M, 3).
+    Пропорции осей как при aspectmode="cube", но без пересчета границ в браузере.
+    Пустой набор точек — автоматический режим "cube".
+    """
+    if not len(points):
+        return dict(aspectmode="cube")
+    mn = points.min(axis=0)
+    mx = points.max(axis=0)
+    pad = np.maximum((mx - mn) * pad_ratio, min_pad)
+    lo = (mn - pad).tolist()
+    hi = (mx + pad).tolist()
+    return dict(
+        aspectmode="manual",
+        aspectratio=dict(x=1, y=1, z=1),
+        xaxis=dict(range=[lo[0], hi[0]]),
+        yaxis=dict(range=[lo[1], hi[1]]),
+        zaxis=dict(range=[lo[2], hi[2]]),
+    )
+
+def _plan_points(prepared: Dict[str, Any], objects: List[Dict[str, Any]]) -> np.ndarray:
+    """Все точки сцены для ограничивающего параллелепипеда: траектории, базы, углы объектов."""
+    parts = [tr.xyzt[:, :3] for tr in prepared["trajs"]]
+    bases = prepared["bases"][0]
+    if bases:
+        parts.append(np.asarray(bases, dtype=np.float64))
+    for obj in objects:
+        center = np.asarray(obj.get("initial_position", [0, 0, 0]), dtype=np.float64)
+        s = float(obj.get("size", 0.1)) / 2.0
+        parts.append(np.vstack([center - s, center + s]))
+    return np.vstack(parts) if parts else np.empty((0, 3))
+
+def create_desktop_3d_visualization(plan: Dict[str, Any], prepared: Dict[str, Any] = None) -> go.Figure:
     """
     Создает оптимизированную 3D визуализацию для десктопного режима с точечным воспроизведением.
+    prepared — результат _prepare(plan); если не передан, вычисляется здесь.
     """
     logger.info("Создание десктопной 3D визуализации с точечным воспроизведением")
     
     fig = go.Figure()
-    robots = plan["robots"]
-    
-    # Цвета для роботов
-    colors = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray']
+    if prepared is None:
+        prepared = _prepare(plan)
+    trajs = prepared["trajs"]
+    colors = _ROBOT_COLORS
     
     # Для каждого робота рисуем только ключевые точки траектории
-    for i, robot in enumerate(robots):
+    for i, traj in enumerate(trajs):
         color = colors[i % len(colors)]
-        trajectory = robot["trajectory"]
         
-        if not trajectory:
-            logger.warning(f"Робот {robot['id']} не имеет траектории")
+        if not len(traj.xyzt):
+            logger.warning(f"Робот {traj.id} не имеет траектории")
             continue
         
         # Берем только ключевые точки для десктопного режима (каждая 5-я точка)
-        step = max(1, len(trajectory) // 20)  # Максимум 20 точек на робота
-        key_trajectory = trajectory[::step]
-        
-        # Извлекаем координаты
-        xs = [p["x"] for p in key_trajectory]
-        ys = [p["y"] for p in key_trajectory]
-        zs = [p["z"] for p in key_trajectory]
-        ts = [p["t"] for p in key_trajectory]
+        step = max(1, len(traj.xyzt) // 20)  # Максимум 20 точек на робота
+        key_trajectory = traj.xyzt[::step]
+        base = tuple(traj.base_xyz.tolist())
         
         # Траектория - только точки, без линий
         fig.add_trace(go.Scatter3d(
-            x=xs, y=ys, z=zs,
+            x=_display(key_trajectory[:, 0]), y=_display(key_trajectory[:, 1]), z=_display(key_trajectory[:, 2]),
             mode="markers",  # Только маркеры, без линий
-            name=f"Robot {robot['id']}",
+            name=f"Robot {traj.id}",
             marker=dict(size=6, color=color, symbol="circle"),
-            hovertemplate=f"<b>Robot {robot['id']}</b><br>" +
-                         "X: %{x:.3f}<br>" +
-                         "Y: %{y:.3f}<br>" +
-                         "Z: %{z:.3f}<br>" +
-                         "Time: %{customdata:.2f}s<extra></extra>",
-            customdata=ts
-        ))
-        
-        # База робота
-        base_xyz = robot.get("base_xyz", [0, 0, 0])
-        fig.add_trace(go.Scatter3d(
-            x=[base_xyz[0]], y=[base_xyz[1]], z=[base_xyz[2]],
-            mode="markers",
-            name=f"Base {robot['id']}",
-            marker=dict(size=12, color=color, symbol="square"),
-            showlegend=False
+            hovertemplate=_HOVER_TEMPLATE,
+            customdata=_hover_customdata(key_trajectory, traj.id)
         ))
         
         # Добавляем 3D модели роботов для ключевых позиций
@@ -104,10 +427,7 @@ def create_desktop_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
                 mesh_data = load_obj(mesh_path, mesh_scale)
                 if mesh_data:
                     # Добавляем 3D модель для ключевых позиций
-                    for j, point in enumerate(key_trajectory[::max(1, len(key_trajectory)//3)]):  # Максимум 3 позы
-                        base = tuple(robot.get("base_xyz", [0, 0, 0]))
-                        tcp = (point["x"], point["y"], point["z"])
-                        
+                    for j in range(len(key_trajectory[::max(1, len(key_trajectory)//3)])):  # Максимум 3 позы
                         # Трансформируем модель к позиции робота
                         xs_mesh, ys_mesh, zs_mesh, i_mesh, j_mesh, k_mesh = mesh_data
                         
@@ -122,7 +442,7 @@ def create_desktop_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
                             i=i_mesh, j=j_mesh, k=k_mesh,
                             color=color,
                             opacity=0.7,
-                            name=f"Robot Model R{robot['id']}" if j == 0 else "",
+                            name=f"Robot Model R{traj.id}" if j == 0 else "",
                             showlegend=j == 0
                         )
                         fig.add_trace(mesh_trace)
@@ -143,8 +463,7 @@ def create_desktop_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
                 hand_def = load_hand_definition(hpath, hscale)
         
         for j, point in enumerate(key_trajectory[::max(1, len(key_trajectory)//5)]):  # Максимум 5 поз
-            base = tuple(robot.get("base_xyz", [0, 0, 0]))
-            tcp = (point["x"], point["y"], point["z"])
+            tcp = (float(point[0]), float(point[1]), float(point[2]))
             
             # Создаем упрощенную модель руки
             joints = _arm_segments(base, tcp, arm_segments, 
@@ -152,18 +471,12 @@ def create_desktop_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
                                  plan.get("arm_model", "curved"))
             
             # Рисуем сегменты руки
-            xs_arm = []
-            ys_arm = []
-            zs_arm = []
-            for k in range(len(joints) - 1):
-                xs_arm += [joints[k][0], joints[k+1][0], None]
-                ys_arm += [joints[k][1], joints[k+1][1], None]
-                zs_arm += [joints[k][2], joints[k+1][2], None]
+            xs_arm, ys_arm, zs_arm = _polyline_segments(joints)
             
             fig.add_trace(go.Scatter3d(
                 x=xs_arm, y=ys_arm, z=zs_arm,
                 mode="lines",
-                name=f"Arm R{robot['id']}" if j == 0 else "",
+                name=f"Arm R{traj.id}" if j == 0 else "",
                 line=dict(width=4, color=color),
                 showlegend=j == 0
             ))
@@ -186,22 +499,26 @@ def create_desktop_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
                         fig.add_trace(go.Scatter3d(
                             x=hx, y=hy, z=hz,
                             mode="lines",
-                            name=f"Hand R{robot['id']}" if j == 0 else "",
+                            name=f"Hand R{traj.id}" if j == 0 else "",
                             line=dict(width=3, color=color),
                             showlegend=j == 0
                         ))
     
+    # Базы роботов — один агрегированный след
+    bases, base_colors, base_labels = prepared["bases"]
+    if bases:
+        fig.add_trace(go.Scatter3d(
+            x=[b[0] for b in bases], y=[b[1] for b in bases], z=[b[2] for b in bases],
+            mode="markers",
+            name="Bases",
+            text=base_labels,
+            marker=dict(size=12, color=base_colors, symbol="square"),
+            showlegend=False
+        ))
+    
     # Объекты (если заданы)
     objects = plan.get("objects", [])
-    for obj in objects:
-        if obj.get("type", "cube") == "cube":
-            center = tuple(obj.get("initial_position", [0, 0, 0]))
-            size = float(obj.get("size", 0.1))
-            xs, ys, zs = _cube_edges(center, size)
-            fig.add_trace(go.Scatter3d(
-                x=xs, y=ys, z=zs, mode="lines", name=f"Object {obj.get('id','?')}",
-                line=dict(color=obj.get("color", "red"), width=4)
-            ))
+    fig.add_traces(_object_edge_traces(objects, width=4))
     
     # Настройка макета для десктопного режима
     makespan = plan.get("makespan", 0.0)
@@ -234,94 +551,226 @@ def create_desktop_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
     logger.info("Десктопная 3D визуализация создана")
     return fig
 
+# Шаг округления координат (м) для ключа кэша поз руки
+_ARM_CACHE_QUANT = 1e-4
+
 def _arm_segments(base: Tuple[float, float, float], tcp: Tuple[float, float, float], segments: int = 4, bulge: float = 0.15, model: str = "curved") -> List[Tuple[float, float, float]]:
     """
     Упрощенная модель манипулятора с «локтем»: базовая линия base→tcp,
     сочленения формируют небольшую дугу (bulge) перпендикулярно направлению.
     Возвращает список точек суставов (включая base и tcp).
+    Позы кэшируются по координатам, округлённым до _ARM_CACHE_QUANT:
+    соседние кадры и неподвижные роботы не пересчитываются.
+    """
+    q = _ARM_CACHE_QUANT
+    base_key = tuple(round(float(c) / q) * q for c in base)
+    tcp_key = tuple(round(float(c) / q) * q for c in tcp)
+    return list(_arm_segments_cached(base_key, tcp_key, int(segments), float(bulge), model))
+
+def _arm_points_np(bx: float, by: float, bz: float, tx: float, ty: float, tz: float,
+                   a: np.ndarray, offset_mag: np.ndarray) -> np.ndarray:
+    """
+    Точки суставов (n, 3) руки base→tcp по профилю _arm_profile (столбцы a и
+    offset_mag): доли длины вдоль base→tcp плюс смещение дуги вдоль
+    перпендикуляра side_dir. base и tcp не должны совпадать.
     """
-    bx, by, bz = base
-    tx, ty, tz = tcp
     v = np.array([tx - bx, ty - by, tz - bz], dtype=float)
-    norm_v = np.linalg.norm(v)
-    if norm_v == 0:
-        return [base, tcp]
-    v_dir = v / norm_v
+    v_dir = v / np.linalg.norm(v)
     up = np.array([0.0, 0.0, 1.0])
     side = np.cross(v_dir, up)
     if np.linalg.norm(side) < 1e-6:
         up = np.array([0.0, 1.0, 0.0])
         side = np.cross(v_dir, up)
     side_dir = side / (np.linalg.norm(side) + 1e-12)
-    points: List[Tuple[float, float, float]] = []
-    for i in range(segments + 1):
-        a = i / segments
-        base_point = np.array([bx, by, bz]) + a * v
-        if model == "straight":
-            p = base_point
-        elif model == "double":
-            # две выпуклости (двойной локоть)
-            offset_mag = bulge * (np.sin(np.pi * a) + 0.5 * np.sin(2 * np.pi * a))
-            p = base_point + offset_mag * side_dir
-        else:
-            # curved (один локоть)
-            offset_mag = bulge * np.sin(np.pi * a)
-            p = base_point + offset_mag * side_dir
-        points.append((float(p[0]), float(p[1]), float(p[2])))
-    return points
+    return np.array([bx, by, bz]) + a * v + offset_mag * side_dir
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _arm_points_nb(bx, by, bz, tx, ty, tz, a, offset_mag):
+        """_arm_points_np, скомпилированный Numba: скалярная арифметика без временных массивов."""
+        vx, vy, vz = tx - bx, ty - by, tz - bz
+        n = np.sqrt(vx * vx + vy * vy + vz * vz)
+        dx, dy, dz = vx / n, vy / n, vz / n
+        # side = v_dir × (0, 0, 1), при вертикальной руке — v_dir × (0, 1, 0)
+        sx, sy, sz = dy, -dx, 0.0
+        if np.sqrt(sx * sx + sy * sy) < 1e-6:
+            sx, sy, sz = -dz, 0.0, dx
+        sn = np.sqrt(sx * sx + sy * sy + sz * sz) + 1e-12
+        sx, sy, sz = sx / sn, sy / sn, sz / sn
+        out = np.empty((a.shape[0], 3))
+        for k in range(a.shape[0]):
+            ak = a[k, 0]
+            ok = offset_mag[k, 0]
+            out[k, 0] = bx + ak * vx + ok * sx
+            out[k, 1] = by + ak * vy + ok * sy
+            out[k, 2] = bz + ak * vz + ok * sz
+        return out
+
+@lru_cache(maxsize=8192)
+def _arm_segments_cached(base: Tuple[float, float, float], tcp: Tuple[float, float, float], segments: int, bulge: float, model: str) -> Tuple[Tuple[float, float, float], ...]:
+    """Вычисление точек суставов для _arm_segments (аргументы уже округлены)."""
+    if base == tcp:
+        return (base, tcp)
+    # Все суставы за один проход: доли длины a, смещение дуги вдоль side_dir
+    a, offset_mag = _arm_profile(segments, bulge, model)
+    kernel = _arm_points_nb if NUMBA_AVAILABLE else _arm_points_np
+    return tuple(map(tuple, kernel(*base, *tcp, a, offset_mag).tolist()))
 
-def _cube_edges(center: Tuple[float, float, float], size: float) -> Tuple[List[float], List[float], List[float]]:
+@lru_cache(maxsize=64)
+def _arm_profile(segments: int, bulge: float, model: str) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Генерирует координаты рёбер куба (как линии) для Scatter3d.
-    Возвращает списки x, y, z с None-разделителями между рёбрами.
+    Доли длины суставов a и величина смещения дуги для модели руки —
+    столбцы (segments + 1, 1); не зависят от позы, поэтому кэшируются.
     """
-    cx, cy, cz = center
-    s = size / 2.0
-    v = [
-        (cx - s, cy - s, cz - s), (cx + s, cy - s, cz - s), (cx + s, cy + s, cz - s), (cx - s, cy + s, cz - s),
-        (cx - s, cy - s, cz + s), (cx + s, cy - s, cz + s), (cx + s, cy + s, cz + s), (cx - s, cy + s, cz + s),
-    ]
-    edges = [
-        (0,1),(1,2),(2,3),(3,0),
-        (4,5),(5,6),(6,7),(7,4),
-        (0,4),(1,5),(2,6),(3,7),
-    ]
-    xs: List[float] = []
-    ys: List[float] = []
-    zs: List[float] = []
-    for a, b in edges:
-        xs += [v[a][0], v[b][0], None]
-        ys += [v[a][1], v[b][1], None]
-        zs += [v[a][2], v[b][2], None]
-    return xs, ys, zs
-
-def _box_mesh(center: Tuple[float, float, float], size: Tuple[float, float, float], color: str = "#2E86DE") -> go.Mesh3d:
-    """Создает Mesh3d прямоугольного параллелепипеда (звено руки)."""
+    a = np.arange(segments + 1) / segments
+    if model == "straight":
+        offset_mag = np.zeros_like(a)
+    elif model == "double":
+        # две выпуклости (двойной локоть)
+        offset_mag = bulge * (np.sin(np.pi * a) + 0.5 * np.sin(2 * np.pi * a))
+    else:
+        # curved (один локоть)
+        offset_mag = bulge * np.sin(np.pi * a)
+    a, offset_mag = a[:, None], offset_mag[:, None]
+    a.flags.writeable = False
+    offset_mag.flags.writeable = False
+    return a, offset_mag
+
+# Рёбра куба как пары индексов вершин (вершины — в порядке знаков (x, y, z) ниже)
+_CUBE_EDGE_PAIRS = (
+    (0,1),(1,2),(2,3),(3,0),
+    (4,5),(5,6),(6,7),(7,4),
+    (0,4),(1,5),(2,6),(3,7),
+)
+_CUBE_VERTEX_SIGNS = (
+    (-1, -1, -1), (1, -1, -1), (1, 1, -1), (-1, 1, -1),
+    (-1, -1, 1), (1, -1, 1), (1, 1, 1), (-1, 1, 1),
+)
+
+def _segment_lines(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """
+    Отрезки starts[i]→ends[i] одним массивом (3·n, 3) для Scatter3d(mode="lines"):
+    тройки [начало, конец, NaN], NaN разрывает линию между отрезками.
+    """
+    out = np.empty((3 * len(starts), 3), dtype=np.float64)
+    out[0::3] = starts
+    out[1::3] = ends
+    out[2::3] = np.nan
+    return out
+
+def _polyline_segments(joints: List[Tuple[float, float, float]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Звенья ломаной joints как отрезки с NaN-разрывами: массивы x, y, z."""
+    pts = np.asarray(joints, dtype=np.float64)
+    lines = _display(_segment_lines(pts[:-1], pts[1:]))
+    return lines[:, 0], lines[:, 1], lines[:, 2]
+
+def _color_index_scale(colors: List[str]) -> Dict[str, Any]:
+    """
+    Параметры line для следа, где цвет вершины — номер робота:
+    дискретная colorscale, в которой значение i точно попадает в colors[i].
+    """
+    n = len(colors)
+    if n == 1:
+        scale = [[0.0, colors[0]], [1.0, colors[0]]]
+    else:
+        scale = [[i / (n - 1), c] for i, c in enumerate(colors)]
+    return dict(colorscale=scale, cmin=0, cmax=max(1, n - 1))
+
+def _merged_lines(parts: List[Tuple[int, Any, Any, Any]]) -> Dict[str, Any]:
+    """
+    Линии нескольких роботов одним Scatter3d-обновлением (словарь): части
+    (номер робота, x, y, z) разделены NaN, line.color — номер робота на каждую
+    вершину (цвет по colorscale из _color_index_scale у плейсхолдера).
+    """
+    cols = ([], [], [])
+    counts = []
+    for _, *xyz in parts:
+        n = len(xyz[0])
+        for axis in range(3):
+            cols[axis].append(_display(xyz[axis]))
+            cols[axis].append(_NAN_BREAK)
+        counts.append(n + 1)
+    color = np.repeat(np.array([part[0] for part in parts], dtype=np.int32), counts)
+    return dict(type="scatter3d", x=np.concatenate(cols[0]), y=np.concatenate(cols[1]),
+                z=np.concatenate(cols[2]), line=dict(color=color))
+
+@lru_cache(maxsize=256)
+def _cube_edge_template(size: float) -> np.ndarray:
+    """
+    Смещения вершин рёбер куба относительно центра для данного размера:
+    массив (3, 36) с NaN-разрывами — строки x, y, z непрерывны, так что
+    результат _cubes_edges уходит в Plotly без копий столбцов.
+    Зависит только от size, поэтому кэшируется.
+    """
+    v = np.array(_CUBE_VERTEX_SIGNS, dtype=np.float64) * (size / 2.0)
+    a, b = np.array(_CUBE_EDGE_PAIRS).T
+    tpl = np.ascontiguousarray(_segment_lines(v[a], v[b]).T)
+    tpl.flags.writeable = False
+    return tpl
+
+def _cubes_edges(centers: np.ndarray, sizes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Рёбра сразу нескольких кубов (центры (M, 3), размеры (M,)) одним вызовом:
+    x, y, z подряд по кубам, куб k — срез [36·k, 36·(k+1)) (12 рёбер с NaN-разделителями).
+    Шаблон единичного куба уже содержит NaN-разрывы, поэтому кубы не сливаются.
+    """
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 3)
+    sizes = np.asarray(sizes, dtype=np.float64)
+    pts = _display(_cube_edge_template(1.0)[:, None, :] * sizes[None, :, None] + centers.T[:, :, None])
+    pts = pts.reshape(3, -1)
+    return pts[0], pts[1], pts[2]
+
+def _object_edge_traces(objects: List[Dict[str, Any]], width: int) -> List[Dict[str, Any]]:
+    """
+    Рёбра кубов-объектов статичной сцены: один след Scatter3d на цвет вместо
+    следа на объект. Рёбра уже разделены NaN, поэтому кубы одного цвета
+    склеиваются простой конкатенацией. Если цвет у одного объекта, след
+    сохраняет его имя «Object <id>».
+    """
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for obj in objects:
+        if obj.get("type", "cube") == "cube":
+            groups.setdefault(obj.get("color", "red"), []).append(obj)
+    traces = []
+    for color, objs in groups.items():
+        xs, ys, zs = _cubes_edges([obj.get("initial_position", [0, 0, 0]) for obj in objs],
+                                  [float(obj.get("size", 0.1)) for obj in objs])
+        name = f"Object {objs[0].get('id', '?')}" if len(objs) == 1 else "Objects"
+        traces.append(dict(type="scatter3d", x=xs, y=ys, z=zs, mode="lines", name=name,
+                           line=dict(color=color, width=width)))
+    return traces
+
+# Треугольники (12) осевого бокса _box_mesh: вершины по z-слоям, против часовой стрелки
+_BOX_I = (0, 0, 0, 1, 1, 2, 4, 4, 5, 0, 2, 6)
+_BOX_J = (1, 3, 4, 2, 5, 3, 5, 7, 6, 4, 6, 7)
+_BOX_K = (2, 2, 5, 3, 6, 7, 6, 6, 7, 7, 7, 4)
+# Треугольники (12) ориентированного бокса: вершины в порядке _BOX_SIGNS
+_OBOX_I = (0, 0, 0, 1, 1, 2, 4, 4, 5, 3, 2, 6)
+_OBOX_J = (1, 2, 4, 3, 5, 3, 5, 6, 7, 7, 6, 7)
+_OBOX_K = (2, 4, 6, 2, 6, 7, 6, 7, 7, 2, 7, 4)
+
+def _box_mesh(center: Tuple[float, float, float], size: Tuple[float, float, float], color: str = "#2E86DE") -> Dict[str, Any]:
+    """Создает Mesh3d-трейс (словарь) прямоугольного параллелепипеда (звено руки)."""
     cx, cy, cz = center
     sx, sy, sz = size
     dx, dy, dz = sx/2.0, sy/2.0, sz/2.0
     # 8 вершин
-    x = [cx-dx, cx+dx, cx+dx, cx-dx, cx-dx, cx+dx, cx+dx, cx-dx]
-    y = [cy-dy, cy-dy, cy+dy, cy+dy, cy-dy, cy-dy, cy+dy, cy+dy]
-    z = [cz-dz, cz-dz, cz-dz, cz-dz, cz+dz, cz+dz, cz+dz, cz+dz]
-    # 12 треугольников
-    i = [0, 0, 0, 1, 1, 2, 4, 4, 5, 0, 2, 6]
-    j = [1, 3, 4, 2, 5, 3, 5, 7, 6, 4, 6, 7]
-    k = [2, 2, 5, 3, 6, 7, 6, 6, 7, 7, 7, 4]
-    return go.Mesh3d(x=x, y=y, z=z, i=i, j=j, k=k, color=color, opacity=0.5)
-
-def _oriented_box_mesh(p1: Tuple[float, float, float], p2: Tuple[float, float, float], thickness: float, color: str = "#2E86DE") -> go.Mesh3d:
-    """
-    Строит ориентированный Mesh3d прямоугольного звена между p1 и p2
-    с квадратным сечением thickness x thickness.
-    """
-    a = np.array(p1, dtype=float)
-    b = np.array(p2, dtype=float)
+    x = _display([cx-dx, cx+dx, cx+dx, cx-dx, cx-dx, cx+dx, cx+dx, cx-dx])
+    y = _display([cy-dy, cy-dy, cy+dy, cy+dy, cy-dy, cy-dy, cy+dy, cy+dy])
+    z = _display([cz-dz, cz-dz, cz-dz, cz-dz, cz+dz, cz+dz, cz+dz, cz+dz])
+    return dict(type="mesh3d", x=x, y=y, z=z, i=_BOX_I, j=_BOX_J, k=_BOX_K, color=color, opacity=0.5)
+
+# Знаки (u, v, w) восьми вершин бокса:
+# (-,-,-),( -,-,+),( -,+,-),( -,+,+),( +,-,-),( +,-,+),( +,+,-),( +,+,+)
+_BOX_SIGNS = np.array([(su, sv, sw) for su in (-1, 1) for sv in (-1, 1) for sw in (-1, 1)], dtype=np.float64)
+
+def _oriented_box_corners_np(ax: float, ay: float, az: float, bx: float, by: float, bz: float,
+                             thickness: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Вершины ориентированного бокса a→b (NumPy-фолбэк для _oriented_box_corners)."""
+    a = np.array([ax, ay, az])
+    b = np.array([bx, by, bz])
     u = b - a
     L = np.linalg.norm(u)
-    if L == 0:
-        center = a
-        return _box_mesh((float(center[0]), float(center[1]), float(center[2])), (thickness, thickness, thickness), color=color)
     u_dir = u / L
     # Выбираем опорный вектор неколлинеарный u_dir
     ref = np.array([0.0, 0.0, 1.0])
@@ -334,35 +783,138 @@ def _oriented_box_mesh(p1: Tuple[float, float, float], p2: Tuple[float, float, f
         v_norm = 1.0
     v_dir = v_dir / v_norm
     w_dir = np.cross(u_dir, v_dir)
+    half = np.array([L / 2.0, thickness / 2.0, thickness / 2.0])
+    corners = (a + b) / 2.0 + (_BOX_SIGNS * half) @ np.vstack([u_dir, v_dir, w_dir])
+    return corners[:, 0], corners[:, 1], corners[:, 2]
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _oriented_box_corners_nb(ax, ay, az, bx, by, bz, thickness):
+        """Вершины ориентированного бокса a→b скалярной арифметикой (Numba)."""
+        ux = bx - ax
+        uy = by - ay
+        uz = bz - az
+        L = np.sqrt(ux * ux + uy * uy + uz * uz)
+        ux /= L
+        uy /= L
+        uz /= L
+        # Опорный вектор: z, либо y для почти вертикального звена
+        rx, ry, rz = 0.0, 0.0, 1.0
+        if abs(uz) > 0.95:
+            rx, ry, rz = 0.0, 1.0, 0.0
+        vx = uy * rz - uz * ry
+        vy = uz * rx - ux * rz
+        vz = ux * ry - uy * rx
+        vn = np.sqrt(vx * vx + vy * vy + vz * vz)
+        if vn == 0.0:
+            vx, vy, vz = 0.0, 1.0, 0.0
+            vn = 1.0
+        vx /= vn
+        vy /= vn
+        vz /= vn
+        wx = uy * vz - uz * vy
+        wy = uz * vx - ux * vz
+        wz = ux * vy - uy * vx
+        cx = (ax + bx) / 2.0
+        cy = (ay + by) / 2.0
+        cz = (az + bz) / 2.0
+        hu = L / 2.0
+        h = thickness / 2.0
+        xs = np.empty(8)
+        ys = np.empty(8)
+        zs = np.empty(8)
+        n = 0
+        for iu in range(2):
+            su = hu * (2 * iu - 1)
+            for iv in range(2):
+                sv = h * (2 * iv - 1)
+                for iw in range(2):
+                    sw = h * (2 * iw - 1)
+                    xs[n] = cx + su * ux + sv * vx + sw * wx
+                    ys[n] = cy + su * uy + sv * vy + sw * wy
+                    zs[n] = cz + su * uz + sv * vz + sw * wz
+                    n += 1
+        return xs, ys, zs
+
+def _oriented_box_corners(p1: Tuple[float, float, float], p2: Tuple[float, float, float],
+                          thickness: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Координаты x, y, z восьми вершин бокса p1→p2 в порядке _BOX_SIGNS.
+    Отрезок p1→p2 должен иметь ненулевую длину.
+    """
+    args = (float(p1[0]), float(p1[1]), float(p1[2]), float(p2[0]), float(p2[1]), float(p2[2]), float(thickness))
+    if NUMBA_AVAILABLE:
+        return _oriented_box_corners_nb(*args)
+    return _oriented_box_corners_np(*args)
+
+def _oriented_box_mesh(p1: Tuple[float, float, float], p2: Tuple[float, float, float], thickness: float, color: str = "#2E86DE") -> Dict[str, Any]:
+    """
+    Строит ориентированный Mesh3d-трейс (словарь) прямоугольного звена между p1 и p2
+    с квадратным сечением thickness x thickness.
+    """
+    if p1[0] == p2[0] and p1[1] == p2[1] and p1[2] == p2[2]:
+        return _box_mesh((float(p1[0]), float(p1[1]), float(p1[2])), (thickness, thickness, thickness), color=color)
+    xs, ys, zs = _oriented_box_corners(p1, p2, thickness)
+    return dict(type="mesh3d", x=_display(xs), y=_display(ys), z=_display(zs),
+                i=_OBOX_I, j=_OBOX_J, k=_OBOX_K, color=color, opacity=0.65)
 
-    center = (a + b) / 2.0
-    hu = L / 2.0
-    hv = thickness / 2.0
-    hw = thickness / 2.0
+def _frozen_indices(*lists: List[int]) -> Tuple[np.ndarray, ...]:
+    """Списки индексов треугольников -> неизменяемые массивы int32 для кэша."""
+    arrays = tuple(np.asarray(lst, dtype=np.int32) for lst in lists)
+    for arr in arrays:
+        arr.flags.writeable = False
+    return arrays
 
-    # 8 вершин: \pm u, \pm v, \pm w относительно центра
-    corners = []
-    for su in (-1, 1):
-        for sv in (-1, 1):
-            for sw in (-1, 1):
-                p = center + su * hu * u_dir + sv * hv * v_dir + sw * hw * w_dir
-                corners.append(p)
-    # Индексация вершин для удобства
-    # corners order (u,v,w): (-,-,-),( -,-,+),( -,+,-),( -,+,+),( +,-,-),( +,-,+),( +,+,-),( +,+,+)
-    x = [float(p[0]) for p in corners]
-    y = [float(p[1]) for p in corners]
-    z = [float(p[2]) for p in corners]
+@lru_cache(maxsize=None)
+def _cylinder_indices(segments: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Треугольники боковой поверхности цилиндра; зависят только от числа сегментов."""
+    i_idx = []
+    j_idx = []
+    k_idx = []
+    for k in range(segments):
+        k_next = (k + 1) % segments
+        # нижнее кольцо k -> верхнее k -> нижнее k+1
+        i_idx += [k, k, k + segments]
+        j_idx += [k + segments, k_next, k_next + segments]
+        k_idx += [k_next + segments, k_next + segments, k_next]
+    return _frozen_indices(i_idx, j_idx, k_idx)
 
-    # Треугольники (12) по индексам 0..7
-    i = [0, 0, 0, 1, 1, 2, 4, 4, 5, 3, 2, 6]
-    j = [1, 2, 4, 3, 5, 3, 5, 6, 7, 7, 6, 7]
-    k = [2, 4, 6, 2, 6, 7, 6, 7, 7, 2, 7, 4]
+@lru_cache(maxsize=None)
+def _sphere_indices(u_segments: int, v_segments: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Треугольники сферы по сетке u×v; зависят только от числа сегментов."""
+    # Ячейка (a, b) сетки даёт два треугольника (p1, p2, p4) и (p1, p3, p4)
+    p1 = (np.arange(u_segments - 1)[:, None] * v_segments + np.arange(v_segments - 1)).ravel()
+    p2 = p1 + v_segments
+    p3 = p1 + 1
+    p4 = p2 + 1
+    return _frozen_indices(np.repeat(p1, 2), np.column_stack([p2, p3]).ravel(), np.repeat(p4, 2))
+
+@lru_cache(maxsize=None)
+def _unit_circle(segments: int) -> Tuple[np.ndarray, np.ndarray]:
+    """cos и sin углов кольца цилиндра — столбцы (segments, 1); зависят только от числа сегментов."""
+    theta = np.linspace(0, 2 * np.pi, segments, endpoint=False)
+    cos_t, sin_t = np.cos(theta)[:, None], np.sin(theta)[:, None]
+    cos_t.flags.writeable = False
+    sin_t.flags.writeable = False
+    return cos_t, sin_t
 
-    return go.Mesh3d(x=x, y=y, z=z, i=i, j=j, k=k, color=color, opacity=0.65)
+@lru_cache(maxsize=None)
+def _unit_sphere(u_segments: int, v_segments: int) -> np.ndarray:
+    """
+    Вершины единичной сферы по сетке u×v — массив (3, u·v) в порядке
+    _sphere_indices; сфера в кадре — масштаб и перенос этого шаблона.
+    """
+    u = np.linspace(0, 2 * np.pi, u_segments)[:, None]
+    v = np.linspace(0, np.pi, v_segments)
+    sin_v = np.sin(v)
+    unit = np.stack([(np.cos(u) * sin_v).ravel(), (np.sin(u) * sin_v).ravel(),
+                     np.tile(np.cos(v), u_segments)])
+    unit.flags.writeable = False
+    return unit
 
-def _oriented_cylinder_mesh(p1: Tuple[float, float, float], p2: Tuple[float, float, float], radius: float, color: str = "#2E86DE", segments: int = 16) -> go.Mesh3d:
+def _oriented_cylinder_mesh(p1: Tuple[float, float, float], p2: Tuple[float, float, float], radius: float, color: str = "#2E86DE", segments: int = 16) -> Dict[str, Any]:
     """
-    Создает ориентированный цилиндр Mesh3d между точками p1 и p2 с заданным радиусом.
+    Создает ориентированный цилиндр Mesh3d-трейс (словарь) между точками p1 и p2 с заданным радиусом.
     """
     a = np.array(p1, dtype=float)
     b = np.array(p2, dtype=float)
@@ -381,85 +933,330 @@ def _oriented_cylinder_mesh(p1: Tuple[float, float, float], p2: Tuple[float, flo
     v /= (np.linalg.norm(v) + 1e-12)
     w = np.cross(axis_dir, v)
 
-    # Кольца по окружности на концах цилиндра
-    theta = np.linspace(0, 2 * np.pi, segments, endpoint=False)
-    circle = np.cos(theta)[:, None] * v + np.sin(theta)[:, None] * w
-    ring1 = a + radius * circle
-    ring2 = b + radius * circle
+    # Кольца по окружности на концах цилиндра (углы кольца — из кэша)
+    cos_t, sin_t = _unit_circle(segments)
+    ring = radius * (cos_t * v + sin_t * w)
 
-    # Вершины
-    vertices = np.vstack([ring1, ring2])
-    x = vertices[:, 0].tolist()
-    y = vertices[:, 1].tolist()
-    z = vertices[:, 2].tolist()
+    # Вершины: кольцо у a, затем у b
+    vertices = np.concatenate([a + ring, b + ring])
+    x = _display(vertices[:, 0])
+    y = _display(vertices[:, 1])
+    z = _display(vertices[:, 2])
 
-    # Треугольники боковой поверхности
-    i_idx = []
-    j_idx = []
-    k_idx = []
-    for k in range(segments):
-        k_next = (k + 1) % segments
-        # нижнее кольцо k -> верхнее k -> нижнее k+1
-        i_idx += [k, k, k + segments]
-        j_idx += [k + segments, k_next, k_next + segments]
-        k_idx += [k_next + segments, k_next + segments, k_next]
+    i_idx, j_idx, k_idx = _cylinder_indices(segments)
+    return dict(type="mesh3d", x=x, y=y, z=z, i=i_idx, j=j_idx, k=k_idx, color=color, opacity=0.75)
 
-    return go.Mesh3d(x=x, y=y, z=z, i=i_idx, j=j_idx, k=k_idx, color=color, opacity=0.75)
+def _sphere_mesh(center: Tuple[float, float, float], radius: float, color: str = "#2E86DE", u_segments: int = 16, v_segments: int = 16) -> Dict[str, Any]:
+    """Создает Mesh3d-трейс (словарь) сферы: единичная сфера из кэша, масштаб и перенос."""
+    x, y, z = _display(radius * _unit_sphere(u_segments, v_segments)
+                       + np.asarray(center, dtype=np.float64)[:, None])
+    i_idx, j_idx, k_idx = _sphere_indices(u_segments, v_segments)
+    return dict(type="mesh3d", x=x, y=y, z=z, i=i_idx, j=j_idx, k=k_idx, color=color, opacity=0.9)
 
-def _sphere_mesh(center: Tuple[float, float, float], radius: float, color: str = "#2E86DE", u_segments: int = 16, v_segments: int = 16) -> go.Mesh3d:
-    """Создает сферу Mesh3d в указанном центре и радиусе."""
-    cx, cy, cz = center
-    u = np.linspace(0, 2 * np.pi, u_segments)
-    v = np.linspace(0, np.pi, v_segments)
-    x = (cx + radius * np.outer(np.cos(u), np.sin(v))).ravel()
-    y = (cy + radius * np.outer(np.sin(u), np.sin(v))).ravel()
-    z = (cz + radius * np.outer(np.ones_like(u), np.cos(v))).ravel()
-    i_idx = []
-    j_idx = []
-    k_idx = []
-    for a in range(u_segments - 1):
-        for b in range(v_segments - 1):
-            p1 = a * v_segments + b
-            p2 = (a + 1) * v_segments + b
-            p3 = p1 + 1
-            p4 = p2 + 1
-            i_idx += [p1, p1]
-            j_idx += [p2, p3]
-            k_idx += [p4, p4]
-    return go.Mesh3d(x=x.tolist(), y=y.tolist(), z=z.tolist(), i=i_idx, j=j_idx, k=k_idx, color=color, opacity=0.9)
+def _merge_meshes(meshes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Склеивает Mesh3d-трейсы (словари) в один: вершины конкатенируются,
+    индексы треугольников сдвигаются на число вершин предыдущих мешей.
+    Цвет и прозрачность берутся у первого меша — у одного трейса они общие.
+    """
+    counts = [len(m["x"]) for m in meshes]
+    offsets = np.cumsum([0] + counts[:-1])
+    merged = dict(meshes[0])
+    for axis in ("x", "y", "z"):
+        merged[axis] = np.concatenate([_display(m[axis]) for m in meshes])
+    for axis in ("i", "j", "k"):
+        merged[axis] = np.concatenate([np.asarray(m[axis], dtype=np.int32) + np.int32(off)
+                                       for m, off in zip(meshes, offsets)])
+    return merged
 
-def _rotation_matrix_from_vectors(a: np.ndarray, b: np.ndarray) -> np.ndarray:
-    """Возвращает матрицу поворота, поворачивающую вектор a в вектор b (оба нормализованы)."""
-    a = a / (np.linalg.norm(a) + 1e-12)
-    b = b / (np.linalg.norm(b) + 1e-12)
-    v = np.cross(a, b)
-    c = float(np.dot(a, b))
-    s = float(np.linalg.norm(v))
+# Параметры меш-руки в кадре анимации: цилиндры звеньев (realistic),
+# сферы узлов и пластины хваталки
+_ARM_CYLINDER_SEGMENTS = 14
+_ARM_SPHERE_SEGMENTS = 16
+
+def _arm_mesh_np(joints: Sequence[Tuple[float, float, float]], tcp: Tuple[float, float, float], thickness: float,
+                 realistic: bool, details: bool, color: str) -> Dict[str, Any]:
+    """
+    Склеенный меш руки на кадр (NumPy-фолбэк для _arm_mesh): звенья боксами
+    или цилиндрами, при details — сферы плеча, локтя и запястья и две
+    тонкие пластины хваталки у TCP.
+    """
+    arm_meshes = []
+    for j in range(len(joints) - 1):
+        p1 = (joints[j][0], joints[j][1], joints[j][2])
+        p2 = (joints[j+1][0], joints[j+1][1], joints[j+1][2])
+        if realistic:
+            mesh = _oriented_cylinder_mesh(p1, p2, radius=thickness * 0.5, color=color, segments=_ARM_CYLINDER_SEGMENTS)
+        else:
+            mesh = _oriented_box_mesh(p1, p2, thickness=thickness, color=color)
+        arm_meshes.append(mesh)
+    # Узлы: плечо, локоть, запястье
+    if details and len(joints) >= 3:
+        shoulder = joints[0]
+        elbow = joints[len(joints)//2]
+        wrist = joints[-2]
+        sph_r = thickness * 0.9
+        for center in (shoulder, elbow, wrist):
+            arm_meshes.append(_sphere_mesh(center, sph_r, color=color,
+                                           u_segments=_ARM_SPHERE_SEGMENTS, v_segments=_ARM_SPHERE_SEGMENTS))
+    # Простая хваталка: две тонкие пластины у TCP
+    if details:
+        tcp_arr = np.array(tcp, dtype=float)
+        prev_arr = np.array(joints[-2], dtype=float)
+        dir_vec = tcp_arr - prev_arr
+        n = np.linalg.norm(dir_vec)
+        if n > 1e-9:
+            dir_vec = dir_vec / n
+        else:
+            dir_vec = np.array([1.0, 0.0, 0.0])
+        ref = np.array([0.0, 0.0, 1.0])
+        side = np.cross(dir_vec, ref)
+        if np.linalg.norm(side) < 1e-6:
+            ref = np.array([0.0, 1.0, 0.0])
+            side = np.cross(dir_vec, ref)
+        side = side / (np.linalg.norm(side) + 1e-12)
+        gap = thickness * 0.6
+        plate_len = thickness * 2.0
+        plate_th = thickness * 0.25
+        p_left1 = tuple(tcp_arr + side * gap)
+        p_left2 = tuple(tcp_arr + side * gap + dir_vec * plate_len)
+        p_right1 = tuple(tcp_arr - side * gap)
+        p_right2 = tuple(tcp_arr - side * gap + dir_vec * plate_len)
+        arm_meshes.append(_oriented_box_mesh(p_left1, p_left2, thickness=plate_th, color=color))
+        arm_meshes.append(_oriented_box_mesh(p_right1, p_right2, thickness=plate_th, color=color))
+    return _merge_meshes(arm_meshes) if arm_meshes else _EMPTY_MESH_UPDATE
+
+@lru_cache(maxsize=None)
+def _arm_mesh_indices(n_joints: int, realistic: bool, details: bool) -> Tuple[np.ndarray, ...]:
+    """
+    Индексы треугольников склеенного меша руки в порядке вершин ядра
+    _arm_mesh_vertices_nb; зависят только от числа суставов и режима.
+    """
+    segment = _cylinder_indices(_ARM_CYLINDER_SEGMENTS) if realistic else _frozen_indices(_OBOX_I, _OBOX_J, _OBOX_K)
+    parts = [(segment, 2 * _ARM_CYLINDER_SEGMENTS if realistic else 8)] * (n_joints - 1)
+    if details and n_joints >= 3:
+        parts += [(_sphere_indices(_ARM_SPHERE_SEGMENTS, _ARM_SPHERE_SEGMENTS), _ARM_SPHERE_SEGMENTS ** 2)] * 3
+    if details:
+        parts += [(_frozen_indices(_OBOX_I, _OBOX_J, _OBOX_K), 8)] * 2
+    offsets = np.cumsum([0] + [count for _, count in parts[:-1]])
+    return _frozen_indices(*(np.concatenate([idx[axis] + off for (idx, _), off in zip(parts, offsets)])
+                             for axis in range(3)))
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _arm_mesh_vertices_nb(joints, tcp, thickness, realistic, details, cos_t, sin_t, sphere):
+        """
+        Вершины склеенного меша руки (те же, что у _arm_mesh_np) одним проходом
+        сразу в float32: звенья, сферы узлов, пластины хваталки. Звенья и
+        пластины должны иметь ненулевую длину.
+        """
+        n_joints = joints.shape[0]
+        seg_verts = 2 * cos_t.shape[0] if realistic else 8
+        n_sphere = sphere.shape[1]
+        total = (n_joints - 1) * seg_verts
+        if details and n_joints >= 3:
+            total += 3 * n_sphere
+        if details:
+            total += 16
+        out_x = np.empty(total, dtype=np.float32)
+        out_y = np.empty(total, dtype=np.float32)
+        out_z = np.empty(total, dtype=np.float32)
+        n = 0
+        for j in range(n_joints - 1):
+            ax, ay, az = joints[j, 0], joints[j, 1], joints[j, 2]
+            bx, by, bz = joints[j + 1, 0], joints[j + 1, 1], joints[j + 1, 2]
+            if realistic:
+                # Кольца цилиндра радиуса thickness/2 у концов звена
+                ux, uy, uz = bx - ax, by - ay, bz - az
+                L = np.sqrt(ux * ux + uy * uy + uz * uz)
+                ux, uy, uz = ux / L, uy / L, uz / L
+                rx, ry, rz = 0.0, 0.0, 1.0
+                if abs(uz) > 0.95:
+                    rx, ry, rz = 0.0, 1.0, 0.0
+                vx = uy * rz - uz * ry
+                vy = uz * rx - ux * rz
+                vz = ux * ry - uy * rx
+                vn = np.sqrt(vx * vx + vy * vy + vz * vz) + 1e-12
+                vx, vy, vz = vx / vn, vy / vn, vz / vn
+                wx = uy * vz - uz * vy
+                wy = uz * vx - ux * vz
+                wz = ux * vy - uy * vx
+                radius = thickness * 0.5
+                m = cos_t.shape[0]
+                for k in range(m):
+                    c = cos_t[k]
+                    s = sin_t[k]
+                    ox = radius * (c * vx + s * wx)
+                    oy = radius * (c * vy + s * wy)
+                    oz = radius * (c * vz + s * wz)
+                    out_x[n + k] = ax + ox
+                    out_y[n + k] = ay + oy
+                    out_z[n + k] = az + oz
+                    out_x[n + m + k] = bx + ox
+                    out_y[n + m + k] = by + oy
+                    out_z[n + m + k] = bz + oz
+                n += 2 * m
+            else:
+                xs, ys, zs = _oriented_box_corners_nb(ax, ay, az, bx, by, bz, thickness)
+                for k in range(8):
+                    out_x[n + k] = xs[k]
+                    out_y[n + k] = ys[k]
+                    out_z[n + k] = zs[k]
+                n += 8
+        if details and n_joints >= 3:
+            # Сферы плеча, локтя и запястья — масштаб и перенос единичной сферы
+            radius = thickness * 0.9
+            for c in (0, n_joints // 2, n_joints - 2):
+                cx, cy, cz = joints[c, 0], joints[c, 1], joints[c, 2]
+                for k in range(n_sphere):
+                    out_x[n + k] = radius * sphere[0, k] + cx
+                    out_y[n + k] = radius * sphere[1, k] + cy
+                    out_z[n + k] = radius * sphere[2, k] + cz
+                n += n_sphere
+        if details:
+            # Пластины хваталки по обе стороны от направления последнего звена
+            tx, ty, tz = tcp[0], tcp[1], tcp[2]
+            dx = tx - joints[n_joints - 2, 0]
+            dy = ty - joints[n_joints - 2, 1]
+            dz = tz - joints[n_joints - 2, 2]
+            dn = np.sqrt(dx * dx + dy * dy + dz * dz)
+            if dn > 1e-9:
+                dx, dy, dz = dx / dn, dy / dn, dz / dn
+            else:
+                dx, dy, dz = 1.0, 0.0, 0.0
+            # side = dir × (0, 0, 1), при вертикальном звене — dir × (0, 1, 0)
+            sx, sy, sz = dy, -dx, 0.0
+            if np.sqrt(sx * sx + sy * sy + sz * sz) < 1e-6:
+                sx, sy, sz = -dz, 0.0, dx
+            sn = np.sqrt(sx * sx + sy * sy + sz * sz) + 1e-12
+            sx, sy, sz = sx / sn, sy / sn, sz / sn
+            gap = thickness * 0.6
+            plate_len = thickness * 2.0
+            for sign in (1.0, -1.0):
+                px = tx + sign * sx * gap
+                py = ty + sign * sy * gap
+                pz = tz + sign * sz * gap
+                xs, ys, zs = _oriented_box_corners_nb(px, py, pz, px + dx * plate_len, py + dy * plate_len,
+                                                      pz + dz * plate_len, thickness * 0.25)
+                for k in range(8):
+                    out_x[n + k] = xs[k]
+                    out_y[n + k] = ys[k]
+                    out_z[n + k] = zs[k]
+                n += 8
+        return out_x, out_y, out_z
+
+def _arm_mesh(joints: Sequence[Tuple[float, float, float]], tcp: Tuple[float, float, float], thickness: float,
+              realistic: bool, details: bool, color: str) -> Dict[str, Any]:
+    """
+    Склеенный Mesh3d-трейс (словарь) руки на кадр. С Numba вершины считает
+    одно ядро, а индексы берутся из кэша; вырожденные руки (нулевые звенья
+    или толщина) собираются из отдельных мешей в _arm_mesh_np.
+    """
+    if NUMBA_AVAILABLE and thickness > 0 and len(joints) >= 2:
+        pts = np.asarray(joints, dtype=np.float64)
+        if not (pts[1:] == pts[:-1]).all(axis=1).any():
+            cos_t, sin_t = _unit_circle(_ARM_CYLINDER_SEGMENTS)
+            x, y, z = _arm_mesh_vertices_nb(pts, np.asarray(tcp, dtype=np.float64), float(thickness),
+                                            bool(realistic), bool(details), cos_t[:, 0], sin_t[:, 0],
+                                            _unit_sphere(_ARM_SPHERE_SEGMENTS, _ARM_SPHERE_SEGMENTS))
+            i_idx, j_idx, k_idx = _arm_mesh_indices(len(pts), bool(realistic), bool(details))
+            return dict(type="mesh3d", x=x, y=y, z=z, i=i_idx, j=j_idx, k=k_idx, color=color,
+                        opacity=0.75 if realistic else 0.65)
+    return _arm_mesh_np(joints, tcp, thickness, realistic, details, color)
+
+def _rotation_matrix_elems(ax: float, ay: float, az: float, bx: float, by: float, bz: float) -> Tuple[float, ...]:
+    """
+    Матрица поворота вектора a в вектор b по формуле Родрига в замкнутой
+    форме: нормы, векторное произведение и K, K @ K расписаны по компонентам
+    без временных массивов и произведений матриц. Возвращает 9 элементов матрицы
+    построчно. Чистая скалярная арифметика — тот же код компилирует Numba.
+    """
+    n = math.sqrt(ax * ax + ay * ay + az * az) + 1e-12
+    ax /= n
+    ay /= n
+    az /= n
+    n = math.sqrt(bx * bx + by * by + bz * bz) + 1e-12
+    bx /= n
+    by /= n
+    bz /= n
+    vx = ay * bz - az * by
+    vy = az * bx - ax * bz
+    vz = ax * by - ay * bx
+    c = ax * bx + ay * by + az * bz
+    s = math.sqrt(vx * vx + vy * vy + vz * vz)
     if s < 1e-12:
-        # Параллельные или противоположные: если противоположные — поворот на 180° вокруг ортогональной оси
         if c > 0.999999:
-            return np.eye(3)
-        # Найти любую ось, ортогональную a
-        ref = np.array([1.0, 0.0, 0.0]) if abs(a[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
-        v = np.cross(a, ref)
-        v = v / (np.linalg.norm(v) + 1e-12)
-        # Формула Родрига для угла pi: R = I + 2*K^2, где K — матрица перекр. произведения единичного v
-        K = np.array([[0, -v[2], v[1]],[v[2], 0, -v[0]],[-v[1], v[0], 0]], dtype=float)
-        return np.eye(3) + 2.0 * (K @ K)
-    # Формула Родрига: R = I + K*sin + K^2*(1-cos)
-    vx, vy, vz = v
-    K = np.array([[0, -vz, vy],[vz, 0, -vx],[-vy, vx, 0]], dtype=float)
-    R = np.eye(3) + K + K @ K * ((1 - c) / (s * s + 1e-12))
-    return R
-
-def _transform_mesh_vertices(xs: List[float], ys: List[float], zs: List[float], R: np.ndarray, t: Tuple[float, float, float]) -> Tuple[List[float], List[float], List[float]]:
-    """Применяет поворот R и перенос t к вершинам меша."""
+            return 1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0
+        # Противоположные: поворот на 180° вокруг оси, ортогональной a (R = I + 2*K^2)
+        if abs(ax) < 0.9:
+            rx, ry, rz = 1.0, 0.0, 0.0
+        else:
+            rx, ry, rz = 0.0, 1.0, 0.0
+        vx = ay * rz - az * ry
+        vy = az * rx - ax * rz
+        vz = ax * ry - ay * rx
+        n = math.sqrt(vx * vx + vy * vy + vz * vz) + 1e-12
+        vx /= n
+        vy /= n
+        vz /= n
+        f = 2.0
+        kx, ky, kz = 0.0, 0.0, 0.0
+    else:
+        # R = I + K + K^2 * (1 - c) / s^2
+        f = (1.0 - c) / (s * s + 1e-12)
+        kx, ky, kz = vx, vy, vz
+    # K^2 для единичного и неединичного v: v v^T - |v|^2 I
+    return (1.0 - f * (vy * vy + vz * vz), -kz + f * vx * vy, ky + f * vx * vz,
+            kz + f * vx * vy, 1.0 - f * (vx * vx + vz * vz), -kx + f * vy * vz,
+            -ky + f * vx * vz, kx + f * vy * vz, 1.0 - f * (vx * vx + vy * vy))
+
+if NUMBA_AVAILABLE:
+    _rotation_matrix_from_vectors_nb = njit(cache=True)(_rotation_matrix_elems)
+
+def _rotation_matrix_from_vectors(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Возвращает матрицу поворота, поворачивающую вектор a в вектор b (оба нормализованы)."""
+    kernel = _rotation_matrix_from_vectors_nb if NUMBA_AVAILABLE else _rotation_matrix_elems
+    return np.array(kernel(float(a[0]), float(a[1]), float(a[2]),
+                           float(b[0]), float(b[1]), float(b[2]))).reshape(3, 3)
+
+def _mesh_arrays(mesh_data: Tuple) -> Tuple[np.ndarray, ...]:
+    """
+    Переводит меш (xs, ys, zs, is, js, ks) из списков в массивы NumPy один раз
+    при загрузке, чтобы позы в кадрах анимации не конвертировали списки заново.
+    """
+    xs, ys, zs, is_, js_, ks_ = mesh_data
+    return (_display(xs), _display(ys), _display(zs),
+            np.asarray(is_, dtype=np.int32), np.asarray(js_, dtype=np.int32), np.asarray(ks_, dtype=np.int32))
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _transform_vertices_nb(xs, ys, zs, R, tx, ty, tz):
+        """Поворот R и перенос (tx, ty, tz) вершин в один проход, сразу в _DISPLAY_DTYPE (Numba)."""
+        n = xs.shape[0]
+        out_x = np.empty(n, dtype=np.float32)
+        out_y = np.empty(n, dtype=np.float32)
+        out_z = np.empty(n, dtype=np.float32)
+        for i in range(n):
+            x = np.float64(xs[i])
+            y = np.float64(ys[i])
+            z = np.float64(zs[i])
+            out_x[i] = R[0, 0] * x + R[0, 1] * y + R[0, 2] * z + tx
+            out_y[i] = R[1, 0] * x + R[1, 1] * y + R[1, 2] * z + ty
+            out_z[i] = R[2, 0] * x + R[2, 1] * y + R[2, 2] * z + tz
+        return out_x, out_y, out_z
+
+def _transform_mesh_vertices(xs: Sequence[float], ys: Sequence[float], zs: Sequence[float], R: np.ndarray, t: Tuple[float, float, float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Применяет поворот R и перенос t к вершинам меша (списки или массивы); возвращает массивы."""
+    if NUMBA_AVAILABLE and isinstance(xs, np.ndarray) and xs.dtype == _DISPLAY_DTYPE:
+        # Массивы из _mesh_arrays: без vstack и промежуточной матрицы (N, 3)
+        return _transform_vertices_nb(xs, ys, zs, np.ascontiguousarray(R, dtype=np.float64),
+                                      float(t[0]), float(t[1]), float(t[2]))
     V = np.vstack([np.asarray(xs, dtype=float), np.asarray(ys, dtype=float), np.asarray(zs, dtype=float)])  # 3xN
-    Vp = (R @ V).T + np.asarray(t, dtype=float)  # Nx3
-    return Vp[:,0].tolist(), Vp[:,1].tolist(), Vp[:,2].tolist()
+    Vp = _display((R @ V).T + np.asarray(t, dtype=float))  # Nx3
+    return Vp[:, 0], Vp[:, 1], Vp[:, 2]
 
 def _create_robot_pose_mesh(robot_mesh_data: Tuple, base: Tuple[float, float, float], tcp: Tuple[float, float, float], 
-                           color: str, robot_id: int, pose_interpolation: float = 0.0) -> go.Mesh3d:
+                           color: str, robot_id: int, pose_interpolation: float = 0.0) -> Dict[str, Any]:
     """
     Создает 3D меш робота в заданной позе с возможностью интерполяции между позами.
     
@@ -509,75 +1306,62 @@ def _create_robot_pose_mesh(robot_mesh_data: Tuple, base: Tuple[float, float, fl
         # Трансформируем вершины меша
         txs, tys, tzs = _transform_mesh_vertices(xs0, ys0, zs0, R, base)
         
-        return go.Mesh3d(x=txs, y=tys, z=tzs, i=is_, j=js_, k=ks_,
-                        color=color, opacity=0.7,
-                        name=f"RobotMesh R{robot_id}", showlegend=False)
+        return dict(type="mesh3d", x=txs, y=tys, z=tzs, i=is_, j=js_, k=ks_,
+                    color=color, opacity=0.7,
+                    name=f"RobotMesh R{robot_id}", showlegend=False)
     except Exception as e:
         logger.warning(f"Ошибка создания позы робота {robot_id}: {e}")
         # Fallback: простая линия
         xs_l = [base[0], tcp[0]]
         ys_l = [base[1], tcp[1]]
         zs_l = [base[2], tcp[2]]
-        return go.Scatter3d(x=xs_l, y=ys_l, z=zs_l, mode="lines",
-                           line=dict(width=6, color=color),
-                           name=f"Arm R{robot_id}", showlegend=False)
+        return dict(type="scatter3d", x=xs_l, y=ys_l, z=zs_l, mode="lines",
+                    line=dict(width=6, color=color),
+                    name=f"Arm R{robot_id}", showlegend=False)
 
-def create_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
+def create_3d_visualization(plan: Dict[str, Any], prepared: Dict[str, Any] = None) -> go.Figure:
     """
     Создает 3D визуализацию траекторий роботов с зонами безопасности и коллизиями.
+    prepared — результат _prepare(plan); если не передан, вычисляется здесь.
     """
     logger.info("Создание 3D визуализации траекторий")
     
+    if prepared is None:
+        prepared = _prepare(plan)
+    
     # Проверяем, нужна ли точечная визуализация для десктопного режима
     if plan.get("desktop_mode", False):
-        return create_desktop_3d_visualization(plan)
+        return create_desktop_3d_visualization(plan, prepared)
     
     fig = go.Figure()
-    robots = plan["robots"]
+    trajs = prepared["trajs"]
     safe_dist = plan.get("safe_dist", 0.0)
-    
-    # Цвета для роботов
-    colors = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray']
+    colors = _ROBOT_COLORS
+    # Точки, размеры, цвета и подписи зон безопасности всех роботов
+    zone_pts, zone_sizes, zone_colors, zone_labels = [], [], [], []
     
     # Для каждого робота рисуем траекторию
-    for i, robot in enumerate(robots):
+    for i, traj in enumerate(trajs):
         color = colors[i % len(colors)]
-        trajectory = robot["trajectory"]
+        arr = traj.xyzt
         
-        if not trajectory:
-            logger.warning(f"Робот {robot['id']} не имеет траектории")
+        if not len(arr):
+            logger.warning(f"Робот {traj.id} не имеет траектории")
             continue
         
-        # Извлекаем координаты
-        xs = [p["x"] for p in trajectory]
-        ys = [p["y"] for p in trajectory]
-        zs = [p["z"] for p in trajectory]
-        ts = [p["t"] for p in trajectory]
-        
-        # Траектория
+        # Траектория (длинные пути прореживаются LTTB)
+        shown = prepared["shown"][i]
         fig.add_trace(go.Scatter3d(
-            x=xs, y=ys, z=zs,
+            x=shown[0], y=shown[1], z=shown[2],
             mode="lines+markers",
-            name=f"Robot {robot['id']}",
+            name=f"Robot {traj.id}",
             line=dict(width=6, color=color),
             marker=dict(size=4, color=color),
-            hovertemplate=f"<b>Robot {robot['id']}</b><br>" +
-                         "X: %{x:.3f}<br>" +
-                         "Y: %{y:.3f}<br>" +
-                         "Z: %{z:.3f}<br>" +
-                         "Time: %{customdata:.2f}s<extra></extra>",
-            customdata=ts
+            hovertemplate=_HOVER_TEMPLATE,
+            customdata=_hover_customdata(arr[prepared["lttb_idx"][i]], traj.id)
         ))
         
-        # База робота (пьедестал) — визуально более выразительный
-        base_xyz = robot.get("base_xyz", [0, 0, 0])
-        fig.add_trace(go.Scatter3d(
-            x=[base_xyz[0]], y=[base_xyz[1]], z=[base_xyz[2]],
-            mode="markers",
-            name=f"Base {robot['id']}",
-            marker=dict(size=10, color=color, symbol="square"),
-            showlegend=False
-        ))
+        base_xyz = tuple(traj.base_xyz.tolist())
         
         # Добавляем 3D модель робота в статичной визуализации
         robot_mesh = plan.get("robot_mesh")
@@ -587,46 +1371,52 @@ def create_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
                 mesh_data = load_obj(robot_mesh["path"], robot_mesh.get("scale", 1.0))
                 if mesh_data:
                     # Создаем 3D модель робота в начальной позиции
-                    tcp = (xs[0], ys[0], zs[0]) if xs and ys and zs else base_xyz
-                    robot_mesh_obj = _create_robot_pose_mesh(mesh_data, base_xyz, tcp, color, robot['id'], 0.0)
+                    tcp = tuple(arr[0, :3].tolist())
+                    robot_mesh_obj = _create_robot_pose_mesh(mesh_data, base_xyz, tcp, color, traj.id, 0.0)
                     fig.add_trace(robot_mesh_obj)
             except Exception as e:
-                logger.warning(f"Не удалось загрузить 3D модель робота {robot['id']}: {e}")
+                logger.warning(f"Не удалось загрузить 3D модель робота {traj.id}: {e}")
         
-        # Зоны безопасности (упрощенно - только в ключевых точках)
-        tool_clearance = robot.get("tool_clearance", 0.0)
+        # Зоны безопасности (упрощенно - только в начале, середине и конце);
+        # точки всех роботов собираются в один след после цикла
+        tool_clearance = traj.tool_clearance
         if tool_clearance > 0:
-            # Показываем зоны безопасности только в начале, середине и конце
-            key_points = [0, len(trajectory)//2, -1] if len(trajectory) > 2 else [0, -1]
-            for idx in key_points:
-                if idx == -1:
-                    idx = len(trajectory) - 1
-                if idx < len(trajectory):
-                    x, y, z = xs[idx], ys[idx], zs[idx]
-                    fig.add_trace(go.Scatter3d(
-                        x=[x], y=[y], z=[z],
-                        mode="markers",
-                        marker=dict(
-                            size=tool_clearance * 30,  # масштаб
-                            color=color,
-                            opacity=0.2,
-                            line=dict(width=1, color=color)
-                        ),
-                        name=f"Safety zone {robot['id']}" if idx == key_points[0] else "",
-                        showlegend=idx == key_points[0]
-                    ))
+            for idx in sorted({0, len(arr) // 2, len(arr) - 1}):
+                zone_pts.append(arr[idx, :3])
+                zone_sizes.append(tool_clearance * 30)  # масштаб
+                zone_colors.append(color)
+                zone_labels.append(f"Safety zone {traj.id}")
+    
+    if zone_pts:
+        zones = _display(zone_pts)
+        fig.add_trace(go.Scatter3d(
+            x=zones[:, 0], y=zones[:, 1], z=zones[:, 2],
+            mode="markers",
+            marker=dict(
+                size=zone_sizes,
+                color=zone_colors,
+                opacity=0.2,
+                line=dict(width=1, color=zone_colors)
+            ),
+            name="Safety zones",
+            text=zone_labels
+        ))
+    
+    # Базы роботов (пьедесталы) — один агрегированный след без дублей
+    bases, base_colors, base_labels = prepared["bases"]
+    if bases:
+        fig.add_trace(go.Scatter3d(
+            x=[b[0] for b in bases], y=[b[1] for b in bases], z=[b[2] for b in bases],
+            mode="markers",
+            name="Bases",
+            text=base_labels,
+            marker=dict(size=10, color=base_colors, symbol="square"),
+            showlegend=False
+        ))
     
     # Объекты (если заданы)
     objects = plan.get("objects", [])
-    for obj in objects:
-        if obj.get("type", "cube") == "cube":
-            center = tuple(obj.get("initial_position", [0, 0, 0]))
-            size = float(obj.get("size", 0.1))
-            xs, ys, zs = _cube_edges(center, size)
-            fig.add_trace(go.Scatter3d(
-                x=xs, y=ys, z=zs, mode="lines", name=f"Object {obj.get('id','?')}",
-                line=dict(color=obj.get("color", "red"), width=6)
-            ))
+    fig.add_traces(_object_edge_traces(objects, width=6))
 
     # Настройка макета
     makespan = plan.get("makespan", 0.0)
@@ -641,8 +1431,8 @@ def create_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
             xaxis_title="X (m)",
             yaxis_title="Y (m)",
             zaxis_title="Z (m)",
-            aspectmode="cube",
-            dragmode="orbit"
+            dragmode="orbit",
+            **_scene_ranges(_plan_points(prepared, objects))
         ),
         margin=dict(l=0, r=0, b=0, t=50),
         template="plotly_white",
@@ -658,19 +1448,48 @@ def create_3d_visualization(plan: Dict[str, Any]) -> go.Figure:
     logger.info("3D визуализация создана")
     return fig
 
-def create_2d_projection(plan: Dict[str, Any], projection: str = "xy") -> go.Figure:
+# Порог суммарного числа точек, после которого 2D-проекция рисуется растром Datashader
+_DATASHADER_THRESHOLD = 500_000
+
+def _add_density_image(fig: go.Figure, trajs: List[RobotTraj], axis1: int, axis2: int, colors: List[str]) -> None:
+    """
+    Растеризует все траектории на холст Datashader (свой цвет на робота)
+    и кладет PNG под оси 2D-фигуры. Стоимость отрисовки в браузере зависит
+    от размера холста, а не от числа точек.
+    """
+    filled = [(i, tr.xyzt) for i, tr in enumerate(trajs) if len(tr.xyzt)]
+    keys = [str(i) for i, _ in filled]
+    df = pd.DataFrame({
+        "a": np.concatenate([arr[:, axis1] for _, arr in filled]),
+        "b": np.concatenate([arr[:, axis2] for _, arr in filled]),
+        "r": pd.Categorical(np.repeat(keys, [len(arr) for _, arr in filled]), categories=keys),
+    })
+    x0, x1 = float(df["a"].min()), float(df["a"].max())
+    y0, y1 = float(df["b"].min()), float(df["b"].max())
+    if x1 <= x0 or y1 <= y0:
+        return
+    cvs = ds.Canvas(plot_width=1600, plot_height=1200, x_range=(x0, x1), y_range=(y0, y1))
+    agg = cvs.points(df, "a", "b", agg=ds.count_cat("r"))
+    img = tf.shade(agg, color_key={k: colors[i % len(colors)] for k, (i, _) in zip(keys, filled)}, how="eq_hist")
+    fig.add_layout_image(dict(
+        source=img.to_pil(), xref="x", yref="y",
+        x=x0, y=y1, sizex=x1 - x0, sizey=y1 - y0,
+        sizing="stretch", layer="below"
+    ))
+
+def create_2d_projection(plan: Dict[str, Any], projection: str = "xy", prepared: Dict[str, Any] = None) -> go.Figure:
     """
     Создает 2D проекцию траекторий.
     
     Args:
         plan: План выполнения
         projection: Тип проекции ("xy", "xz", "yz")
+        prepared: Результат _prepare(plan); если не передан, вычисляется здесь
     """
     logger.info(f"Создание 2D проекции {projection}")
     
     fig = go.Figure()
-    robots = plan["robots"]
-    colors = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray']
+    colors = _ROBOT_COLORS
     
     # Выбираем оси для проекции
     axis_map = {
@@ -683,33 +1502,41 @@ def create_2d_projection(plan: Dict[str, Any], projection: str = "xy") -> go.Fig
         raise ValueError(f"Неизвестная проекция: {projection}")
     
     axis1, axis2, label1, label2 = axis_map[projection]
+    if prepared is None:
+        prepared = _prepare(plan)
+    trajs = prepared["trajs"]
     
-    for i, robot in enumerate(robots):
+    # Очень много точек — плотность растром, поверх тонкие линии LTTB
+    total_points = sum(len(tr.xyzt) for tr in trajs)
+    density = DATASHADER_AVAILABLE and total_points > int(plan.get("datashader_threshold", _DATASHADER_THRESHOLD))
+    if density:
+        logger.info(f"2D проекция {projection}: {total_points} точек, растеризация Datashader")
+        _add_density_image(fig, trajs, axis1, axis2, colors)
+    
+    for i, traj in enumerate(trajs):
         color = colors[i % len(colors)]
-        trajectory = robot["trajectory"]
         
-        if not trajectory:
+        if not len(traj.xyzt):
             continue
         
-        coords = [[p["x"], p["y"], p["z"]] for p in trajectory]
-        xs = [coord[axis1] for coord in coords]
-        ys = [coord[axis2] for coord in coords]
-        
+        shown = prepared["shown"][i]
         fig.add_trace(go.Scatter(
-            x=xs, y=ys,
-            mode="lines+markers",
-            name=f"Robot {robot['id']}",
-            line=dict(width=3, color=color),
+            x=shown[axis1], y=shown[axis2],
+            mode="lines" if density else "lines+markers",
+            name=f"Robot {traj.id}",
+            line=dict(width=1 if density else 3, color=color),
             marker=dict(size=6, color=color)
         ))
-        
-        # База робота
-        base_xyz = robot.get("base_xyz", [0, 0, 0])
+    
+    # Базы роботов — один агрегированный след
+    bases, base_colors, base_labels = prepared["bases"]
+    if bases:
         fig.add_trace(go.Scatter(
-            x=[base_xyz[axis1]], y=[base_xyz[axis2]],
+            x=[b[axis1] for b in bases], y=[b[axis2] for b in bases],
             mode="markers",
-            name=f"Base {robot['id']}",
-            marker=dict(size=10, color=color, symbol="square"),
+            name="Bases",
+            text=base_labels,
+            marker=dict(size=10, color=base_colors, symbol="square"),
             showlegend=False
         ))
     
@@ -724,9 +1551,10 @@ def create_2d_projection(plan: Dict[str, Any], projection: str = "xy") -> go.Fig
     
     return fig
 
-def create_time_analysis(plan: Dict[str, Any]) -> go.Figure:
+def create_time_analysis(plan: Dict[str, Any], prepared: Dict[str, Any] = None) -> go.Figure:
     """
     Создает график анализа времени выполнения для каждого робота.
+    prepared — результат _prepare(plan); если не передан, вычисляется здесь.
     """
     logger.info("Создание анализа времени")
     
@@ -736,51 +1564,36 @@ def create_time_analysis(plan: Dict[str, Any]) -> go.Figure:
         vertical_spacing=0.1
     )
     
-    robots = plan["robots"]
-    colors = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray']
+    if prepared is None:
+        prepared = _prepare(plan)
+    trajs = prepared["trajs"]
+    colors = _ROBOT_COLORS
     
-    for i, robot in enumerate(robots):
+    for i, traj in enumerate(trajs):
         color = colors[i % len(colors)]
-        trajectory = robot["trajectory"]
         
-        if not trajectory:
+        if not len(traj.xyzt):
             continue
         
-        times = [p["t"] for p in trajectory]
-        xs = [p["x"] for p in trajectory]
-        ys = [p["y"] for p in trajectory]
-        zs = [p["z"] for p in trajectory]
+        times = traj.ts
         
         # Позиция по времени
         fig.add_trace(go.Scatter(
-            x=times, y=xs,
+            x=times, y=_display(traj.xyzt[:, 0]),
             mode="lines+markers",
-            name=f"Robot {robot['id']} X",
+            name=f"Robot {traj.id} X",
             line=dict(color=color, width=2),
             marker=dict(size=4)
         ), row=1, col=1)
         
-        # Вычисляем скорость (упрощенно)
-        if len(trajectory) > 1:
-            velocities = []
-            for j in range(1, len(trajectory)):
-                dt = times[j] - times[j-1]
-                if dt > 0:
-                    dx = xs[j] - xs[j-1]
-                    dy = ys[j] - ys[j-1]
-                    dz = zs[j] - zs[j-1]
-                    velocity = np.sqrt(dx**2 + dy**2 + dz**2) / dt
-                    velocities.append(velocity)
-                else:
-                    velocities.append(0)
-            
-            # Добавляем первую точку
-            velocities.insert(0, 0)
+        # Скорость (упрощенно) — посчитана в _prepare
+        if len(times) > 1:
+            velocities = prepared["speeds"][i]
             
             fig.add_trace(go.Scatter(
-                x=times, y=velocities,
+                x=times, y=_display(velocities),
                 mode="lines+markers",
-                name=f"Robot {robot['id']} Speed",
+                name=f"Robot {traj.id} Speed",
                 line=dict(color=color, width=2),
                 marker=dict(size=4)
             ), row=2, col=1)
@@ -798,473 +1611,1172 @@ def create_time_analysis(plan: Dict[str, Any]) -> go.Figure:
     
     return fig
 
-def show_visualization(plan: Dict[str, Any], visualization_type: str = "3d", progress_callback=None):
+# Обрамление HTML-документа вокруг фрагмента фигуры
+_HTML_HEAD = b'<html>\n<head><meta charset="utf-8" /></head>\n<body>\n'
+_HTML_TAIL = b'\n</body>\n</html>'
+_HTML_WRITE_BUFFER = 1 << 20
+
+# Типизированные массивы plotly.js (bdata) по dtype numpy
+_TYPED_ARRAY_DTYPES = {"int8": "i1", "uint8": "u1", "int16": "i2", "uint16": "u2",
+                       "int32": "i4", "uint32": "u4", "float32": "f4", "float64": "f8"}
+# Ключи, которые Plotly не переводит в bdata (см. _plotly_utils.utils.is_skipped_key)
+_TYPED_ARRAY_SKIPPED_KEYS = frozenset(("geojson", "layer", "layers", "range"))
+# Экранирование JSON внутри <script>, как в plotly.io (над байтами UTF-8 от orjson)
+_JSON_SCRIPT_ESCAPES = ((b"<", b"\\u003c"), (b">", b"\\u003e"), (b"/", b"\\u002f"),
+                        ("\u2028".encode("utf-8"), b"\\u2028"), ("\u2029".encode("utf-8"), b"\\u2029"))
+
+def _typed_array(values: np.ndarray):
     """
-    Главная функция визуализации.
+    Массив numpy -> спецификация typed array plotly.js (или сам массив, если нельзя).
+    Формат {"dtype", "bdata"} понимает plotly.js >= 2.28; бандл и тег CDN
+    plotly >= 6 (см. requirements.txt) ему соответствуют.
+    """
+    if values.size == 0:
+        return values
+    if values.dtype.kind in "iu" and values.dtype.itemsize == 8:
+        lo, hi = values.min(), values.max()
+        for dtype in ((np.int8, np.int16, np.int32) if values.dtype.kind == "i" else (np.uint8, np.uint16, np.uint32)):
+            info = np.iinfo(dtype)
+            if info.min <= lo and hi <= info.max:
+                values = values.astype(dtype)
+                break
+        else:
+            return values
+    short = _TYPED_ARRAY_DTYPES.get(values.dtype.name)
+    if short is None:
+        return values
+    spec = {"dtype": short, "bdata": base64.b64encode(np.ascontiguousarray(values)).decode("ascii")}
+    if values.ndim > 1:
+        spec["shape"] = str(values.shape)[1:-1]
+    return spec
+
+def _plotly_payload(obj):
+    """
+    Копия свойств фигуры с массивами numpy в виде typed array — то же, что
+    делает Figure.to_dict(), но без deepcopy всей фигуры и без проверки
+    каждого массива через narwhals.
+    """
+    if isinstance(obj, dict):
+        return {key: value if key in _TYPED_ARRAY_SKIPPED_KEYS else _plotly_payload(value)
+                for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plotly_payload(value) for value in obj]
+    if isinstance(obj, np.ndarray):
+        return _typed_array(obj)
+    return obj
+
+def _orjson_default(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError
+
+def _script_json(obj) -> bytes:
+    """JSON для вставки в <script>: байты UTF-8 от orjson без перекодирования в str."""
+    data = orjson.dumps(obj, default=_orjson_default,
+                        option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    for unsafe, safe in _JSON_SCRIPT_ESCAPES:
+        if unsafe in data:
+            data = data.replace(unsafe, safe)
+    return data
+
+@lru_cache(maxsize=1)
+def _plotlyjs_cdn_tag() -> str:
+    """Тег CDN plotly.js с SRI-хэшем; хэш бандла (~4 МБ) считается один раз за процесс."""
+    digest = hashlib.sha256(get_plotlyjs().encode("utf-8")).digest()
+    return (f'<script charset="utf-8" src="https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js" '
+            f'integrity="sha256-{base64.b64encode(digest).decode("ascii")}" crossorigin="anonymous"></script>')
+
+def _frames_json(frames: List[Dict[str, Any]]) -> Iterator[bytes]:
+    """
+    JSON-массив кадров по частям, кадр за кадром: JSON всей анимации
+    целиком в памяти не собирается и уходит в файл по мере кодирования.
+    """
+    yield b"["
+    for k, frame in enumerate(frames):
+        if k:
+            yield b","
+        yield _script_json(_plotly_payload(frame))
+    yield b"]"
+
+_PLOTLY_WINDOW_CONFIG = "<script>window.PlotlyConfig = {MathJaxConfig: 'local'};</script>"
+
+def _html_fragment(fig: go.Figure, config: Dict[str, Any], include_plotlyjs: str) -> Iterable[bytes]:
+    """
+    Фрагмент <div> со скриптом фигуры — эквивалент pio.to_html(full_html=False,
+    include_mathjax=False) для include_plotlyjs "cdn"/"directory": статичная
+    обвязка, а данные, layout и кадры сериализуются напрямую через orjson.
+    Возвращает части в байтах. Данные и layout кодируются сразу, а кадры
+    (самая большая часть) — лениво, по одному, без склейки в одну строку и
+    повторного кодирования. TypeError при обходе частей — повод для фолбэка.
+    Свойства читаются из внутренних _data/_layout/_frame_objs фигуры, а не
+    через to_plotly_json(), которая делает deepcopy всей фигуры.
+    """
+    div_id = str(uuid.uuid4())
+    layout = fig._layout
+    template_layout = layout.get("template", {}).get("layout", {})
+    size = []
+    for key in ("height", "width"):
+        value = layout.get(key, template_layout.get(key, "100%"))
+        size.append(f"{value}px" if isinstance(value, (int, float)) else value)
+    frames = [frame._props for frame in fig._frame_objs]
+    load_plotlyjs = _plotlyjs_cdn_tag() if include_plotlyjs == "cdn" else '<script charset="utf-8" src="plotly.min.js"></script>'
+    parts = [
+        (f'<div style="height:{size[0]}; width:{size[1]};">{_PLOTLY_WINDOW_CONFIG}{load_plotlyjs}'
+         f'<div id="{div_id}" class="plotly-graph-div" style="height:100%; width:100%;"></div>'
+         f'<script>window.PLOTLYENV=window.PLOTLYENV || {{}};'
+         f'if (document.getElementById("{div_id}")) {{Plotly.newPlot("{div_id}", ').encode("utf-8"),
+        _script_json(_plotly_payload(fig._data)), b", ",
+        _script_json(_plotly_payload(layout)), b", ",
+        _script_json(dict(config, responsive=config.get("responsive", True))), b")",
+    ]
+    if frames:
+        parts.append(f".then(function(){{Plotly.addFrames('{div_id}', ".encode("utf-8"))
+        tail = [f");}}).then(function(){{Plotly.animate('{div_id}', null);}})}};</script></div>".encode("utf-8")]
+        return itertools.chain(parts, _frames_json(frames), tail)
+    parts.append(b"};</script></div>")
+    return parts
+
+# Длительности кадра (мс) для слайдера скорости анимации
+_SPEED_STEPS_MS = (200, 120, 80, 60, 40, 20)
+
+def _play_opts(duration_ms: int) -> Dict[str, Any]:
+    """
+    Параметры Plotly.animate для проигрывания с заданной длительностью кадра.
+    redraw остаётся True: сцены gl3d (scatter3d/mesh3d) не поддерживают
+    анимированные переходы и без перерисовки кадр не отобразится; переход
+    нулевой длительности отключает анимацию по умолчанию (500 мс) между кадрами.
+    """
+    return {"frame": {"duration": duration_ms, "redraw": True}, "fromcurrent": True,
+            "mode": "immediate", "transition": {"duration": 0}}
+
+# Обновление кадра, очищающее меш руки, когда звеньев нет
+_EMPTY_MESH_UPDATE = dict(type="mesh3d", x=[], y=[], z=[], i=[], j=[], k=[])
+# Обновление кадра, скрывающее подсветку носителя, пока объект не переносится
+_EMPTY_CARRIER_UPDATE = dict(type="scatter3d", x=[], y=[], z=[], text=[])
+
+def _carry_table(obj: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray, List[Any]]:
+    """
+    Таблица переноса объекта: начала и концы интервалов и id носителей,
+    отсортированные по началу. Расширенный формат carry_schedule
+    ([{"by": id, "interval": [t0, t1]}, ...]) имеет приоритет над
+    carried_by + carry_intervals. Некорректные записи отбрасываются.
+    Интервалы одного объекта не должны перекрываться (передачи из рук в руки).
+    """
+    schedule = obj.get("carry_schedule")
+    if isinstance(schedule, list) and schedule:
+        rows = [(item["interval"][0], item["interval"][1], item["by"]) for item in schedule
+                if item.get("by") is not None and isinstance(item.get("interval"), list) and len(item["interval"]) == 2]
+    else:
+        carried_by = obj.get("carried_by")
+        intervals = obj.get("carry_intervals", []) if carried_by is not None else []
+        rows = [(iv[0], iv[1], carried_by) for iv in intervals if len(iv) == 2]
+    rows.sort(key=lambda row: row[0])
+    starts = np.array([row[0] for row in rows], dtype=np.float64)
+    ends = np.array([row[1] for row in rows], dtype=np.float64)
+    return starts, ends, [row[2] for row in rows]
+
+def _carriers_at_many(table: Tuple[np.ndarray, np.ndarray, List[Any]], times: np.ndarray) -> List[Any]:
+    """
+    id робота, несущего объект в каждый момент times (границы интервалов
+    включительно), либо None. Первый интервал с концом >= t находится одним
+    np.searchsorted на все моменты; на стыке передачи объект остаётся у
+    предыдущего носителя.
+    """
+    starts, ends, carriers = table
+    if not len(ends):
+        return [None] * len(times)
+    times = np.asarray(times, dtype=np.float64)
+    k = np.searchsorted(ends, times, side="left")
+    inside = k < len(ends)
+    inside[inside] = starts[k[inside]] <= times[inside]
+    return [carriers[kk] if ok else None for kk, ok in zip(k.tolist(), inside.tolist())]
+
+def _salient_time_indices(trajs: List[Any], times: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Индексы n_out моментов times для кадров анимации: LTTB по сигналу
+    активности s[t] = Σ по роботам |tcp(t) − tcp(t−1)|. Из каждой корзины
+    берётся самый заметный момент (начало движения, рывок), а не первый
+    попавшийся; первый и последний моменты сохраняются.
+    """
+    activity = np.zeros(len(times))
+    for tr in trajs:
+        if len(tr.ts):
+            tcp = _interp_xyz_many(tr.xyzt, times, tr.ts)
+            activity[1:] += np.linalg.norm(np.diff(tcp, axis=0), axis=1)
+    return _lttb_indices(np.column_stack((times, activity)), n_out)
+
+def create_3d_animation(plan: Dict[str, Any], progress_callback=None, prepared: Dict[str, Any] = None) -> go.Figure:
+    """
+    Создает 3D анимацию траекторий с кадрами по времени.
     
     Args:
         plan: План выполнения
-        visualization_type: Тип визуализации ("3d", "2d_xy", "2d_xz", "2d_yz", "time")
+        progress_callback: Функция для отчета о прогрессе (0..100)
+        prepared: Результат _prepare(plan) для повторного использования между вызовами
     """
-    logger.info(f"Запуск визуализации типа: {visualization_type}")
-    
-    try:
-        if visualization_type == "3d":
-            fig = create_3d_visualization(plan)
-        elif visualization_type == "3d_desktop":
-            # Десктопная визуализация с точечным воспроизведением
-            plan["desktop_mode"] = True
-            fig = create_desktop_3d_visualization(plan)
-        elif visualization_type.startswith("2d_"):
-            projection = visualization_type.split("_")[1]
-            fig = create_2d_projection(plan, projection)
-        elif visualization_type == "time":
-            fig = create_time_analysis(plan)
+    # Реал-тайм анимация с использованием кадров по времени
+    logger.info("Создание 3D анимации траекторий")
+    if prepared is None:
+        prepared = _prepare(plan)
+    # Траектории в виде массивов (N, 4) — для интерполяции TCP в кадрах
+    trajs = prepared["trajs"]
+    base_fig = create_3d_visualization({**plan, "robots": []})
+    # Границы сцены — по полному плану, иначе анимируемые роботы обрезаются
+    base_fig.update_scenes(**_scene_ranges(_plan_points(prepared, plan.get("objects", []))))
+    if callable(progress_callback):
+        try:
+            progress_callback(5)
+        except Exception:
+            pass
+
+    # Подготовка данных по роботам
+    robots = plan.get("robots", [])
+    colors = _ROBOT_COLORS
+    # Цвет и база каждого робота считаются один раз и используются
+    # и плейсхолдерами, и циклом кадров
+    robot_colors = [colors[i % len(colors)] for i in range(len(robots))]
+    bases = [tuple(robot.get("base_xyz", [0, 0, 0])) for robot in robots]
+
+    # Собираем уникальные отметки времени
+    time_stride = float(plan.get("anim_time_stride", 0.0))
+    timed = [tr.ts for tr in trajs if len(tr.ts)]
+    if not timed:
+        raise ValueError("Нет точек траектории для анимации")
+    if time_stride > 0:
+        # Регулярная сетка: нужны только границы — min/max по роботам без склейки массивов
+        t_min = float(min(ts.min() for ts in timed))
+        n_times = int(np.ceil((float(max(ts.max() for ts in timed)) - t_min) / time_stride)) + 1
+        times = t_min + np.arange(n_times) * time_stride
+    else:
+        times = np.unique(np.concatenate(timed))
+        n_times = len(times)
+
+    # АГРЕССИВНО ограничиваем количество кадров для экономии памяти
+    max_frames = int(plan.get("max_anim_frames", 50))  # По умолчанию очень мало кадров
+    n_frames = n_times
+    if n_times > max_frames and max_frames > 0:
+        n_frames = max_frames
+        logger.info(f"Ограничиваем анимацию: {n_frames} кадров из {n_times}")
+
+    # Дополнительное ограничение для больших сцен: вдвое меньше кадров
+    if len(robots) >= 6 and n_frames > 40:
+        n_frames = -(-n_frames // 2)
+        logger.info(f"Дополнительное ограничение для {len(robots)} роботов: {n_frames} кадров")
+
+    # Оставляем визуально значимые моменты (LTTB по активности роботов),
+    # а не каждый step-й: короткие перемещения между шагами не теряются
+    if n_frames < n_times:
+        if n_frames >= 3:
+            times = times[_salient_time_indices(trajs, times, n_frames)]
         else:
-            raise ValueError(f"Неизвестный тип визуализации: {visualization_type}")
-        
-        # Для простых типов визуализации возвращаем фигуру
-        if visualization_type != "3d_anim":
-            return fig
-        
-        # Для анимации продолжаем обработку
-        if visualization_type == "3d_anim":
-            # Реал-тайм анимация с использованием кадров по времени
-            logger.info("Создание 3D анимации траекторий")
-            base_fig = create_3d_visualization({**plan, "robots": []})
-            if callable(progress_callback):
-                try:
-                    progress_callback(5)
-                except Exception:
-                    pass
+            times = times[::int(np.ceil(n_times / n_frames))]
+    if callable(progress_callback):
+        try:
+            progress_callback(10)
+        except Exception:
+            pass
 
-            # Подготовка данных по роботам
-            robots = plan.get("robots", [])
-            colors = ['blue', 'red', 'green', 'orange', 'purple', 'brown', 'pink', 'gray']
-
-            # Собираем уникальные отметки времени
-            time_stride = float(plan.get("anim_time_stride", 0.0))
-            if time_stride > 0 and robots:
-                t_min = min(wp["t"] for r in robots for wp in r.get("trajectory", []) if r.get("trajectory"))
-                t_max = max(wp["t"] for r in robots for wp in r.get("trajectory", []) if r.get("trajectory"))
-                n = int(np.ceil((t_max - t_min) / time_stride))
-                times = [t_min + i * time_stride for i in range(n + 1)]
+    # Начальные следы (плейсхолдеры). Кадры обновляют их по индексам (Frame.traces),
+    # поэтому индекс каждого плейсхолдера запоминается при добавлении.
+    # Плейсхолдеры копятся словарями и добавляются в фигуру одним add_traces:
+    # каждый след проверяется Plotly один раз, а не при создании и при добавлении.
+    placeholders: List[Dict[str, Any]] = []
+    first_slot = len(base_fig.data)
+
+    def add_placeholder(trace: Dict[str, Any]) -> int:
+        placeholders.append(trace)
+        return first_slot + len(placeholders) - 1
+
+    # 1) TCP траектории (по роботу)
+    tcp_idx = []
+    for i, robot in enumerate(robots):
+        color = robot_colors[i]
+        tcp_idx.append(add_placeholder(dict(type="scatter3d", x=[], y=[], z=[], mode="lines+markers",
+                                            name=f"Robot {robot['id']}",
+                                            line=dict(width=6, color=color),
+                                            marker=dict(size=4, color=color))))
+
+    # 2) Руки всех роботов как линии — один след с NaN-разрывами,
+    # цвет вершины — номер робота (без легенды)
+    arm_idx = None
+    if robots:
+        arm_idx = add_placeholder(dict(type="scatter3d", x=[], y=[], z=[], mode="lines", name="Arms",
+                                       line=dict(width=6, color=[], **_color_index_scale(robot_colors)),
+                                       showlegend=False))
+
+    # Загрузка внешних мешей роботов (если задано в плане) - ОГРАНИЧИВАЕМ ТЯЖЕЛЫЕ МОДЕЛИ
+    robot_mesh_cfg = plan.get("robot_mesh")
+    robot_mesh_data = None
+    if load_obj is not None and isinstance(robot_mesh_cfg, dict):
+        path = robot_mesh_cfg.get("path")
+        scale = float(robot_mesh_cfg.get("scale", 1.0))
+        if isinstance(path, str):
+            # Проверяем, не тяжелый ли меш
+            try:
+                from core.mesh_loader import is_heavy_mesh
+                is_heavy = is_heavy_mesh(path)
+                if is_heavy:
+                    logger.warning(f"Тяжелый меш обнаружен: {path}, ОТКЛЮЧАЕМ для экономии памяти")
+                    robot_mesh_data = None  # Не загружаем тяжелые модели
+                    plan["robot_mesh"] = None  # Отключаем в плане
+                    plan["arm_mesh"] = True    # Используем простые сегменты
+                else:
+                    mesh = load_obj(path, scale)
+                    if mesh is not None:
+                        robot_mesh_data = mesh
+            except ImportError:
+                is_heavy = "1758706684_68d3bbfcdbb32.obj" in path
+                if is_heavy:
+                    logger.warning(f"Тяжелый меш обнаружен: {path}, ОТКЛЮЧАЕМ для экономии памяти")
+                    robot_mesh_data = None
+                    plan["robot_mesh"] = None
+                    plan["arm_mesh"] = True
+                else:
+                    mesh = load_obj(path, scale)
+                    if mesh is not None:
+                        robot_mesh_data = mesh
+
+    # Пользовательское описание руки/хватателя из внешнего файла (облегчённый формат)
+    hand_def = None
+    hand_cfg = plan.get("hand_definition")
+    if load_hand_definition is not None and isinstance(hand_cfg, dict):
+        hpath = hand_cfg.get("path")
+        hscale = float(hand_cfg.get("scale", 1.0))
+        if isinstance(hpath, str):
+            hand_def = load_hand_definition(hpath, hscale)
+
+    # 3D меш-рука (пер-сегментные боксы/цилиндры)
+    use_mesh_arm = bool(plan.get("arm_mesh", False))
+    arm_style = str(plan.get("arm_style", "box"))  # box|realistic
+    arm_mesh_idx = [None for _ in robots]  # индекс общего меша руки: звенья, сферы и пластины хваталки
+    gripper_idx = None  # индекс общего следа линий хватателей из hand_definition
+    if use_mesh_arm:
+        for i, robot in enumerate(robots):
+            # Один пустой меш-заготовка на робота: кадры заменяют его склеенным мешем руки
+            arm_mesh_idx[i] = add_placeholder(dict(type="mesh3d", x=[], y=[], z=[], i=[], j=[], k=[],
+                                                   color=robot_colors[i], opacity=0.0,
+                                                   name=f"ArmMesh R{robot.get('id')}", showlegend=False))
+        if hand_def is not None and robots:
+            # Хвататели всех роботов — один след, как и линии рук
+            gripper_idx = add_placeholder(dict(type="scatter3d", x=[], y=[], z=[], mode="lines", name="Grippers",
+                                               line=dict(width=6, color=[], **_color_index_scale(robot_colors)),
+                                               showlegend=False))
+
+    # Если хотим заменить «двигающуюся дугу» реальной моделью руки — готовим плейсхолдеры меша (по одному на робота)
+    use_robot_mesh = robot_mesh_data is not None
+    if use_robot_mesh:
+        robot_mesh_data = _mesh_arrays(robot_mesh_data)
+    replace_arc_with_model = bool(use_robot_mesh)
+    # Лёгкий режим: не обновлять меш в каждом кадре, только статически на t0
+    light_mesh_anim = bool(plan.get("light_mesh_anim", False))  # По умолчанию отключаем легкий режим для анимации модели
+
+    # Добавляем плейсхолдеры для 3D моделей роботов (по одному на робота)
+    robot_mesh_idx = [None for _ in robots]
+    if use_robot_mesh and replace_arc_with_model:
+        xs0, ys0, zs0, is0, js0, ks0 = robot_mesh_data
+        for i, robot in enumerate(robots):
+            # Создаем пустой плейсхолдер для 3D модели робота
+            robot_mesh_idx[i] = add_placeholder(dict(type="mesh3d", x=[], y=[], z=[], i=[], j=[], k=[],
+                                                     color=robot_colors[i], opacity=0.7,
+                                                     name=f"RobotMesh R{robot.get('id')}", showlegend=False))
+    objects = plan.get("objects", [])
+    # Рёбра объектов — один след на цвет (как в статичной сцене): кубы группы
+    # идут подряд в obj_order, кадр режет общий результат _cubes_edges по группам
+    obj_groups: Dict[str, List[int]] = {}
+    for o, obj in enumerate(objects):
+        obj_groups.setdefault(obj.get("color", "red"), []).append(o)
+    obj_order = [o for members in obj_groups.values() for o in members]
+    obj_group_idx = []
+    obj_group_ends = np.cumsum([36 * len(members) for members in obj_groups.values()]).tolist()
+    for color, members in obj_groups.items():
+        name = f"Object {objects[members[0]].get('id', '?')}" if len(members) == 1 else "Objects"
+        obj_group_idx.append(add_placeholder(dict(type="scatter3d", x=[], y=[], z=[], mode="lines", name=name,
+                                                  line=dict(color=color, width=6))))
+    carrier_idx = []
+    for obj in objects:
+        # Подсветка TCP текущего носителя объекта
+        carrier_idx.append(add_placeholder(dict(type="scatter3d", x=[], y=[], z=[], mode="markers+text",
+                                                marker=dict(size=6, color="yellow"), textposition="top center",
+                                                showlegend=False)))
+    base_fig.add_traces(placeholders)
+
+    # Число кадров известно заранее: список кадров заполняется по индексу
+    frames = [None] * len(times)
+    # Индекс робота по id для поиска носителя объекта (при повторе id — первый, как раньше)
+    robot_index_by_id = {tr.id: i for i, tr in reversed(list(enumerate(trajs)))}
+    # Подпись и имя подсветки носителя — по одной строке на робота, а не на кадр
+    carrier_labels = {rid: (f"R{rid}", f"Carrier R{rid}") for rid in robot_index_by_id}
+    # Проверяем, используем ли легкий режим анимации
+    light_mesh_anim = bool(plan.get("light_mesh_anim", False))
+
+    # Инварианты цикла кадров: параметры руки и статические данные роботов
+    arm_segs = max(2, int(plan.get("arm_segments", 5)))
+    arm_bulge = float(plan.get("arm_bulge", 0.18))
+    arm_model = str(plan.get("arm_model", "curved"))
+    thickness = float(plan.get("arm_thickness", 0.06))
+    show_arm_line = bool(plan.get("show_arm_line", True))
+    arm_details = bool(plan.get("arm_details", True))
+    many_robots = len(robots) >= 6
+    robot_ids = [robot.get("id") for robot in robots]
+    # Коэффициент интерполяции позы меша на каждый кадр: доля времени между первой
+    # и последней точкой траектории (в лёгком режиме поза не интерполируется)
+    pose_alphas = [
+        ((np.asarray(times, dtype=np.float64) - tr.ts[0]) / (tr.ts[-1] - tr.ts[0])).tolist()
+        if len(tr.ts) > 1 and tr.ts[0] < tr.ts[-1] and not light_mesh_anim else [0.0] * len(times)
+        for tr in trajs
+    ]
+    # Таблицы переноса объектов (интервалы отсортированы по началу)
+    carry_tables = [_carry_table(obj) for obj in objects]
+    # Размер и исходный центр объектов не зависят от кадра — читаем из плана один раз
+    obj_sizes = np.array([float(objects[o].get("size", 0.1)) for o in obj_order], dtype=np.float64)
+    obj_centers = [tuple(obj.get("initial_position", [0, 0, 0])) for obj in objects]
+    # Носитель каждого объекта на каждый кадр (id робота или None)
+    carriers_by_frame = [_carriers_at_many(table, times) for table in carry_tables]
+    # Подписи кадров — общие для имён кадров и шагов слайдера
+    labels = [f"t={t:.2f}" for t in times]
+    # Позиции TCP всех роботов на все моменты кадров — по одному векторному вызову на робота
+    # (кортежи готовы заранее: их используют и рука, и перенос объектов)
+    tcp_rows = [list(map(tuple, _interp_xyz_many(tr.xyzt, times, tr.ts).tolist())) for tr in trajs]
+    # След TCP: концы пройденной части на каждый кадр (один searchsorted на робота)
+    # и координаты (3, N) в _DISPLAY_DTYPE — в кадре только срезы без копий
+    trail_ends = [np.searchsorted(tr.ts, times, side="right").tolist() for tr in trajs]
+    trail_cols = [np.ascontiguousarray(_display(tr.xyzt[:, :3]).T) for tr in trajs]
+    # Линии хватателя из hand_definition: отрезки (3, 3·n) с NaN-разрывами
+    # относительно TCP — в кадре только перенос на TCP одной операцией
+    gripper_lines = None
+    if hand_def is not None and hand_def.get('vertices') and hand_def.get('segments'):
+        verts = np.asarray(hand_def['vertices'], dtype=np.float64).reshape(-1, 3)
+        pairs = np.asarray(hand_def['segments'], dtype=np.int64).reshape(-1, 2)
+        pairs = pairs[((pairs >= 0) & (pairs < len(verts))).all(axis=1)]
+        gripper_lines = np.ascontiguousarray(_segment_lines(verts[pairs[:, 0]], verts[pairs[:, 1]]).T)
+
+    for idx, t in enumerate(times):
+        # Один проход по роботам: след TCP, рука и позиция TCP на момент t.
+        # Кадр содержит только изменившиеся данные; frame_traces — индексы
+        # плейсхолдеров base_fig, к которым они применяются.
+        frame_data = []
+        frame_traces = []
+        # Линии рук и хвататели копятся по роботам и уходят в кадр одним следом
+        arm_parts = []
+        gripper_parts = []
+        for i in range(len(robots)):
+            color = robot_colors[i]
+            # Пройденная часть траектории — срез до t
+            end = trail_ends[i][idx]
+            trail = trail_cols[i][:, :end]
+
+            # Для больших сцен ограничиваем количество точек
+            if many_robots and end > 20:
+                # Берем только каждую 2-ю точку
+                trail = trail[:, ::2]
+            elif end > 50:
+                # Для любых сцен ограничиваем до 50 точек
+                trail = trail[:, -50:]
+
+            frame_data.append(dict(type="scatter3d", x=trail[0], y=trail[1], z=trail[2]))
+            frame_traces.append(tcp_idx[i])
+
+            # Манипулятор: звенья base→tcp или 3D модель робота
+            base = bases[i]
+            tcp = tcp_rows[i][idx]
+            if replace_arc_with_model and use_robot_mesh:
+                # Анимируем 3D модель робота
+                robot_mesh = _create_robot_pose_mesh(
+                    robot_mesh_data, base, tcp,
+                    color, robot_ids[i],
+                    pose_alphas[i][idx]
+                )
+                # При ошибке позы возвращается линия base→tcp — она идёт в след рук
+                if robot_mesh["type"] == "mesh3d":
+                    frame_data.append(robot_mesh)
+                    frame_traces.append(robot_mesh_idx[i])
+                else:
+                    arm_parts.append((i, robot_mesh["x"], robot_mesh["y"], robot_mesh["z"]))
             else:
-                times: List[float] = sorted({wp["t"] for r in robots for wp in r.get("trajectory", [])})
-            if not times:
-                raise ValueError("Нет точек траектории для анимации")
-
-            # АГРЕССИВНО ограничиваем количество кадров для экономии памяти
-            max_frames = int(plan.get("max_anim_frames", 50))  # По умолчанию очень мало кадров
-            if len(times) > max_frames and max_frames > 0:
-                step = int(np.ceil(len(times) / max_frames))
-                times = times[::step]
-                logger.info(f"Ограничиваем анимацию: {len(times)} кадров из {len(times) * step}")
-            
-            # Дополнительное ограничение для больших сцен
-            if len(robots) >= 6 and len(times) > 40:
-                times = times[::2]  # Берем каждый второй кадр
-                logger.info(f"Дополнительное ограничение для {len(robots)} роботов: {len(times)} кадров")
-            if callable(progress_callback):
-                try:
-                    progress_callback(10)
-                except Exception:
-                    pass
+                joints = _arm_segments(base, tcp, segments=arm_segs, bulge=arm_bulge, model=arm_model)
+                # Линия-дуга руки (по желанию)
+                if show_arm_line:
+                    arm_parts.append((i, *_polyline_segments(joints)))
 
-            # Начальные следы (плейсхолдеры) — важно: порядок и количество должны совпадать с кадрами
-            # 1) TCP траектории (по роботу)
-            for i, robot in enumerate(robots):
-                color = colors[i % len(colors)]
-                base_fig.add_trace(go.Scatter3d(x=[], y=[], z=[], mode="lines+markers",
-                                                name=f"Robot {robot['id']}",
-                                                line=dict(width=6, color=color),
-                                                marker=dict(size=4, color=color)))
-
-            # 2) Рука как линии (по роботу) — убираем дублирование и легенду
-            for i, robot in enumerate(robots):
-                base_fig.add_trace(go.Scatter3d(x=[], y=[], z=[], mode="lines",
-                                                name=f"Arm R{robot['id']}",
-                                                line=dict(width=6, color=colors[i % len(colors)]),
-                                                showlegend=False))
-
-            # Загрузка внешних мешей роботов (если задано в плане) - ОГРАНИЧИВАЕМ ТЯЖЕЛЫЕ МОДЕЛИ
-            robot_mesh_cfg = plan.get("robot_mesh")
-            robot_mesh_data = None
-            if load_obj is not None and isinstance(robot_mesh_cfg, dict):
-                path = robot_mesh_cfg.get("path")
-                scale = float(robot_mesh_cfg.get("scale", 1.0))
-                if isinstance(path, str):
-                    # Проверяем, не тяжелый ли меш
-                    try:
-                        from core.mesh_loader import is_heavy_mesh
-                        is_heavy = is_heavy_mesh(path)
-                        if is_heavy:
-                            logger.warning(f"Тяжелый меш обнаружен: {path}, ОТКЛЮЧАЕМ для экономии памяти")
-                            robot_mesh_data = None  # Не загружаем тяжелые модели
-                            plan["robot_mesh"] = None  # Отключаем в плане
-                            plan["arm_mesh"] = True    # Используем простые сегменты
-                        else:
-                            mesh = load_obj(path, scale)
-                            if mesh is not None:
-                                robot_mesh_data = mesh
-                    except ImportError:
-                        is_heavy = "1758706684_68d3bbfcdbb32.obj" in path
-                        if is_heavy:
-                            logger.warning(f"Тяжелый меш обнаружен: {path}, ОТКЛЮЧАЕМ для экономии памяти")
-                            robot_mesh_data = None
-                            plan["robot_mesh"] = None
-                            plan["arm_mesh"] = True
-                        else:
-                            mesh = load_obj(path, scale)
-                            if mesh is not None:
-                                robot_mesh_data = mesh
-
-            # Пользовательское описание руки/хватателя из внешнего файла (облегчённый формат)
-            hand_def = None
-            hand_cfg = plan.get("hand_definition")
-            if load_hand_definition is not None and isinstance(hand_cfg, dict):
-                hpath = hand_cfg.get("path")
-                hscale = float(hand_cfg.get("scale", 1.0))
-                if isinstance(hpath, str):
-                    hand_def = load_hand_definition(hpath, hscale)
-
-            # 3D меш-рука (пер-сегментные боксы/цилиндры)
-            use_mesh_arm = bool(plan.get("arm_mesh", False))
-            arm_style = str(plan.get("arm_style", "box"))  # box|realistic
-            mesh_arm_counts = []  # сколько Mesh3d на робота
-            if use_mesh_arm:
-                for i, robot in enumerate(robots):
-                    segs = int(plan.get("arm_segments", 5))
-                    cnt = max(2, segs)
-                    mesh_arm_counts.append(cnt)
-                    for _ in range(cnt):
-                        # Добавляем пустой меш-заготовку на каждый сегмент
-                        if arm_style == "realistic":
-                            placeholder = _oriented_cylinder_mesh(tuple(robot.get("base_xyz", [0,0,0])), tuple(robot.get("base_xyz", [0,0,0])), radius=0.001, color=colors[i % len(colors)], segments=14)
-                        else:
-                            placeholder = _box_mesh(tuple(robot.get("base_xyz", [0,0,0])), (0.001, 0.001, 0.001), color=colors[i % len(colors)])
-                        placeholder.update(opacity=0.0, showlegend=False, name=f"ArmMesh R{robot.get('id')}")
-                        base_fig.add_trace(placeholder)
-                    # Дополнительные плейсхолдеры: плечо, локоть, запястье (сферы) и простая хваталка (2 элемента)
-                    for _ in range(5):
-                        sph = _sphere_mesh(tuple(robot.get("base_xyz", [0,0,0])), radius=0.001, color=colors[i % len(colors)])
-                        sph.update(opacity=0.0, showlegend=False, name=f"ArmDetail R{robot.get('id')}")
-                        base_fig.add_trace(sph)
+            # Mesh-представление (боксы/цилиндры по сегментам) — используем только если НЕ заменяем реальной моделью
+            if use_mesh_arm and not replace_arc_with_model:
+                # Если есть внешний hand_definition — рисуем детальный хвататель как линии
+                if gripper_lines is not None and arm_details:
+                    # трансформ: привязываем к TCP (упрощенно: перенос без вращения)
+                    hand = gripper_lines + np.asarray(tcp, dtype=np.float64)[:, None]
+                    gripper_parts.append((i, hand[0], hand[1], hand[2]))
+                # Звенья и детали — один склеенный меш руки на кадр
+                frame_data.append(_arm_mesh(joints, tcp, thickness, arm_style == "realistic", arm_details, color))
+                frame_traces.append(arm_mesh_idx[i])
             else:
-                mesh_arm_counts = [0 for _ in robots]
+                # Если меш-рука отключена, но плейсхолдеры были не добавлены — ничего не добавляем и в кадрах
+                pass
 
-            # Если хотим заменить «двигающуюся дугу» реальной моделью руки — готовим плейсхолдеры меша (по одному на робота)
-            use_robot_mesh = robot_mesh_data is not None
-            replace_arc_with_model = bool(use_robot_mesh)
-            # Лёгкий режим: не обновлять меш в каждом кадре, только статически на t0
-            light_mesh_anim = bool(plan.get("light_mesh_anim", False))  # По умолчанию отключаем легкий режим для анимации модели
-            
-            # Добавляем плейсхолдеры для 3D моделей роботов (по одному на робота)
-            if use_robot_mesh and replace_arc_with_model:
-                xs0, ys0, zs0, is0, js0, ks0 = robot_mesh_data
-                for i, robot in enumerate(robots):
-                    # Создаем пустой плейсхолдер для 3D модели робота
-                    placeholder = go.Mesh3d(x=[], y=[], z=[], i=[], j=[], k=[],
-                                            color=colors[i % len(colors)], opacity=0.7,
-                                            name=f"RobotMesh R{robot.get('id')}", showlegend=False)
-                    base_fig.add_trace(placeholder)
-            objects = plan.get("objects", [])
-            for obj in objects:
-                base_fig.add_trace(go.Scatter3d(x=[], y=[], z=[], mode="lines",
-                                                name=f"Object {obj.get('id','?')}",
-                                                line=dict(color=obj.get("color", "red"), width=6)))
-
-            frames = []
-            # Проверяем, используем ли легкий режим анимации
-            light_mesh_anim = bool(plan.get("light_mesh_anim", False))
-            
-            for idx, t in enumerate(times):
-                frame_data = []
-                for i, robot in enumerate(robots):
-                    # Ограничиваем количество точек траектории для экономии памяти
-                    trajectory_points = [p for p in robot["trajectory"] if p["t"] <= t]
-                    
-                    # Для больших сцен ограничиваем количество точек
-                    if len(robots) >= 6 and len(trajectory_points) > 20:
-                        # Берем только каждую 2-ю точку
-                        trajectory_points = trajectory_points[::2]
-                    elif len(trajectory_points) > 50:
-                        # Для любых сцен ограничиваем до 50 точек
-                        trajectory_points = trajectory_points[-50:]
-                    
-                    xs = [p["x"] for p in trajectory_points]
-                    ys = [p["y"] for p in trajectory_points]
-                    zs = [p["z"] for p in trajectory_points]
-                    
-                    tcp_trace = go.Scatter3d(x=xs, y=ys, z=zs, mode="lines+markers",
-                                             line=dict(width=6, color=colors[i % len(colors)]),
-                                             marker=dict(size=4, color=colors[i % len(colors)]),
-                                             name=f"Robot {robots[i].get('id')}")
-                    frame_data.append(tcp_trace)
-
-                # Манипулятор: звенья base→tcp или 3D модель робота
-                for i, robot in enumerate(robots):
-                    base = tuple(robot.get("base_xyz", [0, 0, 0]))
-                    tcp = _interpolate_position(robot.get("trajectory", []), t)
-                    if replace_arc_with_model and use_robot_mesh:
-                        # Анимируем 3D модель робота
-                        if light_mesh_anim:
-                            # В легком режиме используем статичную модель без интерполяции позы
-                            robot_mesh = _create_robot_pose_mesh(
-                                robot_mesh_data, base, tcp, 
-                                colors[i % len(colors)], robot.get('id'), 
-                                0.0  # Без интерполяции позы
-                            )
-                        else:
-                            # Полная анимация с интерполяцией позы
-                            trajectory = robot.get("trajectory", [])
-                            if len(trajectory) > 1:
-                                t_prev = trajectory[0]["t"]
-                                t_next = trajectory[-1]["t"]
-                                if t_prev < t_next:
-                                    pose_interpolation = (t - t_prev) / (t_next - t_prev)
-                                else:
-                                    pose_interpolation = 0.0
-                            else:
-                                pose_interpolation = 0.0
-                            
-                            robot_mesh = _create_robot_pose_mesh(
-                                robot_mesh_data, base, tcp, 
-                                colors[i % len(colors)], robot.get('id'), 
-                                pose_interpolation
-                            )
-                        frame_data.append(robot_mesh)
-                    else:
-                        segs = int(plan.get("arm_segments", 5))
-                        arm_model = str(plan.get("arm_model", "curved"))
-                        joints = _arm_segments(base, tcp, segments=max(2, segs), bulge=float(plan.get("arm_bulge", 0.18)), model=arm_model)
-                        # Линия-дуга руки (по желанию)
-                        if bool(plan.get("show_arm_line", True)):
-                            xs_l = []
-                            ys_l = []
-                            zs_l = []
-                            for j in range(len(joints) - 1):
-                                xs_l += [joints[j][0], joints[j+1][0], None]
-                                ys_l += [joints[j][1], joints[j+1][1], None]
-                                zs_l += [joints[j][2], joints[j+1][2], None]
-                            arm_trace = go.Scatter3d(x=xs_l, y=ys_l, z=zs_l, mode="lines",
-                                                     line=dict(width=6, color=colors[i % len(colors)]),
-                                                     name=f"Arm R{robot.get('id')}",
-                                                     showlegend=False)
-                            frame_data.append(arm_trace)
-
-                    # Mesh-представление (боксы/цилиндры по сегментам) — используем только если НЕ заменяем реальной моделью
-                    if use_mesh_arm and not replace_arc_with_model:
-                        thickness = float(plan.get("arm_thickness", 0.06))
-                        for j in range(len(joints) - 1):
-                            p1 = (joints[j][0], joints[j][1], joints[j][2])
-                            p2 = (joints[j+1][0], joints[j+1][1], joints[j+1][2])
-                            if arm_style == "realistic":
-                                mesh = _oriented_cylinder_mesh(p1, p2, radius=thickness * 0.5, color=colors[i % len(colors)], segments=14)
-                            else:
-                                mesh = _oriented_box_mesh(p1, p2, thickness=thickness, color=colors[i % len(colors)])
-                            mesh.update(name=f"ArmMesh R{robot.get('id')}", showlegend=False)
-                            frame_data.append(mesh)
-                        # Если есть внешний hand_definition — рисуем детальный хвататель как линии
-                        if hand_def is not None and bool(plan.get("arm_details", True)):
-                            verts = hand_def.get('vertices', [])
-                            segs_idx = hand_def.get('segments', [])
-                            if verts and segs_idx:
-                                # трансформ: привязываем к TCP и ориентируем по последнему звену (упрощенно: перенос без вращения)
-                                dx, dy, dz = tcp
-                                hx = []; hy = []; hz = []
-                                for a_idx, b_idx in segs_idx:
-                                    if 0 <= a_idx < len(verts) and 0 <= b_idx < len(verts):
-                                        ax, ay, az = verts[a_idx]
-                                        bx, by, bz = verts[b_idx]
-                                        hx += [ax + dx, bx + dx, None]
-                                        hy += [ay + dy, by + dy, None]
-                                        hz += [az + dz, bz + dz, None]
-                                frame_data.append(go.Scatter3d(x=hx, y=hy, z=hz, mode="lines", line=dict(width=6, color=colors[i % len(colors)]), name=f"Gripper R{robot.get('id')}", showlegend=False))
-                                frame_data_no_arms.append(go.Scatter3d(x=hx, y=hy, z=hz, mode="lines", line=dict(width=0, color=colors[i % len(colors)]), name=f"Gripper R{robot.get('id')}", showlegend=False))
-                        # Узлы: плечо, локоть, запястье
-                        if bool(plan.get("arm_details", True)) and len(joints) >= 3:
-                            shoulder = joints[0]
-                            elbow = joints[len(joints)//2]
-                            wrist = joints[-2]
-                            sph_r = thickness * 0.9
-                            for center in (shoulder, elbow, wrist):
-                                sph = _sphere_mesh(center, sph_r, color=colors[i % len(colors)])
-                                frame_data.append(sph)
-                        # Простая хваталка: две тонкие пластины у TCP
-                        if bool(plan.get("arm_details", True)):
-                            tcp_arr = np.array(tcp, dtype=float)
-                            prev_arr = np.array(joints[-2], dtype=float)
-                            dir_vec = tcp_arr - prev_arr
-                            n = np.linalg.norm(dir_vec)
-                            if n > 1e-9:
-                                dir_vec = dir_vec / n
-                            else:
-                                dir_vec = np.array([1.0, 0.0, 0.0])
-                            ref = np.array([0.0, 0.0, 1.0])
-                            side = np.cross(dir_vec, ref)
-                            if np.linalg.norm(side) < 1e-6:
-                                ref = np.array([0.0, 1.0, 0.0])
-                                side = np.cross(dir_vec, ref)
-                            side = side / (np.linalg.norm(side) + 1e-12)
-                            gap = thickness * 0.6
-                            plate_len = thickness * 2.0
-                            plate_th = thickness * 0.25
-                            p_left1 = tuple(tcp_arr + side * gap)
-                            p_left2 = tuple(tcp_arr + side * gap + dir_vec * plate_len)
-                            p_right1 = tuple(tcp_arr - side * gap)
-                            p_right2 = tuple(tcp_arr - side * gap + dir_vec * plate_len)
-                            left_plate = _oriented_box_mesh(p_left1, p_left2, thickness=plate_th, color=colors[i % len(colors)])
-                            right_plate = _oriented_box_mesh(p_right1, p_right2, thickness=plate_th, color=colors[i % len(colors)])
-                            left_plate.update(showlegend=False); right_plate.update(showlegend=False)
-                            frame_data.append(left_plate); frame_data.append(right_plate)
-                    else:
-                        # Если меш-рука отключена, но плейсхолдеры были не добавлены — ничего не добавляем и в кадрах
-                        pass
+            # Внешний меш уже добавлен статически выше, не добавляем в каждый кадр, чтобы избежать зависаний
 
-                    # Внешний меш уже добавлен статически выше, не добавляем в каждый кадр, чтобы избежать зависаний
+        if arm_parts:
+            frame_data.append(_merged_lines(arm_parts))
+            frame_traces.append(arm_idx)
+        if gripper_parts:
+            frame_data.append(_merged_lines(gripper_parts))
+            frame_traces.append(gripper_idx)
 
-                # Объекты: перенос с TCP, если в carry_intervals
-                for obj in objects:
-                    size = float(obj.get("size", 0.1))
-                    center = tuple(obj.get("initial_position", [0, 0, 0]))
-                    # Расширенная логика переноса: carry_schedule или carry_intervals
-                    schedule = obj.get("carry_schedule")
+        # Объекты: перенос с TCP, если в carry_intervals
+        centers = []
+        for o in range(len(objects)):
+            center = obj_centers[o]
+            current_carrier_id = carriers_by_frame[o][idx]
+            carrier_tcp = None
+            if current_carrier_id is not None:
+                k = robot_index_by_id.get(current_carrier_id)
+                if k is not None:
+                    center = carrier_tcp = tcp_rows[k][idx]
+                else:
                     current_carrier_id = None
-                    if isinstance(schedule, list) and schedule:
-                        for item in schedule:
-                            by = item.get("by")
-                            interval = item.get("interval", [])
-                            if isinstance(interval, list) and len(interval) == 2 and interval[0] <= t <= interval[1] and by is not None:
-                                robot = next((r for r in robots if r.get("id") == by), None)
-                                if robot is not None:
-                                    center = _interpolate_position(robot.get("trajectory", []), t)
-                                    current_carrier_id = by
-                                break
-                    else:
-                        carried_by = obj.get("carried_by")
-                        intervals = obj.get("carry_intervals", [])
-                        if carried_by is not None:
-                            for iv in intervals:
-                                if len(iv) == 2 and iv[0] <= t <= iv[1]:
-                                    robot = next((r for r in robots if r.get("id") == carried_by), None)
-                                    if robot is not None:
-                                        center = _interpolate_position(robot.get("trajectory", []), t)
-                                        current_carrier_id = carried_by
-                                    break
-                    xs, ys, zs = _cube_edges(center, size)
-                    obj_trace = go.Scatter3d(x=xs, y=ys, z=zs, mode="lines",
-                                             line=dict(color=obj.get("color", "red"), width=6))
-                    frame_data.append(obj_trace)
-                    frame_data_no_arms.append(obj_trace)
-                    # Подсветка TCP текущего носителя и подпись
-                    if current_carrier_id is not None:
-                        carrier = next((r for r in robots if r.get("id") == current_carrier_id), None)
-                        if carrier is not None:
-                            tcp = _interpolate_position(carrier.get("trajectory", []), t)
-                            frame_data.append(go.Scatter3d(x=[tcp[0]], y=[tcp[1]], z=[tcp[2]],
-                                                           mode="markers+text",
-                                                           marker=dict(size=6, color="yellow"),
-                                                           text=[f"R{current_carrier_id}"], textposition="top center",
-                                                           name=f"Carrier R{current_carrier_id}", showlegend=False))
-                frames.append(go.Frame(data=frame_data, name=f"t={t:.2f}"))
-                if callable(progress_callback):
-                    # 10..95% в процессе подготовки кадров
-                    pct = 10 + int(85 * (idx + 1) / max(1, len(times)))
-                    try:
-                        progress_callback(min(95, max(10, pct)))
-                    except Exception:
-                        pass
+            centers.append(center)
+            # Подсветка TCP текущего носителя и подпись (пустая — объект не переносится)
+            if carrier_tcp is not None:
+                cx, cy, cz = _display(carrier_tcp)[:, None]
+                label, name = carrier_labels[current_carrier_id]
+                frame_data.append(dict(type="scatter3d", x=cx, y=cy, z=cz, text=[label], name=name))
+            else:
+                frame_data.append(_EMPTY_CARRIER_UPDATE)
+            frame_traces.append(carrier_idx[o])
+        if objects:
+            # Рёбра всех кубов — одним вызовом, затем срезы по группам цвета
+            xs, ys, zs = _cubes_edges([centers[o] for o in obj_order], obj_sizes)
+            lo = 0
+            for g, hi in enumerate(obj_group_ends):
+                frame_data.append(dict(type="scatter3d", x=xs[lo:hi], y=ys[lo:hi], z=zs[lo:hi]))
+                frame_traces.append(obj_group_idx[g])
+                lo = hi
+        # Кадр — обычный словарь: Plotly проверяет его один раз при update(frames=...),
+        # а не повторно при создании go.Frame и при присваивании. Массивы сразу
+        # в виде typed array (как в JSON): валидаторы пропускают их как есть,
+        # без перевода каждого массива через narwhals
+        frames[idx] = dict(data=_plotly_payload(frame_data), traces=frame_traces, name=labels[idx])
+        if callable(progress_callback):
+            # 10..95% в процессе подготовки кадров
+            pct = 10 + int(85 * (idx + 1) / max(1, len(times)))
+            try:
+                progress_callback(min(95, max(10, pct)))
+            except Exception:
+                pass
+
+    base_fig.update(frames=frames)
+    if callable(progress_callback):
+        try:
+            progress_callback(97)
+        except Exception:
+            pass
+    # Кнопки Play/Pause и слайдеры (время и скорость); шаг слайдера ссылается на кадр по той же подписи
+    step_opts = {"mode": "immediate", "frame": {"duration": 0, "redraw": True}, "transition": {"duration": 0}}
+    steps = [{"method": "animate", "label": label, "args": [[label], step_opts]} for label in labels]
+    # Переключатель «С руками/Без рук»: один restyle видимости следов руки.
+    # Кадры видимость не трогают, поэтому выбор сохраняется при проигрывании
+    arm_traces = [k for k in [arm_idx, gripper_idx, *arm_mesh_idx, *robot_mesh_idx] if k is not None]
+    arm_toggle = []
+    if arm_traces:
+        arm_toggle.append({
+            "type": "buttons",
+            "showactive": True,
+            "x": 0.22,
+            "y": 0.95,
+            "direction": "left",
+            "pad": {"r": 10, "t": 5},
+            "buttons": [
+                {"label": "С руками", "method": "restyle", "args": [{"visible": True}, arm_traces]},
+                {"label": "Без рук", "method": "restyle", "args": [{"visible": False}, arm_traces]},
+            ]
+        })
+    base_fig.update_layout(
+        updatemenus=[
+            {
+                "type": "buttons",
+                "showactive": True,
+                "x": 0.02,
+                "y": 0.95,
+                "direction": "left",
+                "pad": {"r": 10, "t": 5},
+                "buttons": [
+                    {"label": "▶ Старт", "method": "animate", "args": [None, _play_opts(80)]},
+                    {"label": "⏸ Пауза", "method": "animate", "args": [[None], {"frame": {"duration": 0, "redraw": False}, "mode": "immediate", "transition": {"duration": 0}}]},
+                ]
+            },
+            *arm_toggle,
+        ],
+        # Первый слайдер — по времени
+        sliders=[{
+            "active": 0,
+            "currentvalue": {"prefix": "t=", "suffix": "", "visible": True},
+            "pad": {"t": 30},
+            "steps": steps,
+            "x": 0.02,
+            "y": 0.02
+        },
+        # Второй слайдер — скорость анимации (frame duration)
+        {
+            "active": 3,
+            "currentvalue": {"prefix": "Speed: ", "suffix": " ms/frame", "visible": True},
+            "pad": {"t": 10},
+            "steps": [
+                {"label": str(ms), "method": "animate", "args": [None, _play_opts(ms)]}
+                for ms in _SPEED_STEPS_MS
+            ],
+            "x": 0.02,
+            "y": 0.08
+        }]
+    )
+
+    # Улучшаем UX легенды: явная подсказка и оформление
+    base_fig.update_layout(
+        legend_title_text="Robots (кликните для скрытия/показа)",
+        legend=dict(
+            yanchor="top",
+            y=0.99,
+            xanchor="left",
+            x=0.02,
+            borderwidth=1,
+            bgcolor="rgba(255,255,255,0.6)",
+            itemclick="toggle",
+            itemdoubleclick="toggleothers"
+        ),
+        annotations=[dict(
+            text="Подсказка: кликайте по элементам легенды, чтобы скрыть/показать роботов",
+            showarrow=False,
+            xref="paper", yref="paper",
+            x=0.35, y=1.06, xanchor="left", yanchor="bottom",
+            font=dict(size=12, color="#555")
+        )]
+    )
+
+    return base_fig
+
+
+def _write_html(fig: go.Figure, fh, config: Dict[str, Any], include_plotlyjs: str = "cdn",
+                fast: bool = True) -> None:
+    """
+    Пишет фигуру в открытый бинарный файл по частям: заголовок документа,
+    фрагмент с div и скриптом фигуры, завершение документа.
+    Полная HTML-страница целиком в памяти не собирается.
+    include_plotlyjs: "cdn" — ссылка на CDN; "directory" — на plotly.min.js
+    рядом с файлом (см. _ensure_plotlyjs). Фигура уже провалидирована при
+    построении, поэтому повторная проверка при сериализации отключена.
+    С orjson (и fast) фрагмент собирает _html_fragment, иначе — pio.to_html.
+    Быстрый путь читает внутренние атрибуты фигуры (проверено на plotly 6–7,
+    см. requirements.txt). Кадры кодируются уже во время записи, поэтому
+    TypeError на кадре поднимается из середины записи — файл целиком
+    переписывает _write_html_file.
+    """
+    parts = None
+    if fast and ORJSON_AVAILABLE and include_plotlyjs in ("cdn", "directory"):
+        try:
+            parts = _html_fragment(fig, config, include_plotlyjs)
+        except (TypeError, AttributeError):
+            # неизвестный тип значения или другая внутренняя структура фигуры —
+            # отдаём сериализацию Plotly (в файл ещё ничего не записано)
+            parts = None
+    if parts is None:
+        parts = [pio.to_html(fig, config=config, include_plotlyjs=include_plotlyjs, include_mathjax=False,
+                             full_html=False, validate=False).encode("utf-8")]
+    fh.write(_HTML_HEAD)
+    fh.writelines(parts)
+    fh.write(_HTML_TAIL)
 
-            base_fig.update(frames=frames)
+def _ensure_plotlyjs(directory: str) -> None:
+    """Однократно кладёт общий plotly.min.js в каталог для офлайн-просмотра HTML."""
+    path = os.path.join(directory, "plotly.min.js")
+    if not os.path.exists(path):
+        # Пишем под временным именем и атомарно переименовываем: оборванная
+        # запись не оставит «существующий» неполный plotly.min.js навсегда
+        part_path = _part_path(path)
+        try:
+            with open(part_path, "w", encoding="utf-8") as js:
+                js.write(get_plotlyjs())
+            os.replace(part_path, path)
+        finally:
+            _safe_unlink(part_path)
+
+def _plan_json_default(value):
+    """Сериализация не-JSON значений плана для хэша: массивы — полностью, не через repr."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+def _plan_key(plan: Dict[str, Any]) -> str:
+    """
+    Хэш содержимого плана: ключ кэша HTML и кэша подготовленных данных.
+    С orjson сериализация плана на порядок быстрее json.dumps — иначе хэш
+    большого плана стоил бы дороже самой подготовки траекторий.
+    """
+    data = None
+    if ORJSON_AVAILABLE:
+        try:
+            data = orjson.dumps(plan, default=_plan_json_default,
+                                option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        except TypeError:
+            data = None  # например, целые вне int64 — считаем через json
+    if data is None:
+        data = json.dumps(plan, sort_keys=True, default=_plan_json_default).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+# Версия формата кэша HTML: увеличивается при любом изменении генерируемой страницы,
+# чтобы после обновления кода не открывались записи, построенные старой версией
+_HTML_CACHE_VERSION = 1
+
+def _plan_files_stamp(plan: Dict[str, Any]) -> List[Tuple[str, Any, Any]]:
+    """(путь, mtime, размер) файлов меша робота и определения руки, на которые ссылается план."""
+    stamp = []
+    for name in ("robot_mesh", "hand_definition"):
+        cfg = plan.get(name)
+        path = cfg.get("path") if isinstance(cfg, dict) else None
+        if not isinstance(path, str):
+            continue
+        try:
+            st = os.stat(path)
+            stamp.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamp.append((path, None, None))
+    return stamp
+
+def _html_cache_path(plan: Dict[str, Any], visualization_type: str, key: str = None) -> str:
+    """
+    Путь к кэшированному HTML для плана: имя файла — хэш содержимого плана,
+    версии формата кэша и plotly.js и отметок файлов меша/руки, так что
+    неизменный план повторно не сериализуется, а правка файла модели или
+    обновление кода дают новую запись. key — уже посчитанный _plan_key(plan).
+    """
+    key = key or _plan_key(plan)
+    salt = json.dumps([key, _HTML_CACHE_VERSION, get_plotlyjs_version(), _plan_files_stamp(plan)])
+    key = hashlib.blake2b(salt.encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(tempfile.gettempdir(), "roboty_viz_cache", f"{visualization_type}_{key}.html.gz")
+
+# Подготовленные данные (_prepare) последних планов: GUI показывает один план
+# разными видами по очереди, и траектории не пересчитываются на каждый вид
+_PREPARED_CACHE_SIZE = 4
+_prepared_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_prepared_lock = threading.Lock()
+
+def _prepare_cached(plan: Dict[str, Any], key: str = None) -> Dict[str, Any]:
+    """_prepare(plan) с LRU-кэшем по хэшу плана; результат только читается."""
+    key = key or _plan_key(plan)
+    with _prepared_lock:
+        prepared = _prepared_cache.get(key)
+        if prepared is not None:
+            _prepared_cache.move_to_end(key)
+            return prepared
+    prepared = _prepare(plan)
+    with _prepared_lock:
+        _prepared_cache[key] = prepared
+        _prepared_cache.move_to_end(key)
+        while len(_prepared_cache) > _PREPARED_CACHE_SIZE:
+            _prepared_cache.popitem(last=False)
+    return prepared
+
+# Построенные фигуры последних планов по (хэш плана, вид, отметки файлов моделей).
+# Фигуры в кэше не меняются: наружу отдаются только копии
+_FIGURE_CACHE_SIZE = 8
+_figure_cache: "OrderedDict[Tuple, go.Figure]" = OrderedDict()
+_figure_lock = threading.Lock()
+
+def _figure_cached(key: Tuple, build) -> go.Figure:
+    """Фигура из LRU-кэша по key либо build(); результат только читается."""
+    with _figure_lock:
+        fig = _figure_cache.get(key)
+        if fig is not None:
+            _figure_cache.move_to_end(key)
+            return fig
+    fig = build()
+    with _figure_lock:
+        _figure_cache[key] = fig
+        _figure_cache.move_to_end(key)
+        while len(_figure_cache) > _FIGURE_CACHE_SIZE:
+            _figure_cache.popitem(last=False)
+    return fig
+
+def _build_figure(plan: Dict[str, Any], visualization_type: str, prepared: Dict[str, Any],
+                  progress_callback=None) -> go.Figure:
+    """Строит фигуру вида visualization_type по подготовленным данным плана."""
+    if visualization_type == "3d":
+        return create_3d_visualization(plan, prepared)
+    if visualization_type == "3d_desktop":
+        # Десктопная визуализация с точечным воспроизведением
+        plan["desktop_mode"] = True
+        return create_desktop_3d_visualization(plan, prepared)
+    if visualization_type.startswith("2d_"):
+        projection = visualization_type.split("_")[1]
+        return create_2d_projection(plan, projection, prepared)
+    if visualization_type == "time":
+        return create_time_analysis(plan, prepared)
+    if visualization_type == "3d_anim":
+        # Реал-тайм анимация с использованием кадров по времени
+        return create_3d_animation(plan, progress_callback, prepared)
+    raise ValueError(f"Неизвестный тип визуализации: {visualization_type}")
+
+def _part_path(path: str) -> str:
+    """Временное имя рядом с path для записи с атомарным os.replace (своё у каждого потока)."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+
+def _html_view_path(cache_path: str) -> str:
+    """
+    Страница для браузера по записи кэша: имя содержит хэш плана, так что
+    повторный показ того же плана открывает тот же файл (и кэш браузера).
+    """
+    return os.path.join(tempfile.gettempdir(), f"viz_{os.path.basename(cache_path)[:-len('.gz')]}")
+
+class _TeeWriter:
+    """Бинарный «файл», повторяющий каждую запись во все переданные файлы."""
+
+    def __init__(self, *files):
+        self._files = files
+
+    def write(self, data: bytes) -> None:
+        for f in self._files:
+            f.write(data)
+
+    def writelines(self, parts) -> None:
+        for part in parts:
+            self.write(part)
+
+def _open_cache_writer(cache_path: str):
+    """
+    gzip-поток записи HTML в кэш (уровень 1: дёшево по CPU, в разы меньше на диске).
+    Пишется во временное имя: _commit_cached_html атомарно переименует его,
+    так что читатель не увидит обрывка. Возвращает (поток, временный путь).
+    """
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    part_path = _part_path(cache_path)
+    return gzip.open(part_path, "wb", compresslevel=1), part_path
+
+def _commit_cached_html(dst, part_path: str, cache_path: str, ok: bool = True) -> None:
+    """Закрывает поток кэша; при ok публикует запись под cache_path, иначе удаляет обрывок."""
+    try:
+        dst.close()
+        if ok:
+            os.replace(part_path, cache_path)
+            _prune_html_cache(os.path.dirname(cache_path))
+            return
+    except OSError as cache_error:
+        logger.warning(f"Не удалось сохранить HTML в кэш: {cache_error}")
+    try:
+        os.unlink(part_path)
+    except OSError:
+        pass
+
+# Сколько последних записей держит кэш HTML (по времени последнего использования)
+_HTML_CACHE_KEEP = 50
+
+def _prune_html_cache(directory: str, keep: int = _HTML_CACHE_KEEP) -> None:
+    """
+    Оставляет в каталоге кэша keep самых свежих записей *.html.gz.
+    Один проход os.scandir: stat записей берётся из результатов обхода.
+    """
+    try:
+        with os.scandir(directory) as it:
+            entries = [(entry.stat().st_mtime, entry.path) for entry in it
+                       if entry.name.endswith(".html.gz") and entry.is_file()]
+    except OSError:
+        return
+    if len(entries) <= keep:
+        return
+    entries.sort(reverse=True)
+    for _, path in entries[keep:]:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+def _safe_unlink(path: str) -> None:
+    try:
+        if os.path.exists(path):
+            os.unlink(path)
+            logger.info(f"Временный файл визуализации удалён: {path}")
+    except Exception as e_del:
+        logger.warning(f"Не удалось удалить временный файл: {e_del}")
+
+class _TempFileJanitor:
+    """
+    Отложенное удаление временных файлов визуализации: один поток-демон на
+    процесс раз в interval секунд удаляет файлы старше ttl, вместо таймера и
+    обработчика atexit на каждый файл. Когда ждать больше нечего, поток
+    завершается и запускается снова при следующем add().
+    purge() без аргумента удаляет всё.
+    """
+
+    def __init__(self, ttl: float = 300.0, interval: float = 60.0):
+        self._ttl = ttl
+        self._interval = interval
+        self._deadlines: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, path: str) -> None:
+        with self._lock:
+            self._deadlines[path] = time.monotonic() + self._ttl
+            if self._thread is None:
+                # Демон не задерживает выход процесса: там сработает atexit
+                self._thread = threading.Thread(target=self._run, name="viz-tmp-janitor", daemon=True)
+                self._thread.start()
+
+    def purge(self, now: float = None) -> None:
+        """Удаляет файлы со сроком не позже now (без now — все зарегистрированные)."""
+        with self._lock:
+            expired = [path for path, deadline in self._deadlines.items() if now is None or deadline <= now]
+            for path in expired:
+                del self._deadlines[path]
+        for path in expired:
+            _safe_unlink(path)
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self._interval)
+            self.purge(time.monotonic())
+            with self._lock:
+                if not self._deadlines:
+                    self._thread = None
+                    return
+
+_tmp_janitor = _TempFileJanitor()
+atexit.register(_tmp_janitor.purge)
+
+def _schedule_unlink(path: str) -> None:
+    """План удаления временного файла: через 5–6 минут или на выходе процесса."""
+    _tmp_janitor.add(path)
+
+def _show_cached_html(cache_path: str, visualization_type: str, open_in_browser: bool) -> bool:
+    """
+    Открывает закэшированный HTML: страница плана (_html_view_path) ещё на
+    диске — как есть, иначе распаковывается из кэша под тем же именем.
+    Возвращает False, если кэша нет или его не удалось использовать.
+    """
+    try:
+        # Отметка использования: очистка кэша удаляет давно не открывавшиеся записи
+        os.utime(cache_path)
+    except OSError:
+        return False
+    view_path = _html_view_path(cache_path)
+    # Срок удаления страницы продлевается до проверки: очистка не удалит её из-под браузера
+    _schedule_unlink(view_path)
+    try:
+        os.utime(view_path)
+    except OSError:
+        part_path = _part_path(view_path)
+        try:
+            with gzip.open(cache_path, "rb") as src, open(part_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, _HTML_WRITE_BUFFER)
+            os.replace(part_path, view_path)
+        except (OSError, EOFError) as e:
+            logger.warning(f"Не удалось использовать кэш визуализации: {e}")
+            _safe_unlink(part_path)
+            return False
+    logger.info(f"Визуализация взята из кэша: {view_path}")
+    if open_in_browser:
+        _open_in_browser(view_path)
+    return True
+
+# Фоновая запись HTML; рабочие потоки пула дожидаются при выходе интерпретатора
+_io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="viz-io")
+
+def _write_html_file(fig: go.Figure, path: str, config: Dict[str, Any], include_plotlyjs: str = "cdn",
+                     cache_path: str = None) -> None:
+    """
+    Атомарно пишет страницу фигуры в path: кадры потоком уходят в
+    _part_path(path), который затем переименовывается. С cache_path в том же
+    проходе пишется сжатая запись кэша. Если быстрый путь падает на
+    сериализации посреди записи, обрывки удаляются и страница пишется заново
+    через pio.to_html — ни неполной страницы, ни неполной записи кэша.
+    """
+    for fast in (True, False):
+        part_path = _part_path(path)
+        # Кэш пишется сжатым в том же проходе, что и HTML, — без перечитывания файла
+        cache_file = cache_part = None
+        if cache_path:
+            try:
+                cache_file, cache_part = _open_cache_writer(cache_path)
+            except OSError as cache_error:
+                logger.warning(f"Не удалось сохранить HTML в кэш: {cache_error}")
+        written = False
+        try:
+            # Крупный буфер: заголовок, фрагмент и хвост уходят минимумом write(2)
+            with open(part_path, "wb", buffering=_HTML_WRITE_BUFFER) as out:
+                _write_html(fig, out if cache_file is None else _TeeWriter(out, cache_file),
+                            config, include_plotlyjs, fast=fast)
+            os.replace(part_path, path)
+            written = True
+        except (TypeError, AttributeError) as encode_error:
+            if not fast:
+                raise
+            logger.info(f"Быстрая сериализация HTML не удалась ({encode_error}), пишем через Plotly")
+        finally:
+            if not written:
+                _safe_unlink(part_path)
+            if cache_file is not None:
+                _commit_cached_html(cache_file, cache_part, cache_path, ok=written)
+        if written:
+            return
+
+def _publish_html(fig: go.Figure, visualization_type: str, plotly_config: Dict[str, Any],
+                  include_plotlyjs: str, cache_path: str, open_in_browser: bool) -> str:
+    """
+    Пишет фигуру во временный HTML, кладёт его в кэш и открывает в браузере.
+    Возвращает путь к временному файлу (удаляется по расписанию).
+    """
+    # С кэшем имя страницы — хэш плана, иначе — уникальное временное имя
+    if cache_path:
+        tmp_path = _html_view_path(cache_path)
+    else:
+        fd, tmp_path = tempfile.mkstemp(suffix=f"_viz_{visualization_type}.html")
+        os.close(fd)
+    _schedule_unlink(tmp_path)
+    _write_html_file(fig, tmp_path, plotly_config, include_plotlyjs, cache_path)
+    # Пытаемся открыть в браузере
+    opened = False
+    if open_in_browser:
+        try:
+            opened = _open_in_browser(tmp_path)
+        except Exception as browser_error:
+            logger.warning(f"Не удалось открыть в браузере: {browser_error}")
+            # Фолбэк: пробуем встроенный просмотрщик
+            try:
+                fig.show(config=plotly_config)
+            except Exception:
+                pass
+    logger.info(f"Визуализация записана во временный файл{' и открыта в браузере' if opened else ''}: {tmp_path}")
+    return tmp_path
+
+def _on_publish_done(fig: go.Figure, plotly_config: Dict[str, Any], progress_callback, future) -> None:
+    """
+    Завершение фоновой записи: успех — 100% прогресса; ошибка — как и раньше,
+    показываем фигуру напрямую без файла.
+    """
+    error = future.exception()
+    if error is None:
+        if callable(progress_callback):
+            try:
+                progress_callback(100)
+            except Exception:
+                pass
+        return
+    logger.error(f"Ошибка записи визуализации: {error}")
+    try:
+        fig.show(config=plotly_config)
+    except Exception as show_error:
+        logger.error(f"Не удалось отобразить визуализацию: {show_error}")
+
+def _browser_command(url: str, platform: str) -> List[str]:
+    """
+    Команда системного открывателя URL для платформы (sys.platform).
+    Windows здесь не поддерживается: там файл открывает os.startfile —
+    без разбора пути через cmd.exe, где ломаются &, ^ и % в имени профиля.
+    """
+    if platform == "darwin":
+        return ["open", url]
+    return ["xdg-open", url]
+
+def _headless(environ=None, platform: str = None) -> bool:
+    """
+    Нет смысла открывать браузер: CI, явный отказ (ROBOTY_NO_BROWSER=1) или
+    Linux без графической сессии — там webbrowser может выбрать текстовый
+    браузер и заблокировать процесс.
+    """
+    environ = os.environ if environ is None else environ
+    platform = sys.platform if platform is None else platform
+    if environ.get("CI") or environ.get("ROBOTY_NO_BROWSER") == "1":
+        return True
+    return platform.startswith("linux") and not (environ.get("DISPLAY") or environ.get("WAYLAND_DISPLAY"))
+
+def _open_in_browser(path: str) -> bool:
+    """
+    Открывает HTML-файл в браузере, не блокируя вызывающий поток:
+    системный открыватель запускается отдельным процессом без ожидания.
+    Если открывателя нет — запасной путь через webbrowser.open.
+    Возвращает False, если окружение без графики и браузер не открывался.
+    """
+    if _headless():
+        logger.info(f"Окружение без графики — браузер не открывается: {path}")
+        return False
+    # Абсолютный путь и корректный file:// URI (в т.ч. C:/ на Windows) — один раз
+    url = Path(path).absolute().as_uri()
+    try:
+        if sys.platform.startswith("win"):
+            # Ассоциация .html через ShellExecute, без командной строки
+            os.startfile(os.path.abspath(path))
+            return True
+        subprocess.Popen(_browser_command(url, sys.platform), stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+    except OSError:
+        webbrowser.open(url)
+    return True
+
+def show_visualization(plan: Dict[str, Any], visualization_type: str = "3d", progress_callback=None,
+                       prepared: Dict[str, Any] = None, open_in_browser: bool = True,
+                       return_figure: bool = False, background: bool = True):
+    """
+    Главная функция визуализации.
+    
+    Args:
+        plan: План выполнения
+        visualization_type: Тип визуализации ("3d", "2d_xy", "2d_xz", "2d_yz", "time")
+        prepared: Результат _prepare(plan) для повторного использования между вызовами
+        open_in_browser: Открывать ли записанный HTML в браузере (False — только файл)
+        return_figure: Для "3d_anim" из кэша HTML — всё же построить и вернуть фигуру
+        background: Для "3d_anim" с открытием в браузере — писать HTML в фоновом
+            потоке. Тогда функция возвращается до окончания записи: 100% прогресса
+            сообщается по её завершении, ошибка записи только логируется (и фигура
+            показывается напрямую). Возвращается копия фигуры, поэтому её можно
+            менять, пока запись идёт. False — запись в вызывающем потоке, ошибки поднимаются
+            как при open_in_browser=False (для рабочих потоков GUI)
+
+    Для "3d_anim" HTML кэшируется по хэшу плана (plan["html_cache"], по умолчанию
+    включено): при повторном показе того же плана сразу открывается готовая
+    страница, фигура не строится и возвращается None (с return_figure=True
+    фигура строится для возврата, но HTML повторно не пишется).
+    Без prepared подготовленные данные берутся из кэша по тому же хэшу,
+    так что смена вида не пересчитывает траектории. Построенные фигуры
+    кэшируются по хэшу плана, виду и отметкам файлов моделей: повторный
+    показ того же плана не строит фигуру заново, а возвращает её копию.
+    """
+    logger.info(f"Запуск визуализации типа: {visualization_type}")
+    
+    try:
+        use_html_cache = visualization_type == "3d_anim" and plan.get("html_cache", True)
+        # Хэш плана считается один раз для всех кэшей
+        plan_key = _plan_key(plan)
+        # Тот же план уже отрисовывался — отдаём готовый HTML без построения
+        cache_path = _html_cache_path(plan, visualization_type, plan_key) if use_html_cache else None
+        cache_hit = bool(cache_path) and _show_cached_html(cache_path, visualization_type, open_in_browser)
+        if cache_hit and not return_figure:
             if callable(progress_callback):
                 try:
-                    progress_callback(97)
+                    progress_callback(100)
                 except Exception:
                     pass
-            # Кнопки Play/Pause и слайдеры (время и скорость)
-            steps = []
-            for t in times:
-                label = f"t={t:.2f}"
-                steps.append({
-                    "method": "animate",
-                    "label": label,
-                    "args": [[f"{label}"], {"mode": "immediate", "frame": {"duration": 0, "redraw": True}, "transition": {"duration": 0}}]
-                })
-            base_fig.update_layout(
-                updatemenus=[
-                    {
-                        "type": "buttons",
-                        "showactive": True,
-                        "x": 0.02,
-                        "y": 0.95,
-                        "direction": "left",
-                        "pad": {"r": 10, "t": 5},
-                        "buttons": [
-                            {"label": "▶ Старт", "method": "animate", "args": [None, {"frame": {"duration": 80, "redraw": True}, "fromcurrent": True, "mode": "immediate"}]},
-                            {"label": "⏸ Пауза", "method": "animate", "args": [[None], {"frame": {"duration": 0, "redraw": False}, "mode": "immediate", "transition": {"duration": 0}}]},
-                        ]
-                    }
-                ],
-                # Первый слайдер — по времени
-                sliders=[{
-                    "active": 0,
-                    "currentvalue": {"prefix": "t=", "suffix": "", "visible": True},
-                    "pad": {"t": 30},
-                    "steps": steps,
-                    "x": 0.02,
-                    "y": 0.02
-                },
-                # Второй слайдер — скорость анимации (frame duration)
-                {
-                    "active": 3,
-                    "currentvalue": {"prefix": "Speed: ", "suffix": " ms/frame", "visible": True},
-                    "pad": {"t": 10},
-                    "steps": [
-                        {"label": "200", "method": "animate", "args": [None, {"frame": {"duration": 200, "redraw": True}, "fromcurrent": True, "mode": "immediate"}]},
-                        {"label": "120", "method": "animate", "args": [None, {"frame": {"duration": 120, "redraw": True}, "fromcurrent": True, "mode": "immediate"}]},
-                        {"label": "80",  "method": "animate", "args": [None, {"frame": {"duration": 80,  "redraw": True}, "fromcurrent": True, "mode": "immediate"}]},
-                        {"label": "60",  "method": "animate", "args": [None, {"frame": {"duration": 60,  "redraw": True}, "fromcurrent": True, "mode": "immediate"}]},
-                        {"label": "40",  "method": "animate", "args": [None, {"frame": {"duration": 40,  "redraw": True}, "fromcurrent": True, "mode": "immediate"}]},
-                        {"label": "20",  "method": "animate", "args": [None, {"frame": {"duration": 20,  "redraw": True}, "fromcurrent": True, "mode": "immediate"}]}
-                    ],
-                    "x": 0.02,
-                    "y": 0.08
-                }]
-            )
-
-            # Улучшаем UX легенды: явная подсказка и оформление
-            base_fig.update_layout(
-                legend_title_text="Robots (кликните для скрытия/показа)",
-                legend=dict(
-                    yanchor="top",
-                    y=0.99,
-                    xanchor="left",
-                    x=0.02,
-                    borderwidth=1,
-                    bgcolor="rgba(255,255,255,0.6)",
-                    itemclick="toggle",
-                    itemdoubleclick="toggleothers"
-                ),
-                annotations=[dict(
-                    text="Подсказка: кликайте по элементам легенды, чтобы скрыть/показать роботов",
-                    showarrow=False,
-                    xref="paper", yref="paper",
-                    x=0.35, y=1.06, xanchor="left", yanchor="bottom",
-                    font=dict(size=12, color="#555")
-                )]
-            )
-
-            fig = base_fig
-        else:
-            raise ValueError(f"Неизвестный тип визуализации: {visualization_type}")
+            return None
+        def build() -> go.Figure:
+            data = prepared
+            if data is None and (visualization_type in ("3d", "3d_desktop", "time", "3d_anim")
+                                 or visualization_type.startswith("2d_")):
+                data = _prepare_cached(plan, plan_key)
+            return _build_figure(plan, visualization_type, data, progress_callback)
+
+        # Фигура того же плана берётся из кэша; вызывающему — всегда копия,
+        # а закэшированный оригинал только читается (в т.ч. фоновой записью HTML)
+        fig = _figure_cached((plan_key, visualization_type, tuple(_plan_files_stamp(plan))), build)
+        
+        # Для простых типов визуализации возвращаем фигуру; страница из кэша уже открыта
+        if visualization_type != "3d_anim" or cache_hit:
+            if cache_hit and callable(progress_callback):
+                try:
+                    progress_callback(100)
+                except Exception:
+                    pass
+            return go.Figure(fig)
         
         # Открываем как раньше через HTML, но сохраняем во временный файл и удаляем его позже
         try:
-            import tempfile, os, atexit, threading, webbrowser
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=f"_viz_{visualization_type}.html")
-            tmp_path = tmp.name
-            tmp.close()
             plotly_config = {
                 "scrollZoom": True,
                 "displaylogo": False,
@@ -1278,47 +2790,28 @@ def show_visualization(plan: Dict[str, Any], visualization_type: str = "3d", pro
                     progress_callback(99)
                 except Exception:
                     pass
-            fig.write_html(tmp_path, auto_open=False, config=plotly_config, include_plotlyjs='cdn', full_html=True)
-            logger.info(f"Визуализация записана во временный файл: {tmp_path}")
-            # Пытаемся открыть в браузере
-            try:
-                webbrowser.open(f"file://{os.path.abspath(tmp_path)}")
-                logger.info("Визуализация открыта в браузере из временного файла")
-            except Exception as browser_error:
-                logger.warning(f"Не удалось открыть в браузере: {browser_error}")
-                # Фолбэк: пробуем встроенный просмотрщик
-                try:
-                    fig.show(config=plotly_config)
-                except Exception:
-                    pass
-
-            # План удаления: на выходе процесса и таймером через 5 минут
-            def _safe_unlink(path: str):
-                try:
-                    if os.path.exists(path):
-                        os.unlink(path)
-                        logger.info(f"Временный файл визуализации удалён: {path}")
-                except Exception as e_del:
-                    logger.warning(f"Не удалось удалить временный файл: {e_del}")
-
-            atexit.register(_safe_unlink, tmp_path)
-            threading.Timer(300.0, _safe_unlink, args=(tmp_path,)).start()
-
-            # Очищаем кэш мешей для освобождения памяти
-            try:
-                from core.mesh_loader import clear_mesh_cache
-                clear_mesh_cache()
-                logger.info("Кэш мешей очищен для освобождения памяти")
-            except ImportError:
-                pass
-
-            if callable(progress_callback):
-                try:
-                    progress_callback(100)
-                except Exception:
-                    pass
+            # Офлайн-режим: все файлы ссылаются на один plotly.min.js во временном каталоге
+            include_plotlyjs = "cdn"
+            if plan.get("offline_html", False):
+                _ensure_plotlyjs(tempfile.gettempdir())
+                include_plotlyjs = "directory"
+            publish_args = (fig, visualization_type, plotly_config, include_plotlyjs, cache_path, open_in_browser)
+            if open_in_browser and background:
+                # Запись и открытие — в фоне: поток GUI не ждёт диска и браузера;
+                # 100% — только когда страница действительно записана
+                future = _io_pool.submit(_publish_html, *publish_args)
+                future.add_done_callback(partial(_on_publish_done, fig, plotly_config, progress_callback))
+            else:
+                _publish_html(*publish_args)
+                if callable(progress_callback):
+                    try:
+                        progress_callback(100)
+                    except Exception:
+                        pass
         except Exception as err:
             logger.error(f"Ошибка показа визуализации: {err}")
+            if not open_in_browser:
+                raise
             # Последняя попытка — прямой показ без файла
             try:
                 fig.show(config=plotly_config)
@@ -1326,30 +2819,126 @@ def show_visualization(plan: Dict[str, Any], visualization_type: str = "3d", pro
                 logger.error(f"Не удалось отобразить визуализацию: {show_error}")
                 raise
         
-        # Возвращаем фигуру для дальнейшего использования
-        return fig
+        # Возвращаем копию фигуры: оригинал может ещё писаться в фоне
+        return go.Figure(fig)
         
     except Exception as e:
         logger.error(f"Ошибка при создании визуализации: {e}")
         raise
 
-def show_all_visualizations(plan: Dict[str, Any]):
+_VISUALIZATIONS = (
+    ("3d", "3D траектории"),
+    ("2d_xy", "2D проекция XY"),
+    ("2d_xz", "2D проекция XZ"),
+    ("2d_yz", "2D проекция YZ"),
+    ("time", "Анализ времени"),
+)
+
+
+def _build_visualization(plan: Dict[str, Any], viz_type: str, description: str, prepared=None):
+    """Строит одну фигуру без открытия браузера; None при ошибке (годится для пула процессов)."""
+    try:
+        logger.info(f"Создание визуализации: {description}")
+        return show_visualization(plan, viz_type, prepared=prepared, open_in_browser=False)
+    except Exception as e:
+        logger.error(f"Ошибка при создании {description}: {e}")
+        return None
+
+
+def _supported_viz_types(prepared: Dict[str, Any]) -> set:
+    """
+    Типы из _VISUALIZATIONS, которые имеет смысл строить по подготовленному плану:
+    без точек траекторий не строится ничего, анализ времени требует хотя бы
+    одной траектории с ненулевой длительностью.
+    """
+    trajs = [traj for traj in prepared["trajs"] if len(traj.xyzt)]
+    if not trajs:
+        return set()
+    supported = {viz_type for viz_type, _ in _VISUALIZATIONS} - {"time"}
+    if any(traj.ts[-1] > traj.ts[0] for traj in trajs):
+        supported.add("time")
+    return supported
+
+
+def _write_index(figs: Dict[str, go.Figure], offline: bool = False, stamp: str = None) -> str:
+    """
+    Пишет фигуры во временные HTML рядом с общей страницей index
+    (ленивые iframe) и возвращает путь к index — в браузере открывается одна вкладка.
+    stamp — общая метка времени пакета в именах всех его файлов.
+    """
+    if stamp is None:
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    directory = tempfile.gettempdir()
+    include_plotlyjs = "cdn"
+    if offline:
+        _ensure_plotlyjs(directory)
+        include_plotlyjs = "directory"
+    prefix = f"roboty_viz_{stamp}_{uuid.uuid4().hex[:6]}"
+    descriptions = dict(_VISUALIZATIONS)
+    items = []
+    for viz_type, fig in figs.items():
+        name = f"{prefix}_{viz_type}.html"
+        path = os.path.join(directory, name)
+        _write_html_file(fig, path, {"responsive": True, "displaylogo": False}, include_plotlyjs)
+        _schedule_unlink(path)
+        title = html.escape(descriptions.get(viz_type, viz_type))
+        items.append(f'<h2>{title}</h2>\n<iframe src="{name}" loading="lazy" '
+                     f'style="width:100%;height:600px;border:0"></iframe>')
+    index_path = os.path.join(directory, f"{prefix}_index.html")
+    with open(index_path, "wb") as fh:
+        fh.write(_HTML_HEAD)
+        fh.write("\n".join(items).encode("utf-8"))
+        fh.write(_HTML_TAIL)
+    _schedule_unlink(index_path)
+    return index_path
+
+
+def show_all_visualizations(plan: Dict[str, Any], open_index: bool = False) -> Dict[str, go.Figure]:
     """
     Показывает все доступные типы визуализации.
+    Фигуры строятся параллельно в пуле потоков, либо — при plan["process_pool"] —
+    в пуле процессов (spawn); браузер при этом не открывается.
+    open_index: записать фигуры и одну страницу index с ними и открыть только её.
+    Возвращает словарь {тип: фигура} для успешно построенных визуализаций.
     """
     logger.info("Запуск всех типов визуализации")
+    # Одна метка времени на весь пакет: его файлы группируются по общему префиксу
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     
-    visualizations = [
-        ("3d", "3D траектории"),
-        ("2d_xy", "2D проекция XY"),
-        ("2d_xz", "2D проекция XZ"),
-        ("2d_yz", "2D проекция YZ"),
-        ("time", "Анализ времени")
-    ]
+    # Общая подготовка траекторий — один раз и до запуска пула
+    prepared = _prepare(plan)
+    
+    # Заведомо пустые виды отсекаются до построения фигур
+    supported = _supported_viz_types(prepared)
+    visualizations = [item for item in _VISUALIZATIONS if item[0] in supported]
+    skipped = [viz_type for viz_type, _ in _VISUALIZATIONS if viz_type not in supported]
+    if skipped:
+        logger.info(f"Пропуск визуализаций без данных: {', '.join(skipped)}")
+    if not visualizations:
+        return {}
     
-    for viz_type, description in visualizations:
+    types = [viz_type for viz_type, _ in visualizations]
+    descriptions = [description for _, description in visualizations]
+    plans = [plan] * len(visualizations)
+    prepareds = [prepared] * len(visualizations)
+    
+    results = None
+    # Процессы обходят GIL при сборке фигур, но spawn каждый раз заново
+    # импортирует plotly/numpy — выигрыш только на очень тяжёлых планах
+    if plan.get("process_pool"):
         try:
-            logger.info(f"Создание визуализации: {description}")
-            show_visualization(plan, viz_type)
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=len(visualizations), mp_context=ctx) as executor:
+                results = list(executor.map(_build_visualization, plans, types, descriptions, prepareds))
         except Exception as e:
-            logger.error(f"Ошибка при создании {description}: {e}")
+            logger.warning(f"Пул процессов недоступен, используем потоки: {e}")
+            results = None
+    
+    if results is None:
+        with ThreadPoolExecutor(max_workers=len(visualizations)) as executor:
+            results = list(executor.map(_build_visualization, plans, types, descriptions, prepareds))
+    
+    figs = {viz_type: fig for viz_type, fig in zip(types, results) if fig is not None}
+    if open_index and figs:
+        _open_in_browser(_write_index(figs, plan.get("offline_html", False), stamp))
+    return figs